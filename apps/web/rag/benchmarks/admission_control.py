@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Exercise model-call admission control against the fake model backend.
+
+The fake model (utils/model_backends.py) sleeps for a log-normal latency and
+answers 429 once more than --upstream-rpm calls start within a minute, like
+the Gemini quota. A burst of interactive and batch callers is sent through
+llm_client.generate_content and the outcome per priority is reported along
+with the limiter's adapted concurrency: ok, 503 when shed by admission
+control, failed when retries ran out or the circuit breaker was open.
+
+Run from apps/web:
+    python -m rag.benchmarks.admission_control --interactive 50 --batch 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import collections
+import statistics
+import time
+from ..config import settings
+from ..utils import llm_client
+from ..utils.admission import AdmissionController, Overloaded, call_priority, BATCH, INTERACTIVE
+from ..utils.model_backends import FakeUpstreamError
+from ..utils.model_registry import model_registry
+from ..utils.resilience import UpstreamUnavailable
+
+async def call(model, priority: int, outcomes: dict):
+    start = time.perf_counter()
+    with call_priority(priority):
+        try:
+            await llm_client.generate_content(model, "ping")
+            outcome = "ok"
+        except Overloaded:
+            outcome = "503"
+        except UpstreamUnavailable:
+            # Retries exhausted (mostly on 429s) or the circuit breaker open
+            outcome = "failed"
+        except FakeUpstreamError as e:
+            outcome = str(e.code)
+    outcomes[priority].append((outcome, time.perf_counter() - start))
+
+def summarise(name: str, results: list):
+    counts = collections.Counter(outcome for outcome, _ in results)
+    latencies = sorted(latency for outcome, latency in results if outcome == "ok")
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+    median = statistics.median(latencies) if latencies else 0.0
+    print(f"{name:>12}: {len(results):>4} calls  ok {counts['ok']:>4}  503 {counts['503']:>4}  "
+          f"failed {counts['failed']:>4}  p50 {median:6.2f}s  p95 {p95:6.2f}s")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interactive", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake model median latency in seconds")
+    parser.add_argument("--sigma", type=float, default=0.2, help="Spread of the fake model's log-normal latency")
+    parser.add_argument("--upstream-rpm", type=int, default=0, help="Fake quota, 0 for unlimited")
+    parser.add_argument("--rate", type=int, default=600, help="Limiter calls per minute")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--queue-timeout", type=float, default=10.0)
+    parser.add_argument("--target-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    limiter = AdmissionController(
+        rate=args.rate / 60, burst=10, queue_size=args.queue_size, queue_timeout=args.queue_timeout,
+        initial_limit=4, min_limit=1, max_limit=64, target_latency=args.target_latency,
+    )
+    llm_client.admission = limiter
+    settings.MODEL_BACKEND = "fake"
+    settings.FAKE_MODEL_LATENCY = args.latency
+    settings.FAKE_MODEL_LATENCY_SIGMA = args.sigma
+    settings.FAKE_MODEL_RPM = args.upstream_rpm
+    model_registry.clear()
+    model = model_registry.get(settings.MODEL_NAME)
+    backend = model_registry.backend
+
+    outcomes = {INTERACTIVE: [], BATCH: []}
+    # Batch back-fill arrives first; interactive scans should still get through
+    calls = [call(model, BATCH, outcomes) for _ in range(args.batch)]
+    calls += [call(model, INTERACTIVE, outcomes) for _ in range(args.interactive)]
+    start = time.perf_counter()
+    await asyncio.gather(*calls)
+
+    print(f"Finished in {time.perf_counter() - start:.1f}s, peak upstream concurrency {backend.peak_in_flight}")
+    summarise("interactive", outcomes[INTERACTIVE])
+    summarise("batch", outcomes[BATCH])
+    print(f"Limiter: {limiter.stats()}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
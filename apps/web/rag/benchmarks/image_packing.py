@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark multi-image packing against one-image-per-call analysis.
+
+For each pack size, analyses every fixture image through
+FoodImageAnalyzer.analyze_food_images and reports images/sec, model calls
+and token cost per image (from Gemini's usage metadata). Pack size 1 is the
+one-at-a-time baseline. This calls the real model.
+
+Run from apps/web:
+    python -m rag.benchmarks.image_packing path/to/fixtures --pack-sizes 1,2,4,8
+"""
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from ..config import settings
+from ..food_image_analyzer import food_analyzer
+from ..utils import llm_client
+from .image_preprocess import load_fixtures
+
+async def run(images: list, size: int) -> dict:
+    settings.PACK_SIZE = size
+    before = dict(llm_client.token_usage)
+    start = time.perf_counter()
+    results = await food_analyzer.analyze_food_images(images)
+    elapsed = time.perf_counter() - start
+    used = {key: llm_client.token_usage[key] - before[key] for key in before}
+    return {
+        "elapsed": elapsed,
+        "succeeded": sum(1 for result in results if result["success"]),
+        **used,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("--pack-sizes", default="1,2,4,8")
+    parser.add_argument("--input-price", type=float, default=0.075, help="USD per 1M input tokens")
+    parser.add_argument("--output-price", type=float, default=0.30, help="USD per 1M output tokens")
+    args = parser.parse_args()
+
+    images, _ = load_fixtures(args.fixtures)
+    if not images:
+        raise SystemExit(f"No images found in {args.fixtures}")
+    images = list(images.values())
+    # Pack size is the variable under test, not the token budget
+    settings.PACK_MAX_OUTPUT_TOKENS = max(settings.PACK_MAX_OUTPUT_TOKENS, settings.PACK_TOKENS_PER_IMAGE * len(images))
+
+    print(f"📸 {len(images)} fixtures")
+    print(f"{'pack':>5} {'img/s':>7} {'calls':>6} {'ok':>5} {'in tok/img':>11} {'out tok/img':>12} {'USD/img':>10}")
+    for size in [int(s) for s in args.pack_sizes.split(",")]:
+        row = await run(images, size)
+        count = len(images)
+        cost = (row["prompt"] * args.input_price + row["output"] * args.output_price) / 1_000_000
+        print(f"{size:>5} {count / row['elapsed']:>7.2f} {row['calls']:>6} {row['succeeded']:>5}"
+              f" {row['prompt'] / count:>11.0f} {row['output'] / count:>12.0f} {cost / count:>10.6f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
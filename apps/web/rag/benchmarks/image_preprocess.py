@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Benchmark image preprocessing before vision inference.
+
+Reports bytes sent and preprocessing latency for each max-edge target. With
+--live it also runs the real analyzer to measure end-to-end latency and
+sanity-check accuracy against the fixture labels (or, for unlabelled
+fixtures, against the full-resolution result).
+
+Fixtures are a directory of food photos, optionally with a labels.json:
+    {"banana.jpg": {"foodName": "banana", "calories": 105}}
+
+Run from apps/web:
+    python -m rag.benchmarks.image_preprocess path/to/fixtures --targets 512,768,1024 --live
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+from ..config import settings
+from ..utils.preprocess import prepare_image
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+# Stand-in for "no downscaling" so the original resolution is the baseline
+FULL_RESOLUTION = 100_000
+
+def load_fixtures(directory: Path):
+    images = {
+        path.name: path.read_bytes()
+        for path in sorted(directory.iterdir())
+        if path.suffix.lower() in IMAGE_SUFFIXES
+    }
+    labels_path = directory / "labels.json"
+    labels = json.loads(labels_path.read_text()) if labels_path.exists() else {}
+    return images, labels
+
+def name_matches(expected: str, actual: str) -> bool:
+    expected_words = set(expected.lower().split())
+    return bool(expected_words & set(actual.lower().split()))
+
+def calorie_error(expected: float, actual: float) -> float:
+    return abs(actual - expected) / expected if expected else 0.0
+
+def measure_preprocessing(images: dict, target: int, image_format: str, quality: int) -> dict:
+    sizes, latencies = [], []
+    for data in images.values():
+        start = time.perf_counter()
+        blob = prepare_image(data, max_edge=target, image_format=image_format, quality=quality)
+        latencies.append(time.perf_counter() - start)
+        sizes.append(len(blob["data"]))
+    return {
+        "bytes_sent": statistics.mean(sizes),
+        "preprocess_ms": statistics.mean(latencies) * 1000,
+    }
+
+async def measure_live(images: dict, target: int) -> dict:
+    from ..food_image_analyzer import food_analyzer
+
+    settings.IMAGE_MAX_EDGE = target
+    results, latencies = {}, []
+    for name, data in images.items():
+        start = time.perf_counter()
+        result = await food_analyzer.analyze_food_image(data)
+        latencies.append(time.perf_counter() - start)
+        results[name] = result.get("data") if result["success"] else None
+    return {
+        "end_to_end_ms": statistics.mean(latencies) * 1000,
+        "results": results,
+    }
+
+def score(results: dict, references: dict) -> dict:
+    matched, errors, failures = 0, [], 0
+    for name, reference in references.items():
+        result = results.get(name)
+        if not result or not reference:
+            failures += 1
+            continue
+        if name_matches(reference["foodName"], result["foodName"]):
+            matched += 1
+        errors.append(calorie_error(float(reference["calories"]), float(result["calories"])))
+    return {
+        "name_match": matched / len(references) if references else 0.0,
+        "calorie_error": statistics.mean(errors) if errors else 0.0,
+        "failures": failures,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("fixtures", type=Path)
+    parser.add_argument("--targets", default="512,768,1024,1536", help="Comma-separated max-edge sizes")
+    parser.add_argument("--format", default=settings.IMAGE_FORMAT)
+    parser.add_argument("--quality", type=int, default=settings.IMAGE_QUALITY)
+    parser.add_argument("--live", action="store_true", help="Call Gemini for latency and accuracy")
+    args = parser.parse_args()
+
+    images, labels = load_fixtures(args.fixtures)
+    if not images:
+        raise SystemExit(f"No images found in {args.fixtures}")
+    targets = [FULL_RESOLUTION] + [int(t) for t in args.targets.split(",")]
+    settings.IMAGE_FORMAT = args.format
+    settings.IMAGE_QUALITY = args.quality
+
+    original_bytes = statistics.mean(len(data) for data in images.values())
+    print(f"📸 {len(images)} fixtures, mean original size {original_bytes / 1024:.1f} KiB")
+    header = f"{'target':>8} {'KiB sent':>10} {'prep ms':>9}"
+    if args.live:
+        header += f" {'e2e ms':>9} {'name ok':>8} {'kcal err':>9}"
+    print(header)
+
+    reference = labels
+    for target in targets:
+        row = measure_preprocessing(images, target, args.format, args.quality)
+        line = f"{'full' if target == FULL_RESOLUTION else target:>8} {row['bytes_sent'] / 1024:>10.1f} {row['preprocess_ms']:>9.1f}"
+        if args.live:
+            live = await measure_live(images, target)
+            if not reference:
+                # Unlabelled fixtures: the full-resolution answers are the reference
+                reference = live["results"]
+            accuracy = score(live["results"], reference)
+            line += (f" {live['end_to_end_ms']:>9.0f} {accuracy['name_match']:>8.0%}"
+                     f" {accuracy['calorie_error']:>9.1%}")
+            if accuracy["failures"]:
+                line += f"  ({accuracy['failures']} failed)"
+        print(line)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+In-process load test of the HTTP endpoints.
+
+Runs the FastAPI app inside this process behind httpx's ASGI transport, with
+the local fake model backend by default. It needs no server, network or API
+key. Each endpoint is driven at each concurrency level with distinct
+synthetic images, so every request misses the result cache. Throughput and
+p50/p95/p99 latency are reported per endpoint and level.
+
+Save a baseline and diff later runs against it:
+    python -m rag.benchmarks.load_test --save rag/benchmarks/load_test_baseline.json
+    python -m rag.benchmarks.load_test --compare rag/benchmarks/load_test_baseline.json --fail-on-regression
+
+Fake model behaviour is set with the RAG_FAKE_MODEL_* settings, e.g.
+RAG_FAKE_MODEL_ERROR_RATE=0.05. Run from apps/web.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+import httpx
+from PIL import Image, ImageDraw
+from ..config import settings
+
+ENDPOINTS = ["analyze-image-url", "analyze", "analyze-stream"]
+
+def make_image(index: int) -> bytes:
+    """
+    Small deterministic JPEG, different for every index
+    """
+    image = Image.new("RGB", (640, 480), ((index * 37) % 256, (index * 91) % 256, (index * 53) % 256))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((120 + index % 200, 80, 420 + index % 200, 380), fill=((index * 13) % 256, 200, 90))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+def serve_fixture(request: httpx.Request) -> httpx.Response:
+    # /images/<index>.jpg
+    index = int(request.url.path.rsplit("/", 1)[-1].split(".")[0])
+    return httpx.Response(200, content=make_image(index), headers={"content-type": "image/jpeg"})
+
+def profile_form(index: int) -> dict:
+    # Varying the profile keeps the advice cache from answering
+    return {
+        "age": str(20 + index % 50),
+        "current_weight": str(55 + index % 40),
+        "goal_weight": "65",
+        "health_goals": "Lose fat while keeping muscle",
+    }
+
+async def send(client: httpx.AsyncClient, endpoint: str, index: int) -> httpx.Response:
+    if endpoint == "analyze-image-url":
+        return await client.post("/analyze-image-url", json={"imageUrl": f"http://fixtures/images/{index}.jpg"})
+    files = {"file": (f"{index}.jpg", make_image(index), "image/jpeg")}
+    path = "/analyze" if endpoint == "analyze" else "/analyze/stream"
+    return await client.post(path, data=profile_form(index), files=files)
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def run_level(client, endpoint: str, concurrency: int, requests: int, indexes) -> dict:
+    latencies, statuses = [], {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for _ in remaining:
+            start = time.perf_counter()
+            try:
+                response = await send(client, endpoint, next(indexes))
+                status = response.status_code
+                # The SSE endpoint reports failures in-band
+                if status == 200 and endpoint == "analyze-stream" and "event: error" in response.text:
+                    status = "sse-error"
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "requests": requests,
+        "throughput": round(requests / elapsed, 2),
+        "p50": round(percentile(ordered, 0.50), 4),
+        "p95": round(percentile(ordered, 0.95), 4),
+        "p99": round(percentile(ordered, 0.99), 4),
+        "mean": round(statistics.mean(ordered), 4),
+        "errorRate": round(1 - statuses.get("200", 0) / requests, 4),
+        "statuses": statuses,
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Print the change against a saved baseline and return the regressions
+    """
+    regressions = []
+    print(f"\nCompared with baseline (tolerance {tolerance:.0%}):")
+    for endpoint, levels in results["results"].items():
+        for level, row in levels.items():
+            before = baseline.get("results", {}).get(endpoint, {}).get(level)
+            if not before:
+                continue
+            changes = {
+                "throughput": row["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0,
+                "p95": row["p95"] / before["p95"] - 1 if before["p95"] else 0.0,
+                "p99": row["p99"] / before["p99"] - 1 if before["p99"] else 0.0,
+            }
+            worse = [name for name, change in changes.items()
+                     if (change < -tolerance if name == "throughput" else change > tolerance)]
+            if row["errorRate"] > before["errorRate"] + 0.01:
+                worse.append("errorRate")
+            flag = "  REGRESSION: " + ", ".join(worse) if worse else ""
+            print(f"{endpoint:>18} c={level:<4} throughput {changes['throughput']:+7.1%}  "
+                  f"p95 {changes['p95']:+7.1%}  p99 {changes['p99']:+7.1%}{flag}")
+            if worse:
+                regressions.append((endpoint, level, worse))
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="fake", help="Model backend: fake (default) or gemini")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per endpoint and level")
+    parser.add_argument("--save", type=Path, help="Write results to this baseline file")
+    parser.add_argument("--compare", type=Path, help="Diff results against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Relative change counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    settings.MODEL_BACKEND = args.backend
+    from ..main import app
+    from ..utils import ingestion
+    from ..utils.model_registry import model_registry
+
+    model_registry.clear()
+    # Image URLs are answered locally instead of over the network
+    ingestion._http_client = httpx.AsyncClient(transport=httpx.MockTransport(serve_fixture))
+
+    endpoints = args.endpoints.split(",")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    indexes = itertools.count()
+    results = {
+        "backend": args.backend,
+        "fakeModel": {
+            "latency": settings.FAKE_MODEL_LATENCY,
+            "sigma": settings.FAKE_MODEL_LATENCY_SIGMA,
+            "errorRate": settings.FAKE_MODEL_ERROR_RATE,
+            "seed": settings.FAKE_MODEL_SEED,
+        },
+        "results": {},
+    }
+
+    print(f"{'endpoint':>18} {'conc':>5} {'req/s':>8} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>7}")
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+            for endpoint in endpoints:
+                for level in levels:
+                    row = await run_level(client, endpoint, level, args.requests, indexes)
+                    results["results"].setdefault(endpoint, {})[str(level)] = row
+                    print(f"{endpoint:>18} {level:>5} {row['throughput']:>8.2f} {row['p50']:>8.3f} "
+                          f"{row['p95']:>8.3f} {row['p99']:>8.3f} {row['errorRate']:>7.1%}")
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nSaved baseline to {args.save}")
+    if args.compare:
+        regressions = compare(results, json.loads(args.compare.read_text()), args.tolerance)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Worker startup time, measured the way `python -X importtime` reports it.
+
+Each run starts a fresh interpreter with the fake model backend and no
+GEMINI_API_KEY, so it also checks that the service boots keyless. Two times
+are reported, as medians over the runs:
+- import: `import rag.main`, from the importtime report;
+- boot: interpreter start to the first health check answered, including
+  the lifespan hook.
+The slowest imports of the last run are listed, and the run fails if any
+module in SLOW_IMPORTS was imported; those are only needed once an image
+is decoded or a real model is called.
+
+Save a baseline and diff later runs against it:
+    python -m rag.benchmarks.startup --save rag/benchmarks/startup_baseline.json
+    python -m rag.benchmarks.startup --compare rag/benchmarks/startup_baseline.json --fail-on-regression
+
+Run from apps/web.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Modules the fake-backend boot must not import (rag/tests/test_startup.py checks the same)
+SLOW_IMPORTS = ["google.generativeai", "google.ai.generativelanguage", "IPython", "PIL"]
+
+BOOT_SCRIPT = """
+import time
+from fastapi.testclient import TestClient
+from rag.main import app
+with TestClient(app) as client:
+    assert client.get("/").status_code == 200
+    print(time.time())
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def environment() -> dict:
+    env = {name: value for name, value in os.environ.items() if name != "GEMINI_API_KEY"}
+    env.update(RAG_MODEL_BACKEND="fake", PYTHONDONTWRITEBYTECODE="1")
+    return env
+
+def parse_importtime(report: str) -> dict:
+    """
+    Module -> (self, cumulative) microseconds
+    """
+    modules = {}
+    for line in report.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+def measure_import() -> dict:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import rag.main"],
+        env=environment(), capture_output=True, text=True
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"import rag.main failed:\n{process.stderr[-2000:]}")
+    return parse_importtime(process.stderr)
+
+def measure_boot() -> float:
+    started = time.time()
+    process = subprocess.run([sys.executable, "-c", BOOT_SCRIPT], env=environment(), capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Boot failed:\n{process.stderr[-2000:]}")
+    return float(process.stdout.strip().splitlines()[-1]) - started
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Print the change against a saved baseline and return the regressions
+    """
+    regressions = []
+    print(f"\nCompared with baseline (tolerance {tolerance:.0%}):")
+    for name in ["import", "boot"]:
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = results[name] / before - 1
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:>8} {before:.3f}s -> {results[name]:.3f}s {change:+7.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to list")
+    parser.add_argument("--save", type=Path, help="Write results to this baseline file")
+    parser.add_argument("--compare", type=Path, help="Diff results against this baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Relative slowdown counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    imports, boots = [], []
+    for _ in range(args.runs):
+        modules = measure_import()
+        imports.append(modules["rag.main"][1] / 1e6)
+        boots.append(measure_boot())
+    results = {
+        "runs": args.runs,
+        "import": round(statistics.median(imports), 4),
+        "boot": round(statistics.median(boots), 4),
+    }
+
+    print(f"{'cumulative s':>12} {'self s':>8}  module")
+    for name, (own, cumulative) in sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:args.top]:
+        print(f"{cumulative / 1e6:>12.3f} {own / 1e6:>8.3f}  {name}")
+    print(f"\nimport rag.main {results['import']:.3f}s, boot to first health check {results['boot']:.3f}s "
+          f"(median of {args.runs})")
+
+    failed = False
+    slow = [name for name in SLOW_IMPORTS if name in modules]
+    if slow:
+        print(f"\nImported at startup but only needed for real model calls: {', '.join(slow)}")
+        failed = True
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nSaved baseline to {args.save}")
+    if args.compare:
+        failed = bool(compare(results, json.loads(args.compare.read_text()), args.tolerance)) or failed
+    if failed and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
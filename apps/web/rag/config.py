@@ -7,15 +7,125 @@ load_dotenv()
 
 class Settings(BaseSettings):
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")  # Get from environment variable
+    LOG_LEVEL: str = "INFO"  # Level for the service's own loggers
+    PROMPT_LOG_SAMPLE_RATE: float = 0.01  # Share of rendered prompts logged at DEBUG level
+    METRICS_TRACING: bool = False  # Wrap pipeline stages in OpenTelemetry spans (needs opentelemetry)
     MODEL_NAME: str = "gemini-1.5-flash"  
+    MODEL_BACKEND: str = "gemini"  # gemini, or fake for offline runs and load tests
+    FAKE_MODEL_LATENCY: float = 0.8  # Fake backend median latency in seconds
+    FAKE_MODEL_LATENCY_SIGMA: float = 0.35  # Spread of the fake backend's log-normal latency
+    FAKE_MODEL_ERROR_RATE: float = 0.0  # Share of fake calls failing with 429/500/503
+    FAKE_MODEL_RPM: int = 0  # Fake upstream quota in calls per minute, answered with 429 beyond it; 0 for unlimited
+    FAKE_MODEL_SEED: int = 0  # Seed so fake latencies and errors repeat run to run
+    FAKE_MODEL_CANNED: str = ""  # Optional JSON file overriding the fake backend's canned answers
     MAX_TOKENS: int = 2048
     TEMPERATURE: float = 0.7
+    VISION_MAX_TOKENS: int = 1024  # Output budget for image analysis
+    VISION_TEMPERATURE: float = 0.3  # Lower temperature for consistent food analysis
+    MODEL_CONCURRENCY: int = 8  # Initial in-flight Gemini call limit per worker, adapted at runtime
+    MODEL_CONCURRENCY_MIN: int = 1  # Floor for the adaptive call limit
+    MODEL_CONCURRENCY_MAX: int = 64  # Ceiling for the adaptive call limit
+    MODEL_TARGET_LATENCY: float = 10.0  # Seconds; slower calls shrink the call limit
+    MODEL_RATE_LIMIT: int = 1000  # Model calls per minute allowed by the Gemini quota
+    MODEL_RATE_BURST: int = 20  # Calls that may start back to back before rate limiting applies
+    MODEL_QUEUE_SIZE: int = 256  # Callers waiting for a model slot before new ones get 503
+    MODEL_QUEUE_TIMEOUT: float = 30.0  # Seconds a caller waits for a slot before 503
+    REQUEST_TIMEOUT: float = 60.0  # Deadline for an interactive request; clients may lower it with X-Request-Timeout
+    BATCH_ITEM_TIMEOUT: float = 120.0  # Deadline for each image of a batch request
+    MODEL_RETRY_ATTEMPTS: int = 3  # Attempts per model call for retryable errors (429, 5xx, timeouts)
+    MODEL_RETRY_BASE_DELAY: float = 0.5  # Seconds; backoff doubles each retry, with full jitter
+    MODEL_RETRY_MAX_DELAY: float = 8.0  # Seconds; cap on a single backoff
+    MODEL_HEDGE_ENABLED: bool = True  # Send a second call when the first outlives the observed p95
+    MODEL_HEDGE_MIN_SAMPLES: int = 20  # Latencies observed before hedging starts
+    MODEL_HEDGE_BUDGET: float = 0.05  # Max hedges as a fraction of model calls
+    MODEL_BREAKER_THRESHOLD: int = 5  # Consecutive upstream failures that open the circuit breaker
+    MODEL_BREAKER_COOLDOWN: float = 30.0  # Seconds the breaker fails fast before probing again
+    DISCONNECT_POLL_INTERVAL: float = 0.5  # Seconds between client disconnect checks
+    RESULT_CACHE_SIZE: int = 1024  # Max analysis results kept in memory
+    RESULT_CACHE_TTL: int = 3600  # Seconds an in-memory result stays valid
+    RESULT_CACHE_DIR: str = ""  # Directory for the on-disk cache tier, empty disables it
+    RESULT_CACHE_DISK_TTL: int = 7 * 24 * 3600  # Seconds an on-disk result stays valid
+    NEAR_DUPLICATE_ENABLED: bool = True  # Reuse a user's recent analysis for a near-identical photo
+    NEAR_DUPLICATE_HASH: str = "phash"  # phash (robust to exposure/compression) or dhash (cheaper)
+    NEAR_DUPLICATE_THRESHOLD: int = 6  # Max differing bits of 64 for two photos to count as the same meal
+    NEAR_DUPLICATE_TTL: int = 3600  # Seconds a photo hash stays eligible for reuse
+    NEAR_DUPLICATE_PER_USER: int = 64  # Recent photo hashes kept per user
+    NEAR_DUPLICATE_MAX_USERS: int = 10000  # Users tracked before the least recently active is dropped
+    RETRIEVAL_ENABLED: bool = True  # Add retrieved nutrition notes and past analyses to advice prompts
+    RETRIEVAL_DIR: str = ""  # Directory for the memory-mapped vector indexes, one subdirectory per worker process; empty keeps them in memory
+    RETRIEVAL_TOP_K: int = 4  # Notes added to each advice prompt
+    RETRIEVAL_MIN_SCORE: float = 0.5  # Minimum cosine similarity for a note to be used
+    RETRIEVAL_INDEX: str = "flat"  # flat (exact) or ivfpq (approximate, for large indexes)
+    RETRIEVAL_IVF_LISTS: int = 64  # k-means lists in ivfpq mode
+    RETRIEVAL_IVF_PROBES: int = 8  # Lists scanned per query in ivfpq mode
+    RETRIEVAL_PQ_SUBVECTORS: int = 32  # Bytes per product-quantised vector in ivfpq mode
+    RETRIEVAL_IVF_MIN_ROWS: int = 50000  # Below this many rows ivfpq mode still searches flat
+    ANALYSIS_NOTES_MAX_ENTRIES: int = 20000  # Past analyses kept as notes, oldest replaced first
+    ANALYSIS_NOTES_TTL: int = 30 * 24 * 3600  # Seconds a past analysis stays eligible as a note
+    EMBEDDING_MODEL: str = "models/text-embedding-004"  # Gemini embedding model for retrieval
+    EMBEDDING_DIM: int = 768  # Embedding dimensions
+    SEMANTIC_CACHE_ENABLED: bool = True  # Answer near-identical advice requests from past advice
+    SEMANTIC_CACHE_THRESHOLD: float = 0.97  # Minimum cosine similarity for a semantic cache hit
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 5000  # Past advice texts kept, oldest replaced first
+    SEMANTIC_CACHE_TTL: int = 24 * 3600  # Seconds past advice stays eligible
+    RECOMMENDATION_BUCKETS: str = "age:5,weight:5,height:5,calories:100,protein:10,carbs:25,fat:10"  # Bucket width per profile/intake field; profiles in one bucket share recommendations
+    RECOMMENDATION_CACHE_SIZE: int = 2048  # Max bucketed recommendation results kept in memory
+    RECOMMENDATION_CACHE_TTL: int = 12 * 3600  # Seconds a bucket's recommendations stay valid
+    RECOMMENDATION_PREWARM_ENABLED: bool = False  # Regenerate the most requested buckets off-peak
+    RECOMMENDATION_PREWARM_HOURS: str = "2-6"  # Local hours (start-end, may wrap midnight) when pre-warming runs
+    RECOMMENDATION_PREWARM_TOP: int = 100  # Most requested buckets kept warm
+    RECOMMENDATION_PREWARM_INTERVAL: int = 900  # Seconds between pre-warm passes inside the window
+    INTAKE_LEDGER_PATH: str = ""  # SQLite file for per-user daily intake totals, may be shared by workers; empty keeps them in memory per worker
+    INTAKE_LEDGER_MAX_USERS: int = 20000  # Users held in memory before the least recently active is dropped (reloaded from SQLite on return)
+    INTAKE_FLUSH_INTERVAL: float = 5.0  # Seconds between write-behind flushes of changed day totals
+    JOB_DB_PATH: str = os.path.join(os.path.dirname(__file__), "data", "jobs.sqlite3")  # SQLite file for the analysis job queue, shared by workers; empty keeps jobs in memory (single worker only, lost on restart)
+    JOB_WORKERS: int = 4  # Jobs analysed concurrently per process
+    JOB_POLL_INTERVAL: float = 1.0  # Seconds idle workers wait before checking for jobs queued by other processes
+    JOB_TIMEOUT: float = 120.0  # Deadline for one job's analysis
+    JOB_LEASE: float = 300.0  # Seconds a job may stay running before it is presumed abandoned and requeued
+    JOB_MAX_ATTEMPTS: int = 3  # Abandoned runs before a job is failed
+    JOB_DEDUPE_TTL: int = 3600  # Seconds a succeeded job is returned for the same image and user
+    JOB_RETENTION: int = 24 * 3600  # Seconds finished jobs stay pollable
+    JOB_WEBHOOK_ALLOWED_HOSTS: str = ""  # Comma-separated callback hosts; when set, the only ones allowed (may be internal)
+    JOB_WEBHOOK_SECRET: str = ""  # HMAC-SHA256 key for the X-Signature header on callbacks; empty sends them unsigned
+    JOB_WEBHOOK_TIMEOUT: float = 10.0  # Seconds per callback attempt
+    JOB_WEBHOOK_ATTEMPTS: int = 3  # Callback attempts before giving up
+    ADVICE_CACHE_SIZE: int = 256  # Max finished advice texts kept in memory
+    ADVICE_CACHE_TTL: int = 3600  # Seconds cached advice stays valid
+    MAX_IMAGE_BYTES: int = 10 * 1024 * 1024  # Largest accepted image download/upload
+    IMAGE_DOWNLOAD_TIMEOUT: float = 30.0  # Seconds
+    IMAGE_DOWNLOAD_MAX_CONNECTIONS: int = 20  # Pooled connections for image downloads
+    IMAGE_MAX_EDGE: int = 1024  # Longest edge in pixels of images sent to the model
+    IMAGE_FORMAT: str = "JPEG"  # JPEG or WEBP re-encode before inference
+    IMAGE_QUALITY: int = 85  # Re-encode quality (1-100)
+    BATCH_MAX_ITEMS: int = 500  # Max images accepted by /analyze-images
+    BATCH_CONCURRENCY: int = 16  # Images downloaded/analysed at once per batch
+    PACK_SIZE: int = 4  # Max images per packed model call in batch mode, 1 disables packing
+    PACK_MAX_OUTPUT_TOKENS: int = 4096  # Output token budget for one packed call
+    PACK_TOKENS_PER_IMAGE: int = 512  # Expected output tokens per image result
+    PACK_LINGER: float = 0.05  # Seconds to wait for a pack to fill before sending it
+    STRUCTURED_OUTPUT: bool = True  # Ask Gemini for schema-constrained JSON
+    NUTRITION_LOOKUP: str = "fill"  # off, fill (override model numbers) or identify (cheaper prompt)
+    NUTRITION_MATCH_CUTOFF: float = 0.85  # Minimum fuzzy name similarity for a table match
+    PROMPT_CACHE_ENABLED: bool = True  # Upload static prefixes over PROMPT_CACHE_MIN_TOKENS as Gemini context caches; no current prompt is that large
+    PROMPT_CACHE_MIN_TOKENS: int = 32768  # Smallest static prefix worth caching (Gemini 1.5 minimum)
+    PROMPT_CACHE_TTL: int = 3600  # Seconds a context cache lives before it is recreated
+    PROXY_TARGET_URL: str = "http://localhost:8000"  # RAG service address used by the food.py proxy
+    PROXY_HTTP2: bool = True  # Negotiate HTTP/2 with the RAG service (needs h2, only over https)
+    PROXY_MAX_CONNECTIONS: int = 100  # Pooled connections to the RAG service
+    PROXY_MAX_KEEPALIVE_CONNECTIONS: int = 20  # Idle connections kept open for reuse
+    PROXY_KEEPALIVE_EXPIRY: float = 30.0  # Seconds an idle pooled connection stays open
+    PROXY_CONNECT_TIMEOUT: float = 5.0  # Seconds
+    PROXY_TIMEOUT: float = 60.0  # Seconds for each read/write/pool wait on a proxied request
+    SERVER_HOST: str = "0.0.0.0"  # start_server.py bind address
+    SERVER_PORT: int = 8000  # start_server.py port, the one PROXY_TARGET_URL and the web app call
+    SERVER_WORKERS: int = 0  # Worker processes in production mode, 0 for one per CPU (start_server.py passes the resolved count to the workers)
+    SERVER_PRELOAD: bool = False  # Import the app once before forking workers (needs gunicorn)
+    SERVER_BACKLOG: int = 2048  # Pending connections queued by the listening socket
+    SERVER_KEEPALIVE: int = 5  # Seconds an idle keep-alive connection stays open
+    SERVER_GRACEFUL_TIMEOUT: int = 30  # Seconds in-flight requests get to finish on shutdown
     
     class Config:
         env_prefix = "RAG_"
 
 settings = Settings()
-
-# Validate API key is present
-if not settings.GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY is not set in environment variables") 
\ No newline at end of file
@@ -1,30 +1,117 @@
-from fastapi import APIRouter, UploadFile, File, Form
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.responses import JSONResponse
 import httpx
+from .config import settings
 
-router = APIRouter()
+logger = logging.getLogger(__name__)
 
-RAG_SERVICE_URL = "http://localhost:8001"  # RAG service address
+CHUNK_SIZE = 64 * 1024
 
-@app.post("/api/food/analyze")
+_proxy_client: Optional[httpx.AsyncClient] = None
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def get_proxy_client() -> httpx.AsyncClient:
+    """
+    Return the pooled client used to forward requests to the RAG service,
+    creating it on first use. Connections are kept alive between requests.
+    """
+    global _proxy_client
+    if _proxy_client is None:
+        http2 = settings.PROXY_HTTP2 and _http2_available()
+        if settings.PROXY_HTTP2 and not http2:
+            logger.warning("PROXY_HTTP2 is set but the h2 package is missing, using HTTP/1.1")
+        _proxy_client = httpx.AsyncClient(
+            base_url=settings.PROXY_TARGET_URL,
+            http2=http2,
+            timeout=httpx.Timeout(settings.PROXY_TIMEOUT, connect=settings.PROXY_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=settings.PROXY_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.PROXY_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings.PROXY_KEEPALIVE_EXPIRY
+            )
+        )
+    return _proxy_client
+
+async def close_proxy_client():
+    global _proxy_client
+    if _proxy_client is not None:
+        await _proxy_client.aclose()
+        _proxy_client = None
+
+@asynccontextmanager
+async def lifespan(app):
+    # One client per worker, shared by every proxied request
+    get_proxy_client()
+    yield
+    await close_proxy_client()
+
+router = APIRouter(lifespan=lifespan)
+
+def _part_header(boundary: str, name: str, filename: str = None, content_type: str = None) -> bytes:
+    disposition = f'form-data; name="{name}"'
+    if filename is not None:
+        # Percent-encode quotes and newlines as browsers do
+        quoted = filename.replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+        disposition += f'; filename="{quoted}"'
+    header = f"--{boundary}\r\nContent-Disposition: {disposition}\r\n"
+    if content_type:
+        header += f"Content-Type: {content_type}\r\n"
+    return (header + "\r\n").encode()
+
+async def _multipart_body(boundary: str, fields: dict, file: UploadFile):
+    """
+    Encode the form as multipart/form-data, streaming the upload in chunks
+    instead of reading it into memory first
+    """
+    for name, value in fields.items():
+        yield _part_header(boundary, name) + str(value).encode() + b"\r\n"
+    yield _part_header(boundary, "file", file.filename or "upload", file.content_type or "application/octet-stream")
+    while chunk := await file.read(CHUNK_SIZE):
+        yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+@router.post("/api/food/analyze")
 async def analyze_food(
     file: UploadFile = File(...),
     age: int = Form(...),
     current_weight: float = Form(...),
     goal_weight: float = Form(...),
-    health_goals: str = Form(...)
+    health_goals: str = Form(...),
+    user_id: Optional[str] = Form(None)
 ):
-    async with httpx.AsyncClient() as client:
-        # Forward request to RAG service
-        form_data = {
-            "file": file.file,
-            "age": str(age),
-            "current_weight": str(current_weight),
-            "goal_weight": str(goal_weight),
-            "health_goals": health_goals
-        }
-        response = await client.post(
-            f"{RAG_SERVICE_URL}/analyze",
-            files={"file": (file.filename, file.file)},
-            data=form_data
+    # Forward request to RAG service
+    form_data = {
+        "age": age,
+        "current_weight": current_weight,
+        "goal_weight": goal_weight,
+        "health_goals": health_goals
+    }
+    if user_id is not None:
+        form_data["user_id"] = user_id
+    boundary = uuid.uuid4().hex
+    try:
+        response = await get_proxy_client().post(
+            "/analyze",
+            content=_multipart_body(boundary, form_data, file),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
         )
-        return response.json()
\ No newline at end of file
+    except httpx.TimeoutException as e:
+        raise HTTPException(status_code=504, detail=f"RAG service timed out: {str(e)}")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"RAG service unavailable: {str(e)}")
+    try:
+        content = response.json()
+    except ValueError:
+        # e.g. a plain-text 500 or an HTML error page from something in front of the service
+        content = {"detail": response.text}
+    return JSONResponse(content, status_code=response.status_code)
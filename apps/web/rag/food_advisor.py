@@ -1,42 +1,171 @@
-from .utils.llm_client import generate_response
+import logging
+from typing import Optional, Tuple
+import numpy as np
+from .config import settings
+from .prompts import PromptTemplate, prompt_registry
+from .retrieval import knowledge_base
+from .utils.llm_client import get_model
+from .utils.result_cache import ResultCache, content_key
+
+logger = logging.getLogger(__name__)
+
+# Finished advice keyed by prompt, shared by the streaming and non-streaming paths
+advice_cache = ResultCache(max_entries=settings.ADVICE_CACHE_SIZE, ttl_seconds=settings.ADVICE_CACHE_TTL)
+
+def summarise_food_analysis(food_analysis: Optional[dict]) -> str:
+    """
+    Compact text form of a FoodImageAnalyzer result for the advice prompt,
+    so the advisor sees the food without a second vision call
+    """
+    if not food_analysis:
+        return "No food analysis available."
+    nutrition = food_analysis.get('nutrition', {})
+    lines = [
+        f"Food: {food_analysis.get('foodName', 'Unknown Food')} "
+        f"(portion {food_analysis.get('portionSize', 'unknown')}, "
+        f"confidence {float(food_analysis.get('confidence', 0)):.2f})",
+        f"Calories: {food_analysis.get('calories', 0)}",
+        "Macros: " + ", ".join(
+            f"{name} {nutrition.get(name, 0)}g" for name in ['protein', 'carbs', 'fat', 'fiber', 'sugar']
+        ),
+    ]
+    if food_analysis.get('ingredients'):
+        lines.append("Ingredients: " + ", ".join(food_analysis['ingredients']))
+    return "\n".join(lines)
+
+ADVICE_PROMPT = prompt_registry.register(PromptTemplate("food_advice", "2", """
+        You are a nutritional expert AI that provides personalized food advice.
+        Analyze the food and provide recommendations based on the user's profile and health goals.
+
+        Given the user profile and food below, provide a detailed nutritional analysis and recommendations.
 
-class FoodAdvisor:
-    def __init__(self, user_profile: dict):
-        self.user_profile = user_profile
-        
-    async def get_recommendation(self, image_path: str) -> dict:
-        # Here you would add your image analysis logic
-        # For example, using Gemini's vision capabilities
-        
-        system_prompt = """You are a nutritional expert AI that provides personalized food advice. 
-        Analyze the food and provide recommendations based on the user's profile and health goals."""
-        
-        user_prompt = f"""
-        Given the following user profile, provide a detailed nutritional analysis and recommendations:
-        
-        User Profile:
-        - Age: {self.user_profile['age']}
-        - Current Weight: {self.user_profile['current_weight']} kg
-        - Current Fat Percentage: {self.user_profile['current_fat_percentage']} %
-        - Health Goals: {self.user_profile['health_goals']}
-        
         Please provide:
         1. Detailed nutritional analysis of the food
         2. Assessment of how this food aligns with the user's goals
         3. Specific recommendations or healthier alternatives if needed
         4. Portion size recommendations based on their goals
-        
+
+        Where the reference notes below are relevant, prefer their figures to rough estimates.
         Format your response in clear sections with bullet points where appropriate.
+        """, dynamic="""
+        User Profile:
+        - Age: {age}
+        - Current Weight: {current_weight} kg
+        - Current Fat Percentage: {current_fat_percentage} %
+        - Health Goals: {health_goals}
+
+        Food (from image analysis):
+        {food}
+
+        Reference notes:
+        {notes}
+        """))
+
+NO_NOTES = "None."
+
+class FoodAdvisor:
+    def __init__(self, user_profile: dict, user_id: Optional[str] = None):
+        self.user_profile = user_profile
+        # Scopes past advice and analysis notes to this user; without one only reference notes are used
+        self.user_id = user_id
+
+    def _prompt_values(self, food_analysis: Optional[dict]) -> dict:
+        return {
+            'age': self.user_profile['age'],
+            'current_weight': self.user_profile['current_weight'],
+            'current_fat_percentage': self.user_profile.get('current_fat_percentage', 'unknown'),
+            'health_goals': self.user_profile['health_goals'],
+            'food': summarise_food_analysis(food_analysis),
+        }
+
+    def _query(self, values: dict) -> str:
+        # The request without retrieved notes, which identifies it for caching
+        return ADVICE_PROMPT.render_dynamic(**{**values, "notes": ""})
+
+    def _version(self) -> str:
+        return f"{get_model().model_name}:{ADVICE_PROMPT.cache_version}"
+
+    def _cache_key(self, values: dict) -> str:
+        # Per user: the answer was grounded in that user's own notes and past advice
+        return content_key(f"{self.user_id or ''}\0{self._query(values)}".encode(), self._version())
+
+    async def _retrieve(self, values: dict) -> Tuple[Optional[str], dict, Optional[np.ndarray]]:
+        """
+        Past advice for a near-identical request if there is one; otherwise
+        the prompt values with retrieved notes, and the query embedding
+        """
+        if not settings.RETRIEVAL_ENABLED:
+            return None, {**values, "notes": NO_NOTES}, None
+        try:
+            # The whole request for the semantic cache, the food alone for notes
+            vector, food_vector = await knowledge_base.embed_queries([self._query(values), values['food']])
+            cached = await knowledge_base.find_advice(vector, self._version(), self.user_id)
+            if cached is not None:
+                return cached, values, vector
+            notes = await knowledge_base.retrieve(food_vector, user_id=self.user_id)
+        except Exception as e:
+            # Advice without notes beats no advice
+            logger.warning(f"Retrieval failed, advising without notes: {str(e)}")
+            return None, {**values, "notes": NO_NOTES}, None
+        return None, {**values, "notes": "\n".join(f"- {note}" for note in notes) or NO_NOTES}, vector
+
+    async def _remember(self, values: dict, vector: Optional[np.ndarray], recommendation: str):
+        if vector is not None:
+            await knowledge_base.add_advice(
+                self._query(values), vector, self._version(), recommendation, self.user_id
+            )
+
+    async def _generate(self, values: dict) -> str:
+        cached, values, vector = await self._retrieve(values)
+        if cached is not None:
+            return cached
+        response = await prompt_registry.generate(ADVICE_PROMPT.name, get_model(), values)
+        await self._remember(values, vector, response.text)
+        return response.text
+
+    async def get_recommendation(self, food_analysis: Optional[dict]) -> dict:
+        """
+        Advice for a food already analysed by FoodImageAnalyzer (one cheap text call)
         """
-        
-        # For debugging purposes, print to stderr which shows in console
-        import sys
-        print("System Prompt:", system_prompt, file=sys.stderr)
-        print("User Prompt:", user_prompt, file=sys.stderr)
-
-        recommendation = await generate_response(user_prompt, system_prompt)
-        
+        values = self._prompt_values(food_analysis)
+
+        recommendation = await advice_cache.get_or_compute(
+            self._cache_key(values),
+            lambda: self._generate(values),
+            should_cache=lambda text: text is not None
+        )
+
         return {
             "analysis": recommendation,
-            "image_path": image_path
-        } 
\ No newline at end of file
+            "food": food_analysis
+        }
+
+    async def stream_recommendation(self, food_analysis: Optional[dict]):
+        """
+        Yield the advice as text chunks as soon as Gemini produces them.
+        The completed answer is logged and cached so repeats are served whole.
+        """
+        values = self._prompt_values(food_analysis)
+        cache_key = self._cache_key(values)
+
+        cached = await advice_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        cached, values, vector = await self._retrieve(values)
+        if cached is not None:
+            yield cached
+            await advice_cache.set(cache_key, cached)
+            return
+
+        chunks = []
+        async for text in prompt_registry.stream(ADVICE_PROMPT.name, get_model(), values):
+            chunks.append(text)
+            yield text
+
+        recommendation = "".join(chunks)
+        logger.info(f"Streamed advice complete: {len(chunks)} chunks, {len(recommendation)} chars")
+        logger.debug(f"Streamed advice: {recommendation}")
+        await advice_cache.set(cache_key, recommendation)
+        await self._remember(values, vector, recommendation)
@@ -1,35 +1,35 @@
-import google.generativeai as genai
-from PIL import Image
+from fastapi import HTTPException
 from .config import settings
+from .nutrition import targets_for_profile
+from .nutrition_db import nutrition_db
+from .prompts import PromptTemplate, prompt_registry
+from .recommendation_cache import recommendation_cache
+from .utils.metrics import stage
+from .utils.model_registry import model_registry
+from .utils.preprocess import prepare_image_async, preprocess_version
+from .utils.structured_output import json_config, parse_json_response
+from .schemas import (
+    FoodAnalysis, FoodIdentification, NutritionEstimate, PackedFoodAnalysis, RecommendationAdvice
+)
+from typing import List, Optional, Union
+import asyncio
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-class FoodImageAnalyzer:
-    def __init__(self):
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            generation_config={
-                "temperature": 0.3,  # Lower temperature for more consistent food analysis
-                "max_output_tokens": 1024,
-            }
-        )
-
-    async def analyze_food_image(self, image_path: str) -> dict:
-        """
-        Analyze food image and return detailed nutrition information
-        """
-        try:
-            image = Image.open(image_path)
-            
-            # Enhanced prompt for food analysis
-            prompt = """
-            You are a professional nutritionist and food expert. Analyze this food image and provide detailed information.
+def get_vision_model():
+    """
+    Shared image analysis model configured from settings
+    """
+    return model_registry.get(
+        settings.MODEL_NAME,
+        temperature=settings.VISION_TEMPERATURE,
+        max_output_tokens=settings.VISION_MAX_TOKENS
+    )
 
-            Return ONLY a valid JSON object with this exact structure:
-            {
+# Shared by the single-image and packed prompts
+RESULT_SCHEMA = """{
                 "foodName": "specific name of the food/dish",
                 "calories": estimated calories as a number,
                 "confidence": confidence score from 0.0 to 1.0,
@@ -45,8 +45,9 @@ class FoodImageAnalyzer:
                 "mealType": "breakfast/lunch/dinner/snack",
                 "healthScore": score from 1-10 (10 being healthiest),
                 "tips": ["helpful", "nutrition", "tips"]
-            }
+            }"""
 
+ANALYSIS_GUIDELINES = """
             Important guidelines:
             - Be as accurate as possible with calorie and nutrition estimates
             - Consider typical serving sizes
@@ -55,29 +56,209 @@ class FoodImageAnalyzer:
             - Estimate based on what you can see in the image
             """
 
-            response = self.model.generate_content([prompt, image])
+# Enhanced prompt for food analysis
+ANALYSIS_PROMPT = prompt_registry.register(PromptTemplate("food_analysis", "1", f"""
+            You are a professional nutritionist and food expert. Analyze this food image and provide detailed information.
+
+            Return ONLY a valid JSON object with this exact structure:
+            {RESULT_SCHEMA}
+{ANALYSIS_GUIDELINES}"""))
+
+PACKED_ANALYSIS_PROMPT = prompt_registry.register(PromptTemplate("food_analysis_packed", "1", f"""
+            You are a professional nutritionist and food expert. You will be given several food images,
+            each preceded by its label "Image <index>:". Analyze every image independently.
+
+            Return ONLY a valid JSON array with exactly one object per image, in any order.
+            Each object must include "index" (the image label number) plus this exact structure:
+            {RESULT_SCHEMA}
+{ANALYSIS_GUIDELINES}""", dynamic="""
+            There are {count} images.
+            """))
+
+# Cheaper prompt used when the local nutrition table fills in the numbers
+IDENTIFY_PROMPT = prompt_registry.register(PromptTemplate("food_identify", "1", """
+            You are a professional nutritionist and food expert. Identify the food in this image.
+
+            Return ONLY a valid JSON object with this exact structure:
+            {
+                "foodName": "specific name of the food/dish",
+                "confidence": confidence score from 0.0 to 1.0,
+                "portionSize": "estimated portion size (e.g., '150g', '1 cup', '1 medium')",
+                "portionGrams": estimated portion weight in grams as a number,
+                "mealType": "breakfast/lunch/dinner/snack"
+            }
+
+            If you can't identify the food clearly, set confidence below 0.5.
+            """))
+
+# Text-only follow-up for identified foods that aren't in the local table
+ESTIMATE_PROMPT = prompt_registry.register(PromptTemplate("nutrition_estimate", "1", """
+            You are a professional nutritionist. Estimate the nutrition of the food portion below.
+
+            Return ONLY a valid JSON object with this exact structure:
+            {
+                "calories": estimated calories as a number,
+                "nutrition": {
+                    "protein": grams of protein,
+                    "carbs": grams of carbohydrates,
+                    "fat": grams of fat,
+                    "fiber": grams of fiber,
+                    "sugar": grams of sugar
+                }
+            }
+            """, dynamic="""
+            Food: {portion} of {food}
+            """))
+
+RECOMMENDATIONS_PROMPT = prompt_registry.register(PromptTemplate("food_recommendations", "1", """
+            Based on the user profile, daily targets and current nutrition intake below, provide personalized food recommendations.
+
+            Return ONLY a valid JSON object:
+            {
+                "recommendations": [
+                    {
+                        "food": "food name",
+                        "reason": "why this food is recommended",
+                        "calories": estimated calories,
+                        "mealType": "breakfast/lunch/dinner/snack"
+                    }
+                ],
+                "tips": ["personalized nutrition tips"]
+            }
+            """, dynamic="""
+            User Profile:
+            - Age: {age} years
+            - Weight: {weight} kg
+            - Height: {height} cm
+            - Goal: {goal}
+            - Activity Level: {activity_level}
+            - Gender: {gender}
+
+            Daily Targets:
+            - Calories: {targets[calories]}
+            - Protein: {targets[protein]}g
+            - Carbs: {targets[carbs]}g
+            - Fat: {targets[fat]}g
+
+            Current Daily Intake:
+            - Calories: {current[calories]}
+            - Protein: {current[protein]}g
+            - Carbs: {current[carbs]}g
+            - Fat: {current[fat]}g
+
+            Remaining Today:
+            - Calories: {remaining[calories]:.0f}
+            - Protein: {remaining[protein]:.0f}g
+            - Carbs: {remaining[carbs]:.0f}g
+            - Fat: {remaining[fat]:.0f}g
+            """))
+
+# Built-in list, not typing.List: the SDK's schema conversion rejects typing generics
+PACKED_SCHEMA = list[PackedFoodAnalysis]
+
+# Every prompt whose output can end up in the analysis result cache
+IMAGE_ANALYSIS_PROMPTS = [ANALYSIS_PROMPT, PACKED_ANALYSIS_PROMPT, IDENTIFY_PROMPT, ESTIMATE_PROMPT]
+
+def fill_from_database(result: dict) -> bool:
+    """
+    Replace model-estimated calories and nutrition with exact values from the
+    local nutrition table when the food and portion can be resolved. A food
+    that only resembles a table entry ("sweet potato fries") keeps the
+    model's values, with the entry reported as similarFood.
+    """
+    with stage("nutrition_lookup"):
+        match = nutrition_db.lookup(result['foodName'], result['portionSize'], result.get('portionGrams'))
+    if match is None or match['matchScore'] < 1.0:
+        if match is not None:
+            result['similarFood'] = match['matchedFood']
+        result['nutritionSource'] = 'model'
+        return False
+    result['calories'] = match['calories']
+    result['nutrition'] = match['nutrition']
+    result['matchedFood'] = match['matchedFood']
+    result['nutritionSource'] = 'database'
+    return True
+
+def normalise_result(result: dict) -> dict:
+    """
+    Validate a parsed analysis result and fill in optional fields
+    """
+    # Validate required fields
+    required_fields = ['foodName', 'calories', 'confidence', 'nutrition', 'portionSize']
+    for field in required_fields:
+        if field not in result:
+            raise ValueError(f"Missing required field: {field}")
+    
+    # Ensure nutrition has required subfields
+    nutrition_fields = ['protein', 'carbs', 'fat', 'fiber', 'sugar']
+    for field in nutrition_fields:
+        if field not in result['nutrition']:
+            result['nutrition'][field] = 0
+    
+    # Add default values if missing
+    result.setdefault('ingredients', [])
+    result.setdefault('mealType', 'unknown')
+    result.setdefault('healthScore', 5)
+    result.setdefault('tips', [])
+    return result
+
+def get_packed_vision_model():
+    """
+    Image analysis model whose output budget covers a whole pack of results
+    """
+    return model_registry.get(
+        settings.MODEL_NAME,
+        temperature=settings.VISION_TEMPERATURE,
+        max_output_tokens=settings.PACK_MAX_OUTPUT_TOKENS
+    )
+
+def pack_size() -> int:
+    """
+    Images per packed call: PACK_SIZE, capped so every result fits the output token budget
+    """
+    return max(1, min(settings.PACK_SIZE, settings.PACK_MAX_OUTPUT_TOKENS // settings.PACK_TOKENS_PER_IMAGE))
+
+class FoodImageAnalyzer:
+    @property
+    def model(self):
+        return get_vision_model()
+
+    @property
+    def cache_version(self) -> str:
+        """
+        Identifies the model and prompt that produced an analysis result
+        """
+        prompts = "+".join(prompt.cache_version for prompt in IMAGE_ANALYSIS_PROMPTS)
+        return f"{self.model.model_name}:{prompts}:{preprocess_version()}:{settings.NUTRITION_LOOKUP}"
+
+    @property
+    def recommendations_version(self) -> str:
+        return f"{self.model.model_name}:{RECOMMENDATIONS_PROMPT.cache_version}"
+
+    async def analyze_food_image(self, image_data: Union[bytes, dict]) -> dict:
+        """
+        Analyze food image and return detailed nutrition information.
+        image_data may be raw bytes or an image already prepared for the model.
+        """
+        try:
+            # Downscale and re-encode before upload to cut bytes sent and tokens
+            image = await prepare_image_async(image_data)
+
+            if settings.NUTRITION_LOOKUP == "identify":
+                return await self._identify_food_image(image)
+
+            response = await prompt_registry.generate(
+                ANALYSIS_PROMPT.name, self.model, attachments=[image],
+                generation_config=json_config(FoodAnalysis)
+            )
             
             # Parse the JSON response
             try:
-                result = json.loads(response.text.strip())
-                
-                # Validate required fields
-                required_fields = ['foodName', 'calories', 'confidence', 'nutrition', 'portionSize']
-                for field in required_fields:
-                    if field not in result:
-                        raise ValueError(f"Missing required field: {field}")
-                
-                # Ensure nutrition has required subfields
-                nutrition_fields = ['protein', 'carbs', 'fat', 'fiber', 'sugar']
-                for field in nutrition_fields:
-                    if field not in result['nutrition']:
-                        result['nutrition'][field] = 0
-                
-                # Add default values if missing
-                result.setdefault('ingredients', [])
-                result.setdefault('mealType', 'unknown')
-                result.setdefault('healthScore', 5)
-                result.setdefault('tips', [])
+                result = normalise_result(
+                    await parse_json_response(self.model, response.text, FoodAnalysis)
+                )
+                if settings.NUTRITION_LOOKUP == "fill":
+                    fill_from_database(result)
                 
                 return {
                     'success': True,
@@ -92,6 +273,8 @@ class FoodImageAnalyzer:
                     'raw_response': response.text
                 }
                 
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error analyzing food image: {str(e)}")
             return {
@@ -99,56 +282,136 @@ class FoodImageAnalyzer:
                 'error': str(e)
             }
 
-    async def get_food_recommendations(self, user_profile: dict, current_nutrition: dict) -> dict:
+    async def _identify_food_image(self, image: dict) -> dict:
         """
-        Generate personalized food recommendations based on user profile and current intake
+        Identify the food with the cheaper prompt and resolve its nutrition
+        locally, falling back to a text-only estimate for unknown foods
         """
+        response = await prompt_registry.generate(
+            IDENTIFY_PROMPT.name, self.model, attachments=[image],
+            generation_config=json_config(FoodIdentification)
+        )
         try:
-            prompt = f"""
-            Based on the user profile and current nutrition intake, provide personalized food recommendations.
+            result = await parse_json_response(self.model, response.text, FoodIdentification)
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse JSON response: {response.text}")
+            return {
+                'success': False,
+                'error': 'Failed to parse AI response',
+                'raw_response': response.text
+            }
 
-            User Profile:
-            - Age: {user_profile.get('age')} years
-            - Weight: {user_profile.get('weight')} kg
-            - Height: {user_profile.get('height')} cm
-            - Goal: {user_profile.get('goal')}
-            - Activity Level: {user_profile.get('activity_level')}
-            - Gender: {user_profile.get('gender')}
+        for field in ['foodName', 'portionSize']:
+            if field not in result:
+                raise ValueError(f"Missing required field: {field}")
 
-            Current Daily Intake:
-            - Calories: {current_nutrition.get('calories', 0)}
-            - Protein: {current_nutrition.get('protein', 0)}g
-            - Carbs: {current_nutrition.get('carbs', 0)}g
-            - Fat: {current_nutrition.get('fat', 0)}g
+        if not fill_from_database(result):
+            response = await prompt_registry.generate(
+                ESTIMATE_PROMPT.name, self.model,
+                {'food': result['foodName'], 'portion': result['portionSize']},
+                generation_config=json_config(NutritionEstimate)
+            )
+            result.update(await parse_json_response(self.model, response.text, NutritionEstimate))
 
-            Return ONLY a valid JSON object:
-            {
-                "recommendations": [
-                    {
-                        "food": "food name",
-                        "reason": "why this food is recommended",
-                        "calories": estimated calories,
-                        "mealType": "breakfast/lunch/dinner/snack"
-                    }
-                ],
-                "dailyTargets": {
-                    "calories": target calories,
-                    "protein": target protein in grams,
-                    "carbs": target carbs in grams,
-                    "fat": target fat in grams
-                },
-                "tips": ["personalized nutrition tips"]
-            }
-            """
+        return {
+            'success': True,
+            'data': normalise_result(result)
+        }
 
-            response = self.model.generate_content(prompt)
-            result = json.loads(response.text.strip())
-            
+    async def analyze_food_images(self, images: List[bytes]) -> List[dict]:
+        """
+        Analyze several food images, packing up to pack_size() of them into
+        each model call. Any image whose packed result is missing or invalid
+        falls back to its own single-image call. Results keep input order.
+        """
+        size = pack_size()
+        packs = [list(range(start, min(start + size, len(images)))) for start in range(0, len(images), size)]
+        packed_results = await asyncio.gather(
+            *(self._analyze_pack([images[i] for i in pack]) for pack in packs)
+        )
+
+        results: List[Optional[dict]] = [None] * len(images)
+        for pack, pack_results in zip(packs, packed_results):
+            for offset, result in enumerate(pack_results):
+                results[pack[offset]] = result
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            logger.info(f"Packed analysis fell back to single calls for {len(missing)} of {len(images)} images")
+            fallbacks = await asyncio.gather(*(self.analyze_food_image(images[i]) for i in missing))
+            for i, result in zip(missing, fallbacks):
+                results[i] = result
+        return results
+
+    async def _analyze_pack(self, images: List[bytes]) -> List[Optional[dict]]:
+        """
+        One multimodal call for a pack of images. Returns a result per image,
+        or None where the model's answer for that image was unusable.
+        """
+        if len(images) == 1:
+            return [await self.analyze_food_image(images[0])]
+
+        try:
+            prepared = await asyncio.gather(*(prepare_image_async(image_data) for image_data in images))
+            attachments = []
+            for index, image in enumerate(prepared):
+                attachments += [f"Image {index}:", image]
+        except Exception as e:
+            # An undecodable image gets its own call, which reports the error for that image alone
+            logger.warning(f"Packed analysis of {len(images)} images skipped: {str(e)}")
+            return [None] * len(images)
+
+        try:
+            model = get_packed_vision_model()
+            response = await prompt_registry.generate(
+                PACKED_ANALYSIS_PROMPT.name, model, {'count': len(images)}, attachments,
+                generation_config=json_config(PACKED_SCHEMA)
+            )
+            parsed = await parse_json_response(model, response.text, PACKED_SCHEMA)
+        except HTTPException:
+            # Overload, deadline or upstream outage: retrying each image on its own won't help
+            raise
+        except Exception as e:
+            # Only an unusable answer (unparseable or blocked) or an API rejection of the pack
+            # falls back to single calls; anything else is a bug and should surface
+            if not isinstance(e, ValueError) and getattr(e, "code", None) is None:
+                raise
+            logger.warning(f"Packed analysis of {len(images)} images failed: {str(e)}")
+            return [None] * len(images)
+
+        results: List[Optional[dict]] = [None] * len(images)
+        for item in parsed if isinstance(parsed, list) else []:
+            try:
+                index = int(item.pop('index'))
+                if 0 <= index < len(images) and results[index] is None:
+                    result = normalise_result(item)
+                    if settings.NUTRITION_LOOKUP != "off":
+                        fill_from_database(result)
+                    results[index] = {'success': True, 'data': result}
+            except (AttributeError, KeyError, TypeError, ValueError):
+                continue
+        return results
+
+    async def get_food_recommendations(self, user_profile: dict, current_nutrition: dict) -> dict:
+        """
+        Generate personalized food recommendations based on user profile and current intake.
+        Daily targets are computed locally; the model only writes the free-text advice,
+        which is shared by users with similar profiles and intake (see recommendation_cache).
+        """
+        try:
+            daily_targets = targets_for_profile(user_profile)
+            result = await recommendation_cache.get_or_compute(
+                user_profile, current_nutrition, self.recommendations_version, self.generate_recommendations
+            )
+            if not result['success']:
+                return result
             return {
                 'success': True,
-                'data': result
+                'data': {**result['data'], 'dailyTargets': daily_targets}
             }
             
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Error generating recommendations: {str(e)}")
             return {
@@ -156,5 +419,83 @@ class FoodImageAnalyzer:
                 'error': str(e)
             }
 
+    async def generate_recommendations(self, user_profile: dict, current_nutrition: dict) -> dict:
+        """
+        Model recommendations for a (bucketed) profile and intake. Errors propagate.
+        """
+        daily_targets = targets_for_profile(user_profile)
+        remaining = {
+            name: target - float(current_nutrition.get(name, 0) or 0)
+            for name, target in daily_targets.items()
+        }
+
+        values = {
+            field: user_profile.get(field)
+            for field in ['age', 'weight', 'height', 'goal', 'activity_level', 'gender']
+        }
+        values['targets'] = daily_targets
+        values['current'] = {name: current_nutrition.get(name, 0) for name in daily_targets}
+        values['remaining'] = remaining
+
+        response = await prompt_registry.generate(
+            RECOMMENDATIONS_PROMPT.name, self.model, values,
+            generation_config=json_config(RecommendationAdvice)
+        )
+        result = await parse_json_response(self.model, response.text, RecommendationAdvice)
+        return {
+            'success': True,
+            'data': result
+        }
+
+class ImagePacker:
+    """
+    Collects images submitted concurrently (e.g. by a batch request) and
+    analyses them together through FoodImageAnalyzer.analyze_food_images
+    """
+    def __init__(self, analyzer: "FoodImageAnalyzer", linger: float = None):
+        self.analyzer = analyzer
+        self.linger = settings.PACK_LINGER if linger is None else linger
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def analyze_food_image(self, image_data: Union[bytes, dict]) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image_data, future))
+        if len(self._pending) >= pack_size():
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Waiters cancelled while the pack filled are left out
+        pending = [(image_data, future) for image_data, future in self._pending if not future.done()]
+        self._pending = []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            for _, future in pending:
+                future.add_done_callback(lambda _, pending=pending, task=task: self._abandon(pending, task))
+
+    @staticmethod
+    def _abandon(pending: List[tuple], task: asyncio.Task):
+        # Every waiter was cancelled (e.g. the clients disconnected): stop the model call
+        if all(future.cancelled() for _, future in pending):
+            task.cancel()
+
+    async def _run(self, pending: List[tuple]):
+        try:
+            results = await self.analyzer.analyze_food_images([image_data for image_data, _ in pending])
+        except Exception as e:
+            results = [{'success': False, 'error': str(e)}] * len(pending)
+        for (_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+
 # Global instance
 food_analyzer = FoodImageAnalyzer()
\ No newline at end of file
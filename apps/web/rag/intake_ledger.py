@@ -0,0 +1,277 @@
+"""
+Per-user daily intake totals, kept server-side as meals are analysed.
+
+Each tracked user owns one slot in a float32 array of shape
+(users, WINDOW_DAYS, columns): a ring of day rows indexed by day % WINDOW_DAYS,
+with the day each row holds in a parallel array. Recording a meal adds its
+macros to one row; today's totals and the 7/30-day windows are read from at
+most WINDOW_DAYS rows, regardless of how many meals were logged.
+
+Recorded meals are added to SQLite behind the request every
+INTAKE_FLUSH_INTERVAL seconds and on shutdown, as increments, so several
+processes can share one INTAKE_LEDGER_PATH; a summary then re-reads the
+user's window from SQLite and adds this process's unflushed meals. Users
+beyond INTAKE_LEDGER_MAX_USERS are evicted least recently used first and
+reloaded from SQLite when next seen. Days are server-local calendar days.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+NUTRIENT_COLUMNS = ["calories", "protein", "carbs", "fat", "fiber", "sugar"]
+COLUMNS = NUTRIENT_COLUMNS + ["meals"]
+WINDOW_DAYS = 30
+# (user, analysis id) pairs remembered so one analysis isn't counted twice
+RECENT_ANALYSES = 100000
+
+def today() -> int:
+    return date.today().toordinal()
+
+def meal_row(analysis: dict) -> np.ndarray:
+    """
+    One analysis result as a row of COLUMNS
+    """
+    nutrition = analysis.get('nutrition', {})
+    values = [analysis.get('calories', 0)] + [nutrition.get(name, 0) for name in NUTRIENT_COLUMNS[1:]] + [1]
+    return np.array([float(value or 0) for value in values], dtype=np.float32)
+
+class _Store:
+    """
+    SQLite table of day totals per user
+    """
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=30)
+        columns = ", ".join(f"{column} REAL NOT NULL" for column in COLUMNS)
+        with self._lock:
+            if path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS intake (user_id TEXT NOT NULL, day INTEGER NOT NULL, {columns}, "
+                "PRIMARY KEY (user_id, day))"
+            )
+            self._conn.commit()
+
+    def load(self, user_id: str, since: int) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT day, {', '.join(COLUMNS)} FROM intake WHERE user_id = ? AND day > ?", (user_id, since)
+            ).fetchall()
+
+    def add(self, rows: List[tuple]):
+        """
+        Add each (user_id, day, *values) row to the stored day totals, in one transaction
+        """
+        placeholders = ", ".join("?" * (len(COLUMNS) + 2))
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in COLUMNS)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO intake (user_id, day, {', '.join(COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (user_id, day) DO UPDATE SET {updates}", rows
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class IntakeLedger:
+    def __init__(self, path: str, max_users: int, flush_interval: float):
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self.path = path
+        self._store: Optional[_Store] = None
+        capacity = min(max_users, 1024)
+        self._totals = np.zeros((capacity, WINDOW_DAYS, len(COLUMNS)), dtype=np.float32)
+        self._days = np.full((capacity, WINDOW_DAYS), -1, dtype=np.int32)
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free: List[int] = list(range(capacity - 1, -1, -1))
+        # (user, day) -> meals recorded here and not yet added to SQLite
+        self._dirty: Dict[Tuple[str, int], np.ndarray] = {}
+        # (user, analysis id) -> when it was recorded, oldest first
+        self._recent: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        # Held while a flush or a reload reads SQLite, so no meal is counted twice or missed
+        self._io = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"recorded": 0, "loads": 0, "evictions": 0, "flushes": 0, "flushErrors": 0,
+                         "duplicates": 0}
+
+    @property
+    def store(self) -> _Store:
+        # Opened on first use so importing the module touches no files
+        if self._store is None:
+            self._store = _Store(self.path)
+        return self._store
+
+    def _grow(self):
+        capacity = len(self._totals)
+        grown = min(self.max_users, capacity * 2)
+        self._totals = np.concatenate([self._totals, np.zeros((grown - capacity,) + self._totals.shape[1:], np.float32)])
+        self._days = np.concatenate([self._days, np.full((grown - capacity, WINDOW_DAYS), -1, np.int32)])
+        self._free += list(range(grown - 1, capacity - 1, -1))
+
+    def _allocate(self, user_id: str) -> int:
+        if not self._free and len(self._totals) < self.max_users:
+            self._grow()
+        if not self._free:
+            # Unflushed rows of the evicted user stay in _dirty until the next flush
+            _, slot = self._slots.popitem(last=False)
+            self.counters["evictions"] += 1
+        else:
+            slot = self._free.pop()
+        self._totals[slot] = 0
+        self._days[slot] = -1
+        self._slots[user_id] = slot
+        return slot
+
+    def _add(self, slot: int, day: int, values: np.ndarray) -> bool:
+        position = day % WINDOW_DAYS
+        if self._days[slot, position] > day:
+            # Older than the window; its ring row already holds a newer day
+            return False
+        if self._days[slot, position] != day:
+            # The ring row still holds a day that has left the window
+            self._days[slot, position] = day
+            self._totals[slot, position] = 0
+        self._totals[slot, position] += values
+        return True
+
+    async def _load(self, user_id: str, day: int) -> int:
+        """
+        Fill the user's ring from SQLite plus the meals not flushed yet
+        """
+        async with self._io:
+            rows = await asyncio.to_thread(self.store.load, user_id, day - WINDOW_DAYS)
+            # Another request may have loaded the same user meanwhile, or evicted them
+            slot = self._slots.get(user_id)
+            if slot is None:
+                slot = self._allocate(user_id)
+            else:
+                self._slots.move_to_end(user_id)
+            self.counters["loads"] += 1
+            self._totals[slot] = 0
+            self._days[slot] = -1
+            for stored_day, *values in sorted(rows):
+                self._add(slot, stored_day, np.array(values, dtype=np.float32))
+            for (dirty_user, dirty_day), values in self._dirty.items():
+                if dirty_user == user_id:
+                    self._add(slot, dirty_day, values)
+            return slot
+
+    async def _slot(self, user_id: str, day: int) -> int:
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            self._slots.move_to_end(user_id)
+            return slot
+        return await self._load(user_id, day)
+
+    def _seen(self, user_id: str, analysis_id: str) -> bool:
+        now = time.monotonic()
+        while self._recent and (len(self._recent) >= RECENT_ANALYSES
+                                or next(iter(self._recent.values())) < now - settings.NEAR_DUPLICATE_TTL):
+            self._recent.popitem(last=False)
+        if (user_id, analysis_id) in self._recent:
+            return True
+        self._recent[(user_id, analysis_id)] = now
+        return False
+
+    async def record(self, user_id: str, analysis: dict, day: int = None, analysis_id: str = None):
+        """
+        Add one analysed meal to the user's totals for the day (today by default).
+        An analysis_id this user recorded within NEAR_DUPLICATE_TTL is not counted again.
+        """
+        if analysis_id is not None and self._seen(user_id, analysis_id):
+            self.counters["duplicates"] += 1
+            return
+        day = today() if day is None else day
+        slot = await self._slot(user_id, day)
+        row = meal_row(analysis)
+        if not self._add(slot, day, row):
+            return
+        key = (user_id, day)
+        self._dirty[key] = self._dirty[key] + row if key in self._dirty else row
+        self.counters["recorded"] += 1
+
+    def _window(self, slot: int, day: int, days: int) -> np.ndarray:
+        held = self._days[slot]
+        mask = (held > day - days) & (held <= day)
+        return self._totals[slot][mask].sum(axis=0)
+
+    async def summary(self, user_id: str, day: int = None) -> dict:
+        """
+        Totals for today and the last 7 and 30 days, with daily averages for the windows
+        """
+        day = today() if day is None else day
+        # Other processes sharing the file may have added meals since the slot was loaded
+        slot = await (self._load(user_id, day) if self.path else self._slot(user_id, day))
+        summary = {}
+        for name, days in [("today", 1), ("last7Days", 7), ("last30Days", 30)]:
+            totals = self._window(slot, day, days)
+            entry = {column: round(float(value), 1) for column, value in zip(NUTRIENT_COLUMNS, totals)}
+            entry["meals"] = int(totals[-1])
+            if days > 1:
+                entry["dailyAverage"] = {
+                    column: round(float(value) / days, 1) for column, value in zip(NUTRIENT_COLUMNS, totals)
+                }
+            summary[name] = entry
+        return summary
+
+    async def flush(self):
+        """
+        Add the meals recorded since the last flush to SQLite
+        """
+        if not self._dirty:
+            return
+        async with self._io:
+            dirty, self._dirty = self._dirty, {}
+            rows = [(user_id, day, *(float(value) for value in values)) for (user_id, day), values in dirty.items()]
+            try:
+                await asyncio.to_thread(self.store.add, rows)
+                self.counters["flushes"] += 1
+            except Exception as e:
+                # Nothing was added; keep them, with any meals recorded meanwhile, for the next flush
+                for key, values in dirty.items():
+                    self._dirty[key] = self._dirty[key] + values if key in self._dirty else values
+                self.counters["flushErrors"] += 1
+                logger.warning(f"Intake ledger flush failed: {str(e)}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if not self.path and settings.SERVER_WORKERS > 1:
+            logger.warning("INTAKE_LEDGER_PATH is empty: each worker keeps its own intake totals")
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "users": len(self._slots),
+            "capacity": len(self._totals),
+            "pendingRows": len(self._dirty),
+        }
+
+# Global instance
+intake_ledger = IntakeLedger(
+    path=settings.INTAKE_LEDGER_PATH,
+    max_users=settings.INTAKE_LEDGER_MAX_USERS,
+    flush_interval=settings.INTAKE_FLUSH_INTERVAL
+)
@@ -0,0 +1,400 @@
+"""
+Asynchronous image analysis jobs.
+
+POST /jobs downloads the image, queues it in SQLite and returns a job id at
+once; JOB_WORKERS tasks per process claim queued jobs oldest first and run
+them at batch priority, so interactive requests keep their model capacity
+and a burst of submissions waits in the queue instead of holding
+connections. Clients poll GET /jobs/{id} or pass a callbackUrl that receives
+the finished job.
+
+Several processes can share one JOB_DB_PATH: a claim is a single UPDATE, and
+jobs left running by a process that died are requeued once JOB_LEASE has
+passed (failed after JOB_MAX_ATTEMPTS). A job rejected by admission control
+goes back to the queue until its Retry-After.
+
+Submitting the same image for the same user while an earlier job is queued,
+running, or succeeded within JOB_DEDUPE_TTL returns the earlier job; its
+callback is the one notified. Webhook deliveries are retried in memory only;
+the job itself stays pollable until JOB_RETENTION.
+
+Callbacks are POSTed from inside our network, so a callback host must
+resolve only to public addresses, checked at submit and again before each
+delivery, or be listed in JOB_WEBHOOK_ALLOWED_HOSTS, which then is the only
+hosts allowed. Redirects are not followed.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import httpx
+from .config import settings
+from .utils.admission import BATCH, Overloaded, call_priority
+from .utils.metrics import job_service_seconds, job_wait_seconds
+from .utils.resilience import deadline
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ["queued", "running", "succeeded", "failed"]
+
+# Seconds between lease and retention sweeps
+MAINTENANCE_INTERVAL = 60
+
+Process = Callable[[bytes, Optional[str]], Awaitable[dict]]
+
+def allowed_hosts() -> List[str]:
+    return [host.strip().lower() for host in settings.JOB_WEBHOOK_ALLOWED_HOSTS.split(",") if host.strip()]
+
+async def check_callback_url(url: str):
+    """
+    Raise ValueError unless url is an http(s) URL we may POST to: an allowed
+    host, or with no allowlist, a host whose every address is public
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        raise ValueError("callbackUrl must be an http(s) URL")
+    allowed = allowed_hosts()
+    if allowed:
+        if host not in allowed:
+            raise ValueError(f"callbackUrl host {host} is not allowed")
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        addresses = await asyncio.get_running_loop().getaddrinfo(host, port)
+    except (OSError, ValueError):
+        raise ValueError(f"callbackUrl host {host} does not resolve")
+    for *_, sockaddr in addresses:
+        # Drop an IPv6 zone id before parsing
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global:
+            raise ValueError(f"callbackUrl host {host} resolves to a non-public address")
+
+class _Store:
+    """
+    The jobs table; every method is one short transaction
+    """
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=30, isolation_level=None)
+        with self._lock:
+            if path:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, image_hash TEXT NOT NULL, "
+                "user_id TEXT NOT NULL, callback_url TEXT, image BLOB, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT, created_at REAL NOT NULL, "
+                "available_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, available_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_image ON jobs (image_hash, user_id)")
+
+    def submit(self, image_hash: str, user_id: str, callback_url: Optional[str], image: bytes,
+               now: float, dedupe_since: float) -> tuple:
+        """
+        (job id, deduplicated): the matching live job, or a newly queued one
+        """
+        with self._lock:
+            # IMMEDIATE so two processes can't both miss the other's job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE image_hash = ? AND user_id = ? AND (status IN ('queued', 'running') "
+                    "OR (status = 'succeeded' AND finished_at >= ?)) ORDER BY created_at DESC LIMIT 1",
+                    (image_hash, user_id, dedupe_since)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("COMMIT")
+                    return row[0], True
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, image_hash, user_id, callback_url, image, status, created_at, available_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                    (job_id, image_hash, user_id, callback_url, image, now, now)
+                )
+                self._conn.execute("COMMIT")
+                return job_id, False
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def claim(self, now: float) -> Optional[tuple]:
+        """
+        Mark the oldest available queued job running and return
+        (id, image, user_id, callback_url, created_at)
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ("
+                "SELECT id FROM jobs WHERE status = 'queued' AND available_at <= ? "
+                "ORDER BY available_at, created_at LIMIT 1) "
+                "RETURNING id, image, user_id, callback_url, created_at",
+                (now, now)
+            ).fetchone()
+
+    def finish(self, job_id: str, status: str, result: Optional[str], error: Optional[str], now: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, image = NULL WHERE id = ?",
+                (status, result, error, now, job_id)
+            )
+
+    def requeue(self, job_ids: List[str], available_at: float):
+        """
+        Put claimed jobs back without counting the attempt
+        """
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, available_at = ?, attempts = attempts - 1 "
+                "WHERE id = ? AND status = 'running'",
+                [(available_at, job_id) for job_id in job_ids]
+            )
+
+    def expire(self, leased_before: float, max_attempts: int, now: float) -> int:
+        """
+        Requeue jobs running since before leased_before, failing those out of attempts
+        """
+        with self._lock:
+            failed = self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Job abandoned by its worker', finished_at = ?, "
+                "image = NULL WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                (now, leased_before, max_attempts)
+            ).rowcount
+            requeued = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL, available_at = ? "
+                "WHERE status = 'running' AND started_at < ?",
+                (now, leased_before)
+            ).rowcount
+            return failed + requeued
+
+    def prune(self, finished_before: float) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (finished_before,)
+            ).rowcount
+
+    def get(self, job_id: str) -> Optional[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, status, result, error, created_at, started_at, finished_at, callback_url "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+
+    def depth(self) -> Tuple[Dict[str, int], Optional[float]]:
+        """
+        (jobs per status, creation time of the oldest queued job)
+        """
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            return counts, oldest
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _view(row: tuple) -> dict:
+    job_id, status, result, error, created_at, started_at, finished_at, _ = row
+    return {
+        "jobId": job_id,
+        "status": status,
+        "createdAt": created_at,
+        "startedAt": started_at,
+        "finishedAt": finished_at,
+        "result": json.loads(result) if result else None,
+        "error": error,
+    }
+
+class JobQueue:
+    def __init__(self, path: str, workers: int):
+        self.workers = workers
+        self.path = path
+        self._store: Optional[_Store] = None
+        self._process: Optional[Process] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._deliveries = set()
+        self._running = set()
+        self._client: Optional[httpx.AsyncClient] = None
+        # Last depth() read, refreshed off the event loop by refresh()
+        self._depth: Tuple[Dict[str, int], Optional[float]] = ({}, None)
+        self.counters = {
+            "submitted": 0, "deduplicated": 0, "succeeded": 0, "failed": 0, "requeued": 0, "expired": 0,
+            "webhooksDelivered": 0, "webhooksFailed": 0,
+        }
+
+    @property
+    def store(self) -> _Store:
+        # Opened on first use so importing the module touches no files
+        if self._store is None:
+            self._store = _Store(self.path)
+        return self._store
+
+    async def submit(self, image_hash: str, image_data: bytes, user_id: Optional[str] = None,
+                     callback_url: Optional[str] = None) -> dict:
+        """
+        Queue an analysis of image_data, or return the live job already analysing it for this user
+        """
+        now = time.time()
+        job_id, deduplicated = await asyncio.to_thread(
+            self.store.submit, image_hash, user_id or "", callback_url, image_data, now, now - settings.JOB_DEDUPE_TTL
+        )
+        self.counters["deduplicated" if deduplicated else "submitted"] += 1
+        if not deduplicated:
+            self._wakeup.set()
+        return {"jobId": job_id, "deduplicated": deduplicated}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        row = await asyncio.to_thread(self.store.get, job_id)
+        return _view(row) if row is not None else None
+
+    async def _worker(self):
+        while True:
+            # Cleared before claiming so a submit during the claim still wakes us
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self.store.claim, time.time())
+            if job is None:
+                try:
+                    # Also polls for jobs queued by other processes
+                    await asyncio.wait_for(self._wakeup.wait(), settings.JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(*job)
+
+    async def _run(self, job_id: str, image: bytes, user_id: str, callback_url: Optional[str], created_at: float):
+        started = time.time()
+        job_wait_seconds.observe(started - created_at)
+        # Left in _running if cancelled, so close() requeues it
+        self._running.add(job_id)
+        try:
+            with call_priority(BATCH), deadline(settings.JOB_TIMEOUT):
+                result = await self._process(image, user_id or None)
+        except Overloaded as e:
+            self._running.discard(job_id)
+            await asyncio.to_thread(self.store.requeue, [job_id], time.time() + e.retry_after)
+            self.counters["requeued"] += 1
+            return
+        except Exception as e:
+            result = {'success': False, 'error': getattr(e, "detail", None) or str(e)}
+        self._running.discard(job_id)
+        finished = time.time()
+        status = "succeeded" if result['success'] else "failed"
+        job_service_seconds.observe(finished - started, status=status)
+        await asyncio.to_thread(
+            self.store.finish, job_id, status,
+            json.dumps(result['data']) if result['success'] else None,
+            None if result['success'] else result.get('error', 'Unknown error'),
+            finished
+        )
+        self.counters[status] += 1
+        if callback_url:
+            row = await asyncio.to_thread(self.store.get, job_id)
+            task = asyncio.ensure_future(self._deliver(callback_url, _view(row)))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, url: str, job: dict):
+        """
+        POST the finished job to its callback, signed with JOB_WEBHOOK_SECRET when set
+        """
+        body = json.dumps(job).encode()
+        headers = {"Content-Type": "application/json"}
+        if settings.JOB_WEBHOOK_SECRET:
+            signature = hmac.new(settings.JOB_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Signature"] = f"sha256={signature}"
+        try:
+            # DNS may have changed since the job was submitted
+            await check_callback_url(url)
+        except ValueError as e:
+            self.counters["webhooksFailed"] += 1
+            logger.warning(f"Webhook for job {job['jobId']} not sent: {str(e)}")
+            return
+        for attempt in range(settings.JOB_WEBHOOK_ATTEMPTS):
+            try:
+                response = await self._webhook_client().post(
+                    url, content=body, headers=headers, timeout=settings.JOB_WEBHOOK_TIMEOUT
+                )
+                if response.is_success:
+                    self.counters["webhooksDelivered"] += 1
+                    return
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(2 ** attempt)
+        self.counters["webhooksFailed"] += 1
+        logger.warning(f"Webhook for job {job['jobId']} could not be delivered")
+
+    def _webhook_client(self) -> httpx.AsyncClient:
+        # Separate from the image download client: a redirect could point anywhere
+        if self._client is None:
+            self._client = httpx.AsyncClient(follow_redirects=False, timeout=settings.JOB_WEBHOOK_TIMEOUT)
+        return self._client
+
+    async def _maintain(self):
+        while True:
+            now = time.time()
+            try:
+                self.counters["expired"] += await asyncio.to_thread(
+                    self.store.expire, now - settings.JOB_LEASE, settings.JOB_MAX_ATTEMPTS, now
+                )
+                await asyncio.to_thread(self.store.prune, now - settings.JOB_RETENTION)
+            except Exception as e:
+                logger.warning(f"Job queue maintenance failed: {str(e)}")
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+    def start(self, process: Process):
+        """
+        Start the workers, which analyse a job's image with process(image, user_id)
+        """
+        if self._tasks:
+            return
+        if not self.path and settings.SERVER_WORKERS > 1:
+            # Each worker would only see the jobs submitted to it, so polls hit 404 on the others
+            raise RuntimeError("JOB_DB_PATH is empty: an in-memory job queue needs a single worker")
+        self._process = process
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.ensure_future(self._maintain()))
+
+    async def close(self):
+        for task in self._tasks + list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._deliveries, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        # Interrupted jobs go back to the queue for the next start
+        if self._running:
+            await asyncio.to_thread(self.store.requeue, list(self._running), time.time())
+            self._running.clear()
+
+    async def refresh(self):
+        """
+        Re-read the queue depth reported by stats()
+        """
+        self._depth = await asyncio.to_thread(self.store.depth)
+
+    def stats(self) -> dict:
+        """
+        Counters, and the queue depth as of the last refresh()
+        """
+        counts, oldest = self._depth
+        return {
+            **self.counters,
+            **{status: counts.get(status, 0) for status in STATUSES},
+            "oldestQueuedSeconds": round(time.time() - oldest, 3) if oldest is not None else 0.0,
+            "workers": self.workers,
+        }
+
+# Global instance
+job_queue = JobQueue(path=settings.JOB_DB_PATH, workers=settings.JOB_WORKERS)
@@ -1,16 +1,63 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from .food_advisor import FoodAdvisor
-from .food_image_analyzer import food_analyzer
-from .utils.storage import save_temp_file
+from .config import settings
+from .food_advisor import FoodAdvisor, advice_cache
+from .food_image_analyzer import food_analyzer, get_vision_model, ImagePacker, pack_size
+from .prompts import prompt_registry
+from .intake_ledger import intake_ledger
+from .jobs import check_callback_url, job_queue
+from .recommendation_cache import recommendation_cache
+from .retrieval import knowledge_base
 from .utils.validation import validate_user_profile
-from .utils.llm_client import generate_response
-import requests
-import tempfile
-import os
+from .utils.llm_client import generate_response, get_model
+from .utils.model_registry import model_registry
+from .utils.admission import admission, call_priority, BATCH
+from .utils.resilience import deadline, request_deadline, resilience
+from .utils.cancellation import run_until_disconnected
+from .utils.result_cache import analysis_cache, content_key
+from .utils.ingestion import download_image, read_upload, close_http_client
+from .utils.near_duplicates import near_duplicate_index
+from .utils.preprocess import prepare_and_hash
+from .utils.structured_output import parse_report
+from .utils.metrics import metrics, stage, http_requests_in_flight, http_request_seconds
 
-app = FastAPI()
+# Application logs (uvicorn configures its own loggers)
+package_logger = logging.getLogger(__package__)
+package_logger.setLevel(settings.LOG_LEVEL.upper())
+if not package_logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    package_logger.addHandler(handler)
+    package_logger.propagate = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Configure the SDK and build the shared models once per worker
+    model_registry.configure()
+    get_vision_model()
+    get_model()
+    knowledge_base.start()
+    intake_ledger.start()
+    job_queue.start(run_analysis_job)
+    recommendation_cache.start(
+        food_analyzer.generate_recommendations, lambda: food_analyzer.recommendations_version
+    )
+    yield
+    await job_queue.close()
+    await recommendation_cache.close()
+    await knowledge_base.close()
+    await intake_ledger.close()
+    await close_http_client()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -21,9 +68,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    # Label by route so arbitrary URLs can't create new series
+    path = request.url.path if request.url.path in {route.path for route in app.routes} else "other"
+    http_requests_in_flight.inc(path=path)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        http_requests_in_flight.dec(path=path)
+        http_request_seconds.observe(time.perf_counter() - start, path=path, method=request.method, status=status)
+
+def service_metrics():
+    """
+    Samples read at scrape time from the caches, admission control and resilience layer
+    """
+    caches = {
+        "analysis": analysis_cache.stats(),
+        "advice": advice_cache.stats(),
+        "recommendations": recommendation_cache.stats(),
+    }
+    yield ("rag_cache_lookups_total", "counter", "Result cache lookups by outcome", [
+        ({"cache": name, "result": result}, stats[key])
+        for name, stats in caches.items()
+        for result, key in [("hit", "hits"), ("disk_hit", "diskHits"), ("miss", "misses"), ("coalesced", "coalesced")]
+    ])
+    yield ("rag_cache_hit_ratio", "gauge", "Share of result cache lookups not needing a new computation",
+           [({"cache": name}, stats["hitRatio"]) for name, stats in caches.items()])
+    yield ("rag_cache_entries", "gauge", "Entries held in memory by each result cache",
+           [({"cache": name}, stats["size"]) for name, stats in caches.items()])
+
+    admitted = admission.stats()
+    duplicates = near_duplicate_index.stats()
+    yield ("rag_near_duplicate_lookups_total", "counter", "Per-user perceptual hash lookups by outcome", [
+        ({"result": "match"}, duplicates["matches"]), ({"result": "miss"}, duplicates["lookups"] - duplicates["matches"])
+    ])
+    yield ("rag_near_duplicate_entries", "gauge", "Photo hashes held by the near-duplicate index", [({}, duplicates["entries"])])
+
+    retrieval = knowledge_base.stats()
+    yield ("rag_semantic_cache_lookups_total", "counter", "Advice requests checked against past advice by outcome", [
+        ({"result": "hit"}, retrieval["semanticHits"]), ({"result": "miss"}, retrieval["semanticMisses"])
+    ])
+    yield ("rag_retrieval_entries", "gauge", "Entries in the retrieval index by kind",
+           [({"kind": kind}, count) for kind, count in retrieval["entries"].items()])
+
+    intake = intake_ledger.stats()
+    yield ("rag_intake_meals_recorded_total", "counter", "Analysed meals added to the intake ledger", [({}, intake["recorded"])])
+    yield ("rag_intake_users", "gauge", "Users whose recent intake is held in memory", [({}, intake["users"])])
+    yield ("rag_intake_pending_rows", "gauge", "Changed day totals not yet written to SQLite", [({}, intake["pendingRows"])])
+
+    jobs = job_queue.stats()
+    yield ("rag_jobs", "gauge", "Analysis jobs held in the queue by status",
+           [({"status": status}, jobs[status]) for status in ["queued", "running", "succeeded", "failed"]])
+    yield ("rag_job_oldest_queued_seconds", "gauge", "Age of the oldest queued analysis job", [({}, jobs["oldestQueuedSeconds"])])
+    yield ("rag_job_submissions_total", "counter", "Analysis job submissions by outcome", [
+        ({"result": "queued"}, jobs["submitted"]), ({"result": "deduplicated"}, jobs["deduplicated"])
+    ])
+    yield ("rag_job_webhooks_total", "counter", "Job callback deliveries by outcome", [
+        ({"result": "delivered"}, jobs["webhooksDelivered"]), ({"result": "failed"}, jobs["webhooksFailed"])
+    ])
+
+    yield ("rag_model_calls_in_flight", "gauge", "Model calls holding an admission slot", [({}, admitted["inFlight"])])
+    yield ("rag_model_queue_depth", "gauge", "Callers waiting for a model slot", [({}, admitted["queued"])])
+    yield ("rag_model_concurrency_limit", "gauge", "Current adaptive model call limit", [({}, admitted["limit"])])
+    yield ("rag_model_admission_total", "counter", "Model call admission outcomes", [
+        ({"result": result}, admitted[key]) for result, key in
+        [("admitted", "admitted"), ("rejected", "rejected"), ("timed_out", "timedOut"), ("rate_limited", "rateLimited"), ("slow", "slow")]
+    ])
+
+    resilient = resilience.stats()
+    yield ("rag_model_resilience_total", "counter", "Model call retries, hedges and failures", [
+        ({"event": event}, resilient[key]) for event, key in
+        [("retry", "retries"), ("hedge", "hedges"), ("hedge_win", "hedgeWins"), ("deadline_exceeded", "deadlineExceeded"), ("failed", "failed")]
+    ])
+    yield ("rag_model_breaker_open", "gauge", "1 while the model circuit breaker is open",
+           [({}, int(resilient["breaker"] == "open"))])
+
+metrics.add_collector(service_metrics)
+
 # Pydantic models for API requests
 class ImageAnalysisRequest(BaseModel):
     imageUrl: str
+    userId: Optional[str] = None  # Enables reuse of this user's recent near-identical photos and records the meal in their intake
+
+class JobRequest(ImageAnalysisRequest):
+    callbackUrl: Optional[str] = None  # Receives the finished job as a JSON POST
+
+class RecommendationRequest(BaseModel):
+    userProfile: dict  # age, weight, height, gender, activity_level, goal
+    currentNutrition: dict = {}  # calories, protein, carbs, fat eaten so far today
+    userId: Optional[str] = None  # Without currentNutrition, today's totals come from this user's intake ledger
 
 class FoodAnalysisResponse(BaseModel):
     foodName: str
@@ -41,6 +179,64 @@ async def health_check():
         "version": "1.0.0"
     }
 
+# Prometheus metrics for this worker
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # Job queue depth lives in SQLite, so it is read off the event loop before rendering
+    await job_queue.refresh()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Result cache counters
+@app.get("/cache/stats")
+async def cache_stats():
+    return analysis_cache.stats()
+
+# Model response parsing counters
+@app.get("/parse/stats")
+async def parse_stats():
+    return parse_report()
+
+# Near-duplicate photo reuse per user
+@app.get("/near-duplicates/stats")
+async def near_duplicate_stats():
+    return near_duplicate_index.stats()
+
+# Bucketed recommendation cache and pre-warm counters
+@app.get("/recommendations/stats")
+async def recommendation_stats():
+    return recommendation_cache.stats()
+
+# Analysis job queue depth and outcomes
+@app.get("/jobs/stats")
+async def job_stats():
+    await job_queue.refresh()
+    return job_queue.stats()
+
+# Intake ledger users and write-behind counters
+@app.get("/intake/stats")
+async def intake_stats():
+    return intake_ledger.stats()
+
+# Retrieval index size and semantic cache counters
+@app.get("/retrieval/stats")
+async def retrieval_stats():
+    return knowledge_base.stats()
+
+# Model call admission: adaptive limit, queue depth and rejections
+@app.get("/admission/stats")
+async def admission_stats():
+    return admission.stats()
+
+# Retries, hedges and circuit breaker state for model calls
+@app.get("/resilience/stats")
+async def resilience_stats():
+    return resilience.stats()
+
+# Prompt versions and tokens served from cached prefixes
+@app.get("/prompts/stats")
+async def prompt_stats():
+    return prompt_registry.stats()
+
 # Test Gemini connection
 @app.get("/test-gemini")
 async def test_gemini():
@@ -51,6 +247,8 @@ async def test_gemini():
             "status": "success",
             "response": response
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini API Error: {str(e)}")
 
@@ -79,11 +277,13 @@ async def test_advisor():
 # Original analyze endpoint
 @app.post("/analyze")
 async def analyze_food(
+    http_request: Request,
     file: UploadFile = File(...),
     age: int = Form(...),
     current_weight: float = Form(...),
     goal_weight: float = Form(...),
-    health_goals: str = Form(...)
+    health_goals: str = Form(...),
+    user_id: Optional[str] = Form(None)
 ):
     try:
         # Validate inputs
@@ -95,31 +295,181 @@ async def analyze_food(
         })
         
         # Process image and get recommendation
-        image_path = await save_temp_file(file)
-        advisor = FoodAdvisor(user_profile)
-        recommendation = await advisor.get_recommendation(image_path)
+        image_data = await read_upload(file)
+        advisor = FoodAdvisor(user_profile, user_id)
+        with request_deadline(http_request):
+            recommendation = await run_until_disconnected(
+                http_request, analyze_and_advise(advisor, image_data, user_id)
+            )
         
         return recommendation
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def analyze_and_advise(advisor: FoodAdvisor, image_data: bytes, user_id: Optional[str] = None) -> dict:
+    """
+    One vision analysis (shared via the result cache), then a text-only
+    advice call that reads the structured result instead of the image
+    """
+    analysis_result = await analyze_image_data(image_data, user_id=user_id)
+    if not analysis_result['success']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Food analysis failed: {analysis_result.get('error', 'Unknown error')}"
+        )
+    return await advisor.get_recommendation(analysis_result['data'])
+
+def sse_event(data: dict, event: str = None) -> str:
+    """
+    Format one Server-Sent Events message
+    """
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Streaming variant of /analyze: advice arrives as Server-Sent Events
+@app.post("/analyze/stream")
+async def analyze_food_stream(
+    http_request: Request,
+    file: UploadFile = File(...),
+    age: int = Form(...),
+    current_weight: float = Form(...),
+    goal_weight: float = Form(...),
+    health_goals: str = Form(...),
+    user_id: Optional[str] = Form(None)
+):
+    user_profile = validate_user_profile({
+        "age": age, 
+        "current_weight": current_weight,
+        "goal_weight": goal_weight,
+        "health_goals": health_goals
+    })
+    image_data = await read_upload(file)
+    advisor = FoodAdvisor(user_profile, user_id)
+
+    async def stream_events():
+        # The generator is only advanced as the client reads; the model
+        # stream itself is buffered, so a slow client doesn't hold a model slot
+        try:
+            with request_deadline(http_request):
+                analysis_result = await analyze_image_data(image_data, user_id=user_id)
+            if not analysis_result['success']:
+                yield sse_event(
+                    {"detail": f"Food analysis failed: {analysis_result.get('error', 'Unknown error')}"},
+                    event="error"
+                )
+                return
+            yield sse_event(to_food_response(analysis_result['data']).model_dump(), event="food")
+
+            async for text in advisor.stream_recommendation(analysis_result['data']):
+                yield sse_event({"text": text})
+            yield sse_event({}, event="done")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def analyze_image_data(image_data: bytes, analyzer=None, user_id: Optional[str] = None) -> dict:
+    """
+    Analyze image bytes, sharing one cached (or in-flight) analysis
+    between identical images. With a user_id, a near-identical photo the
+    same user sent recently reuses that photo's analysis.
+    """
+    analyzer = analyzer or food_analyzer
+    version = food_analyzer.cache_version
+    image_hash = None
+    # Decoded once, off the event loop: the hash comes from the image prepared for the model
+    prepared = None
+    if user_id and settings.NEAR_DUPLICATE_ENABLED:
+        try:
+            prepared, image_hash = await asyncio.to_thread(prepare_and_hash, image_data)
+        except Exception:
+            # Undecodable images fail in the analysis below with a proper error
+            pass
+        else:
+            match = near_duplicate_index.find(user_id, image_hash, version)
+            if match is not None:
+                return {**match, 'nearDuplicate': True}
+
+    cache_key = content_key(image_data, version)
+
+    async def analyze():
+        result = await analyzer.analyze_food_image(prepared or image_data)
+        if result['success']:
+            # Fresh analyses become retrievable notes for the same user's later advice
+            knowledge_base.index_analysis(user_id, result['data'])
+        return result
+
+    analysis_result = await analysis_cache.get_or_compute(
+        cache_key, analyze, should_cache=lambda result: result['success']
+    )
+    if analysis_result['success']:
+        # Kept by near-duplicate matches too, so a user's intake counts the analysis once however it's reached
+        analysis_result = {**analysis_result, 'analysisId': cache_key}
+        if image_hash is not None:
+            near_duplicate_index.add(user_id, image_hash, version, analysis_result)
+    return analysis_result
+
+def to_food_response(data: dict) -> FoodAnalysisResponse:
+    """
+    Transform an analysis result to match the TypeScript expected format
+    """
+    with stage("response"):
+        return _food_response(data)
+
+def _food_response(data: dict) -> FoodAnalysisResponse:
+    nutrition = data.get('nutrition', {})
+    return FoodAnalysisResponse(
+        foodName=data.get('foodName', 'Unknown Food'),
+        calories=int(data.get('calories', 0)),
+        confidence=float(data.get('confidence', 0.0)),
+        nutrition={
+            "protein": float(nutrition.get('protein', 0)),
+            "carbs": float(nutrition.get('carbs', 0)),
+            "fat": float(nutrition.get('fat', 0)),
+            "fiber": float(nutrition.get('fiber', 0)),
+            "sugar": float(nutrition.get('sugar', 0))
+        },
+        portionSize=data.get('portionSize', 'Unknown')
+    )
+
+async def record_intake(user_id: Optional[str], analysis_result: dict):
+    # A re-sent photo of a meal already logged isn't counted twice, whichever endpoint analysed it first
+    if user_id:
+        await intake_ledger.record(user_id, analysis_result['data'], analysis_id=analysis_result.get('analysisId'))
+
+async def run_analysis_job(image_data: bytes, user_id: Optional[str]) -> dict:
+    """
+    What /analyze-image-url does for a queued job, with the response as the result
+    """
+    analysis_result = await analyze_image_data(image_data, user_id=user_id)
+    if not analysis_result['success']:
+        return analysis_result
+    await record_intake(user_id, analysis_result)
+    return {'success': True, 'data': to_food_response(analysis_result['data']).model_dump()}
+
 # New endpoint for NextJS integration - analyze image from URL
-@app.post("/analyze-image-url")
-async def analyze_image_url(request: ImageAnalysisRequest):
+@app.post("/analyze-image-url", response_model=FoodAnalysisResponse)
+async def analyze_image_url(request: ImageAnalysisRequest, http_request: Request):
     """
     Analyze food image from URL and return nutrition information
     This endpoint is specifically designed for NextJS app integration
     """
     try:
-        # Download image from URL to temporary file
-        image_path = await download_image_from_url(request.imageUrl)
+        # Download image from URL into memory
+        image_data = await download_image(request.imageUrl)
         
         # Analyze the image
-        analysis_result = await food_analyzer.analyze_food_image(image_path)
-        
-        # Clean up temporary file
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        # The model call is cancelled if every waiting client goes away.
+        with request_deadline(http_request):
+            analysis_result = await run_until_disconnected(
+                http_request, analyze_image_data(image_data, user_id=request.userId)
+            )
         
         if not analysis_result['success']:
             raise HTTPException(
@@ -127,52 +477,107 @@ async def analyze_image_url(request: ImageAnalysisRequest):
                 detail=f"Food analysis failed: {analysis_result.get('error', 'Unknown error')}"
             )
         
-        # Transform the result to match TypeScript expected format
-        data = analysis_result['data']
+        await record_intake(request.userId, analysis_result)
         
-        response = {
-            "foodName": data.get('foodName', 'Unknown Food'),
-            "calories": int(data.get('calories', 0)),
-            "confidence": float(data.get('confidence', 0.0)),
-            "nutrition": {
-                "protein": float(data.get('nutrition', {}).get('protein', 0)),
-                "carbs": float(data.get('nutrition', {}).get('carbs', 0)),
-                "fat": float(data.get('nutrition', {}).get('fat', 0)),
-                "fiber": float(data.get('nutrition', {}).get('fiber', 0)),
-                "sugar": float(data.get('nutrition', {}).get('sugar', 0))
-            },
-            "portionSize": data.get('portionSize', 'Unknown')
-        }
-        
-        return response
+        return to_food_response(analysis_result['data'])
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Image analysis error: {str(e)}")
 
-async def download_image_from_url(url: str) -> str:
+# Queue an image URL for analysis; poll /jobs/{job_id} or wait for the callback
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    if request.callbackUrl:
+        try:
+            await check_callback_url(request.callbackUrl)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    image_data = await download_image(request.imageUrl)
+    job = await job_queue.submit(
+        content_key(image_data, food_analyzer.cache_version), image_data, request.userId, request.callbackUrl
+    )
+    return {**job, "statusUrl": f"/jobs/{job['jobId']}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Food recommendations for the rest of the day
+@app.post("/recommendations")
+async def food_recommendations(request: RecommendationRequest, http_request: Request):
+    current_nutrition = request.currentNutrition
+    intake = None
+    if request.userId:
+        intake = await intake_ledger.summary(request.userId)
+        current_nutrition = current_nutrition or intake['today']
+    with request_deadline(http_request):
+        result = await food_analyzer.get_food_recommendations(request.userProfile, current_nutrition)
+    if not result['success']:
+        raise HTTPException(status_code=400, detail=f"Recommendations failed: {result.get('error', 'Unknown error')}")
+    return {**result['data'], 'intake': intake} if intake else result['data']
+
+# Today's totals and 7/30-day windows from the intake ledger
+@app.get("/intake/{user_id}")
+async def user_intake(user_id: str):
+    return await intake_ledger.summary(user_id)
+
+# Batch endpoint for back-filling many images in one request
+@app.post("/analyze-images")
+async def analyze_images(
+    imageUrls: List[str] = Form(default=[]),
+    files: List[UploadFile] = File(default=[]),
+    userId: Optional[str] = Form(None)
+):
     """
-    Download image from URL and save to temporary file
-    Returns the path to the temporary file
+    Analyze many food images (URLs and/or uploads) concurrently.
+    Streams one NDJSON line per image in completion order; a failed
+    image yields an error line instead of failing the batch.
     """
-    try:
-        # Create a temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_path = temp_file.name
-        temp_file.close()
-        
-        # Download the image
-        response = requests.get(url, stream=True, timeout=30)
-        response.raise_for_status()
-        
-        # Save to temporary file
-        with open(temp_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return temp_path
-        
-    except Exception as e:
-        # Clean up temp file if it was created
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
-        raise Exception(f"Failed to download image: {str(e)}")
\ No newline at end of file
+    sources = [(url, lambda url=url: download_image(url)) for url in imageUrls]
+    sources += [(file.filename, lambda file=file: read_upload(file)) for file in files]
+    if not sources:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(sources) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exceeds maximum of {settings.BATCH_MAX_ITEMS} images"
+        )
+
+    workers = asyncio.Semaphore(settings.BATCH_CONCURRENCY)
+    # Cache misses from this batch are packed several images per model call
+    analyzer = ImagePacker(food_analyzer) if pack_size() > 1 else food_analyzer
+
+    async def process(index: int, source: str, load) -> dict:
+        item = {"index": index, "source": source}
+        # Back-fill waits behind interactive scans for model slots
+        with call_priority(BATCH), deadline(settings.BATCH_ITEM_TIMEOUT):
+            async with workers:
+                try:
+                    analysis_result = await analyze_image_data(await load(), analyzer, userId)
+                except HTTPException as e:
+                    return {**item, "success": False, "error": e.detail}
+                except Exception as e:
+                    return {**item, "success": False, "error": str(e)}
+        if not analysis_result['success']:
+            return {**item, "success": False, "error": analysis_result.get('error', 'Unknown error')}
+        return {**item, "success": True, "result": to_food_response(analysis_result['data']).model_dump()}
+
+    async def stream_results():
+        tasks = [
+            asyncio.ensure_future(process(index, source, load))
+            for index, (source, load) in enumerate(sources)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # Stop outstanding work if the client goes away mid-stream
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
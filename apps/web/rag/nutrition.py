@@ -0,0 +1,112 @@
+"""
+Deterministic daily nutrition targets.
+
+Pure functions vectorised with NumPy: every argument may be a scalar or an
+array (one element per profile), so targets for a whole user base can be
+computed in one pass. The formulas mirror the web app's
+core/food/analyze-food.ts so both sides agree.
+"""
+from typing import Dict
+import numpy as np
+
+# Multipliers applied to BMR to get total daily energy expenditure
+ACTIVITY_MULTIPLIERS = {
+    "SEDENTARY": 1.2,
+    "LOW": 1.2,
+    "LIGHT": 1.375,
+    "MODERATE": 1.55,
+    "HIGH": 1.725,
+    "VERY_HIGH": 1.9,
+}
+DEFAULT_ACTIVITY_MULTIPLIER = 1.55
+
+# Daily calorie deficit/surplus per goal; the web app stores LOSE_FAT, MAINTAIN
+# or BUILD_MUSCLE (UserGoal in core/users/save-profile.ts)
+GOAL_ADJUSTMENTS = {
+    "LOSE_FAT": -500,
+    "LOSE_WEIGHT": -500,
+    "MAINTAIN": 0,
+    "GAIN_WEIGHT": 500,
+    "BUILD_MUSCLE": 500,
+}
+
+# Share of calories from (protein, carbs, fat) per goal
+MACRO_SPLITS = {
+    "LOSE_FAT": (0.30, 0.40, 0.30),
+    "LOSE_WEIGHT": (0.30, 0.40, 0.30),
+    "MAINTAIN": (0.25, 0.50, 0.25),
+    "GAIN_WEIGHT": (0.25, 0.55, 0.20),
+    "BUILD_MUSCLE": (0.30, 0.50, 0.20),
+}
+DEFAULT_MACRO_SPLIT = MACRO_SPLITS["MAINTAIN"]
+
+# Mifflin-St Jeor sex constant; anything not recognised as male uses the female constant
+SEX_CONSTANTS = {"MALE": 5.0, "M": 5.0, "FEMALE": -161.0, "F": -161.0}
+DEFAULT_SEX_CONSTANT = -161.0
+
+CALORIES_PER_GRAM = {"protein": 4.0, "carbs": 4.0, "fat": 9.0}
+
+def _normalise_label(value) -> str:
+    return str(value).strip().upper().replace(" ", "_").replace("-", "_")
+
+def _lookup(values, table: dict, default) -> np.ndarray:
+    """
+    Map an array of category labels through a table, normalising and
+    looking up each distinct label only once
+    """
+    labels = np.asarray(values)
+    if labels.dtype.kind != "U":
+        labels = labels.astype(str)
+    unique, inverse = np.unique(labels.ravel(), return_inverse=True)
+    mapped = np.array([table.get(_normalise_label(label), default) for label in unique], dtype=float)
+    return mapped[inverse].reshape(labels.shape + mapped.shape[1:])
+
+def bmr(weight_kg, height_cm, age, gender) -> np.ndarray:
+    """
+    Basal metabolic rate (kcal/day) using the Mifflin-St Jeor equation
+    """
+    weight_kg = np.asarray(weight_kg, dtype=float)
+    height_cm = np.asarray(height_cm, dtype=float)
+    age = np.asarray(age, dtype=float)
+    return 10 * weight_kg + 6.25 * height_cm - 5 * age + _lookup(gender, SEX_CONSTANTS, DEFAULT_SEX_CONSTANT)
+
+def daily_calories(weight_kg, height_cm, age, gender, activity_level, goal) -> np.ndarray:
+    """
+    Goal-adjusted daily calorie target: BMR x activity multiplier +/- goal adjustment
+    """
+    tdee = bmr(weight_kg, height_cm, age, gender) * _lookup(
+        activity_level, ACTIVITY_MULTIPLIERS, DEFAULT_ACTIVITY_MULTIPLIER
+    )
+    return tdee + _lookup(goal, GOAL_ADJUSTMENTS, 0)
+
+def daily_targets(weight_kg, height_cm, age, gender, activity_level, goal) -> Dict[str, np.ndarray]:
+    """
+    Daily calorie and macro (grams) targets for one or many profiles
+    """
+    calories = daily_calories(weight_kg, height_cm, age, gender, activity_level, goal)
+    split = _lookup(goal, MACRO_SPLITS, DEFAULT_MACRO_SPLIT)
+    return {
+        "calories": np.rint(calories),
+        "protein": np.rint(calories * split[..., 0] / CALORIES_PER_GRAM["protein"]),
+        "carbs": np.rint(calories * split[..., 1] / CALORIES_PER_GRAM["carbs"]),
+        "fat": np.rint(calories * split[..., 2] / CALORIES_PER_GRAM["fat"]),
+    }
+
+def targets_for_profile(user_profile: dict) -> Dict[str, int]:
+    """
+    Daily targets for a single user profile dict as used by the recommendation API
+    """
+    required_fields = ['weight', 'height', 'age', 'gender']
+    for field in required_fields:
+        if user_profile.get(field) is None:
+            raise ValueError(f"Missing required profile field: {field}")
+
+    targets = daily_targets(
+        user_profile['weight'],
+        user_profile['height'],
+        user_profile['age'],
+        user_profile['gender'],
+        user_profile.get('activity_level') or 'MODERATE',
+        user_profile.get('goal') or 'MAINTAIN',
+    )
+    return {name: int(value) for name, value in targets.items()}
@@ -0,0 +1,240 @@
+"""
+Bundled food-composition table for resolving known foods without the model.
+
+Values are per 100 g (approximate USDA FoodData Central figures) and are
+stored column-wise in data/foods.npy, which is memory-mapped on first use.
+data/foods.csv is the editable source; rebuild the binary files with:
+    python -m rag.nutrition_db
+"""
+import csv
+import difflib
+import json
+import re
+import threading
+from bisect import bisect_left
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .config import settings
+
+DATA_DIR = Path(__file__).parent / "data"
+
+NUTRIENT_COLUMNS = ["calories", "protein", "carbs", "fat", "fiber", "sugar"]
+MEASURE_COLUMNS = ["unit_grams", "cup_grams"]
+COLUMNS = NUTRIENT_COLUMNS + MEASURE_COLUMNS
+
+# Preparation words that don't change which table entry a dish maps to
+MODIFIERS = {
+    "a", "an", "of", "fresh", "raw", "plain", "ripe", "whole", "sliced", "chopped",
+    "steamed", "grilled", "roasted", "baked", "cooked", "homemade", "small", "medium", "large",
+}
+
+GRAM_UNITS = {
+    "g": 1.0, "gram": 1.0, "grams": 1.0, "kg": 1000.0,
+    "oz": 28.35, "ounce": 28.35, "ounces": 28.35, "lb": 453.6, "lbs": 453.6,
+    # Volumes of mostly-water foods and drinks
+    "ml": 1.0, "l": 1000.0,
+}
+CUP_UNITS = {
+    "cup": 1.0, "cups": 1.0,
+    "tbsp": 1 / 16, "tablespoon": 1 / 16, "tablespoons": 1 / 16,
+    "tsp": 1 / 48, "teaspoon": 1 / 48, "teaspoons": 1 / 48,
+}
+SIZE_FACTORS = {"small": 0.75, "medium": 1.0, "large": 1.25}
+COUNT_UNITS = {"piece", "pieces", "slice", "slices", "item", "items", "serving", "servings", "whole"}
+
+MIN_PREFIX_COVERAGE = 0.6
+
+_AMOUNT = r"(\d+\s*/\s*\d+|\d+(?:\.\d+)?)"
+_GRAMS_PATTERN = re.compile(_AMOUNT + r"\s*(g|grams?|kg|oz|ounces?|lbs?|ml|l)\b")
+_COUNT_PATTERN = re.compile(_AMOUNT + r"\s*([a-z]+)?")
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("oes"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+def normalise_name(name: str) -> str:
+    """
+    Lowercase, strip punctuation and singularise each word
+    """
+    words = re.sub(r"[^a-z0-9 ]+", " ", str(name).lower()).split()
+    return " ".join(_singular(word) for word in words)
+
+def _parse_amount(text: Optional[str]) -> float:
+    if not text:
+        return 1.0
+    return float(Fraction(text.replace(" ", "")))
+
+class NutritionDatabase:
+    """
+    Lazily loaded, memory-mapped food table with exact, prefix and fuzzy name lookup
+    """
+    def __init__(self, data_dir: Path = DATA_DIR, match_cutoff: float = 0.85):
+        self.data_dir = Path(data_dir)
+        self.match_cutoff = match_cutoff
+        self._lock = threading.Lock()
+        self._values: Optional[np.ndarray] = None
+        self._names: List[str] = []
+        self._aliases: List[List[str]] = []
+        # Words of each row's name and aliases, for recognising portion units like "2 breasts"
+        self._words: List[set] = []
+        self._index: Dict[str, int] = {}
+        self._keys: List[str] = []
+
+    def _load(self):
+        with self._lock:
+            if self._values is not None:
+                return
+            metadata = json.loads((self.data_dir / "foods.json").read_text())
+            index = {}
+            for row, (name, aliases) in enumerate(zip(metadata["names"], metadata["aliases"])):
+                for key in [name] + aliases:
+                    index.setdefault(normalise_name(key), row)
+            self._names = metadata["names"]
+            self._aliases = metadata["aliases"]
+            self._words = [
+                {word for key in [name] + aliases for word in normalise_name(key).split()}
+                for name, aliases in zip(metadata["names"], metadata["aliases"])
+            ]
+            self._index = index
+            self._keys = sorted(index)
+            self._values = np.load(self.data_dir / "foods.npy", mmap_mode="r")
+
+    def match(self, food_name: str) -> Optional[Tuple[int, float]]:
+        """
+        Find the table row for a food name. Returns (row, score) where score
+        is 1.0 for exact/alias matches (ignoring MODIFIERS) and the prefix
+        coverage or similarity ratio otherwise. Only a score of 1.0 means the
+        entry is the same food; lower scores are merely similar names.
+        """
+        self._load()
+        key = normalise_name(food_name)
+        if not key:
+            return None
+        if key in self._index:
+            return self._index[key], 1.0
+
+        # "grilled chicken breast" -> "chicken breast"
+        core = " ".join(word for word in key.split() if word not in MODIFIERS)
+        if core in self._index:
+            return self._index[core], 1.0
+
+        # Prefix: a truncated name like "blueber" completes to the shortest
+        # matching entry, as long as most of that entry was given
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position].startswith(key):
+            candidates = [k for k in self._keys[position:position + 16] if k.startswith(key)]
+            best = min(candidates, key=len)
+            if len(key) / len(best) >= MIN_PREFIX_COVERAGE:
+                return self._index[best], len(key) / len(best)
+
+        close = difflib.get_close_matches(core or key, self._keys, n=1, cutoff=self.match_cutoff)
+        if close:
+            score = difflib.SequenceMatcher(None, core or key, close[0]).ratio()
+            return self._index[close[0]], score
+        return None
+
+    def portion_grams(self, row: int, portion_size: str, fallback_grams: float = None) -> Optional[float]:
+        """
+        Convert a portion description ("150g", "1 cup", "2 medium", "1/2 cup (120 g)")
+        to grams for a table row
+        """
+        self._load()
+        text = str(portion_size or "").lower()
+        unit_grams, cup_grams = self._values[row, len(NUTRIENT_COLUMNS):]
+
+        explicit = _GRAMS_PATTERN.search(text)
+        if explicit:
+            return _parse_amount(explicit.group(1)) * GRAM_UNITS[explicit.group(2)]
+
+        counted = _COUNT_PATTERN.search(text)
+        if counted:
+            amount, unit = _parse_amount(counted.group(1)), counted.group(2)
+        else:
+            amount, unit = 1.0, next((word for word in text.split() if word in SIZE_FACTORS), None)
+            if unit is None:
+                return float(fallback_grams) if fallback_grams else None
+
+        if unit in CUP_UNITS:
+            grams = amount * CUP_UNITS[unit] * float(cup_grams) if cup_grams else None
+        elif unit is None or unit in SIZE_FACTORS or unit in COUNT_UNITS or _singular(unit) in self._words[row]:
+            grams = amount * SIZE_FACTORS.get(unit, 1.0) * float(unit_grams) if unit_grams else None
+        else:
+            # Unknown unit ("1 bowl"): trust the model's own gram estimate first
+            grams = None
+        if grams is None and fallback_grams:
+            grams = float(fallback_grams)
+        return grams
+
+    def lookup(self, food_name: str, portion_size: str, portion_grams: float = None) -> Optional[dict]:
+        """
+        Resolve a food name and portion to table nutrition, or None when the
+        food isn't in the table or the portion can't be converted to grams.
+        A matchScore below 1.0 means the name was only similar to the entry.
+        """
+        matched = self.match(food_name)
+        if matched is None:
+            return None
+        row, score = matched
+        grams = self.portion_grams(row, portion_size, portion_grams)
+        if not grams:
+            return None
+
+        per_100g = self._values[row, :len(NUTRIENT_COLUMNS)] * (grams / 100.0)
+        values = dict(zip(NUTRIENT_COLUMNS, (round(float(value), 1) for value in per_100g)))
+        return {
+            "matchedFood": self._names[row],
+            "matchScore": round(score, 2),
+            "grams": round(grams, 1),
+            "calories": round(values.pop("calories")),
+            "nutrition": values,
+        }
+
+    def reference_notes(self) -> List[Tuple[str, str]]:
+        """
+        (food name, one-line reference note) for every table row, the text
+        indexed for retrieval
+        """
+        self._load()
+        notes = []
+        for row, name in enumerate(self._names):
+            values = self._values[row]
+            nutrients = dict(zip(COLUMNS, (float(value) for value in values)))
+            text = (f"{name.capitalize()}"
+                    + (f" (also {', '.join(self._aliases[row])})" if self._aliases[row] else "")
+                    + f": per 100 g {nutrients['calories']:g} kcal, "
+                    + ", ".join(f"{nutrients[column]:g} g {column}" for column in NUTRIENT_COLUMNS[1:]))
+            if nutrients["unit_grams"]:
+                text += f". One unit is about {nutrients['unit_grams']:g} g"
+            if nutrients["cup_grams"]:
+                text += f". One cup is about {nutrients['cup_grams']:g} g"
+            notes.append((name, text + "."))
+        return notes
+
+def build(csv_path: Path = DATA_DIR / "foods.csv", out_dir: Path = DATA_DIR):
+    """
+    Compile the editable CSV into the columnar files loaded at runtime
+    """
+    with open(csv_path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    values = np.array([[float(row[column]) for column in COLUMNS] for row in rows], dtype=np.float32)
+    np.save(Path(out_dir) / "foods.npy", values)
+    metadata = {
+        "columns": COLUMNS,
+        "names": [row["name"] for row in rows],
+        "aliases": [[alias for alias in row["aliases"].split("|") if alias] for row in rows],
+    }
+    (Path(out_dir) / "foods.json").write_text(json.dumps(metadata, indent=1) + "\n")
+    return len(rows)
+
+# Global instance
+nutrition_db = NutritionDatabase(match_cutoff=settings.NUTRITION_MATCH_CUTOFF)
+
+if __name__ == "__main__":
+    print(f"Built nutrition table with {build()} foods")
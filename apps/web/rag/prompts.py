@@ -0,0 +1,230 @@
+"""
+Versioned prompt templates with reusable static prefixes.
+
+Each template is split into a static part (instructions, output format) that
+never changes between calls and a dynamic part filled in per request. The
+static part always comes first so repeated calls share a token prefix, and
+Gemini's implicit prefix caching is reported from the response usage
+metadata.
+
+Explicit context caching (uploading the static part once as CachedContent
+and sending only the dynamic part) needs a prefix of at least
+PROMPT_CACHE_MIN_TOKENS, the API minimum. The current templates' static
+parts are a few hundred tokens, far below it, so in practice only implicit
+caching applies; the explicit path only engages for a template that grows
+past the minimum. /prompts/stats reports which mode each prompt is in and why.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import random
+import string
+import textwrap
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Sequence
+from .config import settings
+from .utils.llm_client import generate_content, stream_content, token_usage_by_prompt
+from .utils.model_registry import model_registry
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a token in characters, for deciding whether a prefix is worth caching
+CHARS_PER_TOKEN = 4
+
+# Recreate a context cache this long before it expires rather than racing the expiry
+CACHE_REFRESH_MARGIN = 60
+
+class PromptTemplate:
+    """
+    A named, versioned prompt. The static text is used as-is; the dynamic
+    text is a str.format template. Bump the version whenever the wording changes.
+    """
+    def __init__(self, name: str, version: str, static: str, dynamic: str = ""):
+        self.name = name
+        self.version = version
+        self.static = textwrap.dedent(static).strip()
+        self.dynamic = textwrap.dedent(dynamic).strip()
+        # Field names are parsed once so render() can fail fast on missing values
+        self.fields = {
+            field.split("[")[0].split(".")[0]
+            for _, field, _, _ in string.Formatter().parse(self.dynamic) if field
+        }
+        self.fingerprint = hashlib.sha256(f"{self.static}\0{self.dynamic}".encode()).hexdigest()[:12]
+
+    @property
+    def static_tokens(self) -> int:
+        return len(self.static) // CHARS_PER_TOKEN
+
+    @property
+    def cache_version(self) -> str:
+        """
+        Identifies this exact prompt for result caches
+        """
+        return f"{self.name}:{self.version}:{self.fingerprint}"
+
+    def render_dynamic(self, **values) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise ValueError(f"Missing prompt values for {self.name}: {', '.join(sorted(missing))}")
+        return self.dynamic.format(**values)
+
+    def render(self, **values) -> str:
+        """
+        The whole prompt, static prefix first
+        """
+        dynamic = self.render_dynamic(**values)
+        return f"{self.static}\n\n{dynamic}" if dynamic else self.static
+
+class PromptRegistry:
+    """
+    Process-wide set of prompt templates and the context caches created for them
+    """
+    def __init__(self):
+        self._templates: Dict[str, PromptTemplate] = {}
+        # (template fingerprint, model name, generation config) -> (cached model, expires at)
+        self._cached_models: Dict[tuple, tuple] = {}
+        # Keys for which context caching failed or isn't supported
+        self._unavailable = set()
+        self._lock = asyncio.Lock()
+
+    def register(self, template: PromptTemplate) -> PromptTemplate:
+        self._templates[template.name] = template
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def render(self, name: str, **values) -> str:
+        return self.get(name).render(**values)
+
+    def _explicit_cache_status(self, template: PromptTemplate) -> str:
+        """
+        Why a template does or doesn't get an explicit context cache
+        """
+        if not settings.PROMPT_CACHE_ENABLED:
+            return "disabled"
+        if template.static_tokens < settings.PROMPT_CACHE_MIN_TOKENS:
+            return f"static prefix below PROMPT_CACHE_MIN_TOKENS ({settings.PROMPT_CACHE_MIN_TOKENS})"
+        if not model_registry.backend.supports_context_cache:
+            return "not supported by the model backend"
+        if any(key[0] == template.fingerprint for key in self._unavailable):
+            return "refused by the API"
+        return "eligible"
+
+    def _cacheable(self, template: PromptTemplate) -> bool:
+        return self._explicit_cache_status(template) == "eligible"
+
+    async def _cached_model(self, template: PromptTemplate, model) -> Optional["genai.GenerativeModel"]:
+        """
+        Model bound to a context cache holding the template's static text,
+        created on first use and refreshed before it expires. None when the
+        prefix is too small, caching is disabled, or the API refused it.
+        """
+        if not self._cacheable(template):
+            return None
+        generation_config = dict(model._generation_config)
+        key = (template.fingerprint, model.model_name, repr(sorted(generation_config.items())))
+        if key in self._unavailable:
+            return None
+
+        entry = self._cached_models.get(key)
+        if entry is not None and entry[1] - CACHE_REFRESH_MARGIN > time.monotonic():
+            return entry[0]
+
+        async with self._lock:
+            entry = self._cached_models.get(key)
+            if entry is not None and entry[1] - CACHE_REFRESH_MARGIN > time.monotonic():
+                return entry[0]
+            try:
+                # Only reached with the Gemini backend; the SDK is slow to import
+                import google.generativeai as genai
+                from google.generativeai import caching
+
+                cached_content = await asyncio.to_thread(
+                    caching.CachedContent.create,
+                    model=model.model_name,
+                    display_name=template.cache_version,
+                    contents=[template.static],
+                    ttl=datetime.timedelta(seconds=settings.PROMPT_CACHE_TTL),
+                )
+                cached_model = genai.GenerativeModel.from_cached_content(
+                    cached_content, generation_config=generation_config
+                )
+            except Exception as e:
+                logger.warning(f"Context caching unavailable for prompt {template.name}, sending it in full: {str(e)}")
+                self._unavailable.add(key)
+                return None
+            logger.info(f"Cached {template.static_tokens} prompt tokens for {template.cache_version}")
+            self._cached_models[key] = (cached_model, time.monotonic() + settings.PROMPT_CACHE_TTL)
+            return cached_model
+
+    async def prepare(self, name: str, model, values: dict = None, attachments: Sequence = ()):
+        """
+        Resolve a template into (model, contents) for one call: the cached-prefix
+        model with only the dynamic part when a context cache is available,
+        otherwise the given model with the whole prompt
+        """
+        template = self.get(name)
+        values = values or {}
+        self._log_prompt(template, values)
+        cached_model = await self._cached_model(template, model)
+        if cached_model is not None:
+            dynamic = template.render_dynamic(**values)
+            return cached_model, ([dynamic] if dynamic else []) + list(attachments)
+        return model, [template.render(**values)] + list(attachments)
+
+    def _log_prompt(self, template: PromptTemplate, values: dict):
+        """
+        Log a sample of rendered prompts at DEBUG as one JSON object per line
+        """
+        if logger.isEnabledFor(logging.DEBUG) and random.random() < settings.PROMPT_LOG_SAMPLE_RATE:
+            logger.debug(json.dumps({
+                "event": "prompt",
+                "prompt": template.name,
+                "version": template.version,
+                "fingerprint": template.fingerprint,
+                "dynamic": template.render_dynamic(**values),
+            }))
+
+    async def generate(self, name: str, model, values: dict = None, attachments: Sequence = (), **kwargs):
+        model, contents = await self.prepare(name, model, values, attachments)
+        return await generate_content(model, contents, usage_key=name, **kwargs)
+
+    async def stream(self, name: str, model, values: dict = None, attachments: Sequence = (), **kwargs):
+        model, contents = await self.prepare(name, model, values, attachments)
+        async for text in stream_content(model, contents, usage_key=name, **kwargs):
+            yield text
+
+    def stats(self) -> dict:
+        """
+        Per-prompt version, static prefix size and the prompt tokens Gemini
+        reported as served from cache, averaged per request. cacheMode is
+        "implicit" unless an explicit context cache is in use, and
+        explicitCache says why it is or isn't.
+        """
+        cached_fingerprints = {key[0] for key in self._cached_models}
+        report = {}
+        for name, template in sorted(self._templates.items()):
+            usage = token_usage_by_prompt.get(name, {})
+            calls = usage.get("calls", 0)
+            report[name] = {
+                "version": template.version,
+                "fingerprint": template.fingerprint,
+                "staticTokens": template.static_tokens,
+                "cacheMode": "explicit" if template.fingerprint in cached_fingerprints else "implicit",
+                "explicitCache": ("active" if template.fingerprint in cached_fingerprints
+                                  else self._explicit_cache_status(template)),
+                "calls": calls,
+                "promptTokens": usage.get("prompt", 0),
+                "cachedTokens": usage.get("cached", 0),
+                "tokensSavedPerRequest": round(usage.get("cached", 0) / calls, 1) if calls else 0.0,
+            }
+        return report
+
+# Global instance
+prompt_registry = PromptRegistry()
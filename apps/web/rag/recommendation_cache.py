@@ -0,0 +1,175 @@
+"""
+Shared recommendations for similar users.
+
+get_food_recommendations answers depend on a handful of profile and intake
+numbers, and many users fall within a few years, kilos and calories of each
+other. Each numeric field is snapped to the middle of a bucket of width
+RECOMMENDATION_BUCKETS[field] (0 keeps it exact) and categorical fields are
+normalised. The model then answers for the bucket, once per TTL, and
+everyone in the bucket shares the answer.
+
+Requested buckets are counted. When pre-warming is enabled, the most
+requested ones are regenerated during the off-peak hours, before they
+expire, so peak traffic is served from memory.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from .config import settings
+from .utils.admission import BATCH, call_priority
+from .utils.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FIELDS = ["age", "weight", "height"]
+CATEGORY_FIELDS = ["goal", "activity_level", "gender"]
+INTAKE_FIELDS = ["calories", "protein", "carbs", "fat"]
+
+# Buckets remembered for pre-warming; the least requested half is dropped past this
+MAX_TRACKED_BUCKETS = 4096
+
+Compute = Callable[[dict, dict], Awaitable[dict]]
+
+def parse_buckets(spec: str) -> Dict[str, float]:
+    """
+    "age:5,weight:2.5" -> {"age": 5.0, "weight": 2.5}
+    """
+    buckets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        field, _, width = item.partition(":")
+        buckets[field.strip()] = float(width)
+    return buckets
+
+def parse_hours(spec: str) -> Optional[Tuple[int, int]]:
+    if not spec.strip():
+        return None
+    start, _, end = spec.partition("-")
+    return int(start), int(end)
+
+def _snap(value, width: float):
+    if value is None or value == "":
+        return None
+    value = float(value)
+    if width <= 0:
+        return value
+    middle = (math.floor(value / width) + 0.5) * width
+    return int(middle) if middle == int(middle) else round(middle, 2)
+
+def _label(value) -> Optional[str]:
+    if value is None:
+        return None
+    return str(value).strip().upper().replace(" ", "_").replace("-", "_")
+
+class RecommendationCache:
+    def __init__(self, buckets: Dict[str, float], max_entries: int, ttl_seconds: float):
+        self.buckets = buckets
+        self.ttl_seconds = ttl_seconds
+        self._cache = ResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        # key -> [requests, profile, intake]
+        self._requested: Dict[str, list] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.prewarmed = 0
+        self.prewarm_errors = 0
+
+    def quantise(self, user_profile: dict, current_nutrition: dict) -> Tuple[dict, dict]:
+        """
+        The bucket's representative profile and intake
+        """
+        profile = {field: _snap(user_profile.get(field), self.buckets.get(field, 0)) for field in PROFILE_FIELDS}
+        profile.update({field: _label(user_profile.get(field)) for field in CATEGORY_FIELDS})
+        intake = {field: _snap(current_nutrition.get(field) or 0, self.buckets.get(field, 0))
+                  for field in INTAKE_FIELDS}
+        return profile, intake
+
+    def key(self, profile: dict, intake: dict, version: str) -> str:
+        return f"{json.dumps([profile, intake], sort_keys=True)}:{version}"
+
+    def _track(self, key: str, profile: dict, intake: dict):
+        entry = self._requested.get(key)
+        if entry is None:
+            if len(self._requested) >= MAX_TRACKED_BUCKETS:
+                ranked = sorted(self._requested.items(), key=lambda item: item[1][0], reverse=True)
+                self._requested = dict(ranked[:MAX_TRACKED_BUCKETS // 2])
+            entry = self._requested[key] = [0, profile, intake]
+        entry[0] += 1
+
+    async def get_or_compute(self, user_profile: dict, current_nutrition: dict, version: str,
+                             compute: Compute) -> dict:
+        """
+        Recommendations for this user's bucket, generated by compute(profile, intake) on a miss
+        """
+        profile, intake = self.quantise(user_profile, current_nutrition)
+        key = self.key(profile, intake, version)
+        self._track(key, profile, intake)
+        return await self._cache.get_or_compute(
+            key, lambda: compute(profile, intake), should_cache=lambda result: result['success']
+        )
+
+    async def prewarm(self, compute: Compute, version: str, top: int = None) -> int:
+        """
+        Regenerate the most requested buckets that are missing or past half their TTL
+        """
+        ranked = sorted(self._requested.values(), key=lambda entry: entry[0], reverse=True)
+        warmed = 0
+        for _, profile, intake in ranked[:top or settings.RECOMMENDATION_PREWARM_TOP]:
+            key = self.key(profile, intake, version)
+            if self._cache.ttl_remaining(key) > self.ttl_seconds / 2:
+                continue
+            try:
+                with call_priority(BATCH):
+                    result = await compute(profile, intake)
+            except Exception as e:
+                self.prewarm_errors += 1
+                logger.warning(f"Pre-warming recommendations failed: {str(e)}")
+                continue
+            if result['success']:
+                await self._cache.set(key, result)
+                warmed += 1
+        self.prewarmed += warmed
+        return warmed
+
+    def _off_peak(self) -> bool:
+        hours = parse_hours(settings.RECOMMENDATION_PREWARM_HOURS)
+        if hours is None:
+            return False
+        start, end = hours
+        hour = time.localtime().tm_hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    async def _prewarm_loop(self, compute: Compute, version: Callable[[], str]):
+        while True:
+            await asyncio.sleep(settings.RECOMMENDATION_PREWARM_INTERVAL)
+            if self._off_peak():
+                warmed = await self.prewarm(compute, version())
+                logger.info(f"Pre-warmed recommendations for {warmed} buckets")
+
+    def start(self, compute: Compute, version: Callable[[], str]):
+        """
+        Start the off-peak pre-warm job when RECOMMENDATION_PREWARM_ENABLED
+        """
+        if settings.RECOMMENDATION_PREWARM_ENABLED and self._task is None:
+            self._task = asyncio.ensure_future(self._prewarm_loop(compute, version))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "trackedBuckets": len(self._requested),
+            "prewarmed": self.prewarmed,
+            "prewarmErrors": self.prewarm_errors,
+        }
+
+# Global instance
+recommendation_cache = RecommendationCache(
+    buckets=parse_buckets(settings.RECOMMENDATION_BUCKETS),
+    max_entries=settings.RECOMMENDATION_CACHE_SIZE,
+    ttl_seconds=settings.RECOMMENDATION_CACHE_TTL
+)
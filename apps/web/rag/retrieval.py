@@ -0,0 +1,216 @@
+"""
+Retrieval for the advisor, over a local vector index (utils/vector_store.py).
+
+The index holds three kinds of entry:
+- "reference": one note per food in the bundled nutrition table, indexed
+  in the background at startup and re-embedded only when its text changes.
+- "analysis": a summary of each fresh image analysis by a known user,
+  added as analyses complete. Slots are reused oldest first past
+  ANALYSIS_NOTES_MAX_ENTRIES and notes older than ANALYSIS_NOTES_TTL are
+  ignored.
+- "advice": finished advice keyed by the request it answered. This is the
+  semantic cache: a new request whose embedding is within
+  SEMANTIC_CACHE_THRESHOLD of a past one gets that advice without a model
+  call. Advice slots are reused oldest first past SEMANTIC_CACHE_MAX_ENTRIES.
+
+Analysis and advice entries are scoped to the user they came from and only
+found by that user's requests; requests without a user id see reference
+notes only. Reference and analysis entries similar to an advice request are
+added to its prompt as notes.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import re
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from .config import settings
+from .nutrition_db import nutrition_db
+from .utils.admission import BATCH, call_priority
+from .utils.llm_client import embed_texts
+from .utils.model_registry import model_registry
+from .utils.vector_store import DirectoryInUse, VectorStore
+
+logger = logging.getLogger(__name__)
+
+NOTE_KINDS = ["reference", "analysis"]
+# Reference notes are shared by everyone
+SHARED = ""
+# Part of the index directory name; bumped when stored entries change meaning
+INDEX_LAYOUT = "scoped"
+
+def summarise_analysis(analysis: dict) -> str:
+    nutrition = analysis.get('nutrition', {})
+    text = (f"Previously analysed: {analysis.get('foodName', 'Unknown Food')}, "
+            f"{analysis.get('portionSize', 'unknown portion')}: {analysis.get('calories', 0)} kcal, "
+            + ", ".join(f"{nutrition.get(name, 0)} g {name}" for name in ['protein', 'carbs', 'fat', 'fiber', 'sugar']))
+    if analysis.get('ingredients'):
+        text += ". Ingredients: " + ", ".join(analysis['ingredients'])
+    return text + "."
+
+class KnowledgeBase:
+    def __init__(self):
+        self._store: Optional[VectorStore] = None
+        self._lock = threading.Lock()
+        self._tasks = set()
+        # Serialises slot claims so two entries don't take the same slot
+        self._slot_lock = threading.Lock()
+        self.counters = {"searches": 0, "semanticHits": 0, "semanticMisses": 0, "indexed": 0, "indexErrors": 0}
+
+    @property
+    def store(self) -> VectorStore:
+        with self._lock:
+            if self._store is None:
+                options = dict(
+                    mode=settings.RETRIEVAL_INDEX,
+                    lists=settings.RETRIEVAL_IVF_LISTS,
+                    probes=settings.RETRIEVAL_IVF_PROBES,
+                    subvectors=settings.RETRIEVAL_PQ_SUBVECTORS,
+                    min_train_rows=settings.RETRIEVAL_IVF_MIN_ROWS
+                )
+                directory = settings.RETRIEVAL_DIR
+                if not directory:
+                    self._store = VectorStore(settings.EMBEDDING_DIM, **options)
+                    return self._store
+                # Vectors from different embedding models can't be compared
+                space = (f"{model_registry.backend.name}-{settings.EMBEDDING_MODEL}-{settings.EMBEDDING_DIM}"
+                         f"-{INDEX_LAYOUT}")
+                directory = os.path.join(directory, re.sub(r"[^a-z0-9.-]+", "-", space.lower()))
+                # A store is written by one process; each worker takes the first index no other has open
+                for worker in itertools.count():
+                    try:
+                        self._store = VectorStore(
+                            settings.EMBEDDING_DIM, os.path.join(directory, f"worker-{worker}"), **options
+                        )
+                        break
+                    except DirectoryInUse:
+                        continue
+            return self._store
+
+    def _spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        """
+        Index the nutrition reference notes in the background
+        """
+        if settings.RETRIEVAL_ENABLED:
+            self._spawn(self._index_reference())
+
+    async def _index_reference(self):
+        try:
+            notes = nutrition_db.reference_notes()
+            stored = await asyncio.to_thread(self.store.texts, [f"food:{name}" for name, _ in notes])
+            changed = [(name, text) for name, text in notes if stored.get(f"food:{name}") != text]
+            if changed:
+                # Startup indexing yields model capacity to interactive requests
+                with call_priority(BATCH):
+                    vectors = await embed_texts([text for _, text in changed])
+                await asyncio.to_thread(
+                    self.store.upsert,
+                    [{"id": f"food:{name}", "kind": "reference", "text": text} for name, text in changed],
+                    vectors
+                )
+            self.counters["indexed"] += len(changed)
+            logger.info(f"Nutrition reference index ready ({len(changed)} of {len(notes)} notes embedded)")
+        except Exception as e:
+            self.counters["indexErrors"] += 1
+            logger.warning(f"Indexing nutrition reference notes failed: {str(e)}")
+
+    def _put(self, kind: str, limit: int, entry: dict, vector: np.ndarray):
+        # Entries of a kind take slots kind:0 .. kind:limit-1, then replace the oldest
+        with self._slot_lock:
+            store = self.store
+            used = store.counts().get(kind, 0)
+            slot = f"{kind}:{used}" if used < limit else store.oldest(kind)
+            store.upsert([{**entry, "id": slot, "kind": kind}], [vector])
+
+    def index_analysis(self, user_id: Optional[str], analysis: dict):
+        """
+        Add a fresh analysis result to the user's notes in the background
+        """
+        if settings.RETRIEVAL_ENABLED and user_id and settings.ANALYSIS_NOTES_MAX_ENTRIES > 0:
+            self._spawn(self._index_analysis(user_id, analysis))
+
+    async def _index_analysis(self, user_id: str, analysis: dict):
+        try:
+            text = summarise_analysis(analysis)
+            with call_priority(BATCH):
+                vectors = await embed_texts([text])
+            await asyncio.to_thread(
+                self._put, "analysis", settings.ANALYSIS_NOTES_MAX_ENTRIES,
+                {"text": text, "scope": user_id}, vectors[0]
+            )
+            self.counters["indexed"] += 1
+        except Exception as e:
+            self.counters["indexErrors"] += 1
+            logger.warning(f"Indexing analysis failed: {str(e)}")
+
+    async def embed_queries(self, texts: List[str]) -> np.ndarray:
+        return await embed_texts(texts, task_type="retrieval_query")
+
+    async def retrieve(self, vector: np.ndarray, k: int = None, user_id: Optional[str] = None) -> List[str]:
+        """
+        Text of the reference entries and the user's own recent analysis
+        entries closest to the query vector
+        """
+        self.counters["searches"] += 1
+        scopes = [SHARED, user_id] if user_id else [SHARED]
+        found = await asyncio.to_thread(
+            self.store.search, vector, k or settings.RETRIEVAL_TOP_K, NOTE_KINDS, scopes
+        )
+        oldest = time.time() - settings.ANALYSIS_NOTES_TTL
+        return [
+            entry["text"] for entry in found
+            if entry["score"] >= settings.RETRIEVAL_MIN_SCORE
+            and (entry["kind"] != "analysis" or entry["updatedAt"] >= oldest)
+        ]
+
+    async def find_advice(self, vector: np.ndarray, version: str, user_id: Optional[str]) -> Optional[str]:
+        """
+        Advice given to this user for a near-identical request, if any
+        """
+        if not settings.SEMANTIC_CACHE_ENABLED or not user_id:
+            return None
+        found = await asyncio.to_thread(self.store.search, vector, 1, ["advice"], [user_id])
+        for entry in found:
+            payload = entry["payload"] or {}
+            if (entry["score"] >= settings.SEMANTIC_CACHE_THRESHOLD and payload.get("version") == version
+                    and time.time() - entry["updatedAt"] <= settings.SEMANTIC_CACHE_TTL):
+                self.counters["semanticHits"] += 1
+                return payload["text"]
+        self.counters["semanticMisses"] += 1
+        return None
+
+    async def add_advice(self, query: str, vector: np.ndarray, version: str, text: str, user_id: Optional[str]):
+        if not settings.SEMANTIC_CACHE_ENABLED or settings.SEMANTIC_CACHE_MAX_ENTRIES <= 0 or not user_id:
+            return
+        await asyncio.to_thread(
+            self._put, "advice", settings.SEMANTIC_CACHE_MAX_ENTRIES,
+            {"text": query, "scope": user_id, "payload": {"version": version, "text": text}}, vector
+        )
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        with self._lock:
+            if self._store is not None:
+                self._store.close()
+                self._store = None
+
+    def stats(self) -> dict:
+        store = self._store
+        return {
+            **self.counters,
+            "entries": store.counts() if store is not None else {},
+            **(store.stats() if store is not None else {}),
+        }
+
+# Global instance
+knowledge_base = KnowledgeBase()
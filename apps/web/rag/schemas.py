@@ -0,0 +1,47 @@
+from typing import List
+from pydantic import BaseModel
+
+# Response schemas for Gemini structured output. Field names match the
+# JSON structures described in the prompts.
+
+class NutritionValues(BaseModel):
+    protein: float
+    carbs: float
+    fat: float
+    fiber: float
+    sugar: float
+
+class FoodAnalysis(BaseModel):
+    foodName: str
+    calories: float
+    confidence: float
+    nutrition: NutritionValues
+    portionSize: str
+    ingredients: List[str]
+    mealType: str
+    healthScore: float
+    tips: List[str]
+
+class PackedFoodAnalysis(FoodAnalysis):
+    index: int
+
+class FoodIdentification(BaseModel):
+    foodName: str
+    confidence: float
+    portionSize: str
+    portionGrams: float
+    mealType: str
+
+class NutritionEstimate(BaseModel):
+    calories: float
+    nutrition: NutritionValues
+
+class FoodRecommendation(BaseModel):
+    food: str
+    reason: str
+    calories: float
+    mealType: str
+
+class RecommendationAdvice(BaseModel):
+    recommendations: List[FoodRecommendation]
+    tips: List[str]
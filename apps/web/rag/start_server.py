@@ -1,29 +1,124 @@
 #!/usr/bin/env python3
 """
 Start the RAG FastAPI server for food image analysis
+
+    python start_server.py                 # production: one worker per CPU
+    python start_server.py --workers 4 --preload
+    python start_server.py --dev           # single process with auto-reload
+
+Defaults come from config.Settings (RAG_SERVER_* environment variables).
 """
-import uvicorn
+import argparse
+import importlib.util
 import os
+import sys
 from pathlib import Path
 
-if __name__ == "__main__":
-    # Change to the rag directory
-    os.chdir(Path(__file__).parent)
-    
+APP = "rag.main:app"
+WEB_DIR = Path(__file__).resolve().parent.parent
+
+def installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def parse_args(settings):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS,
+                        help="Worker processes, 0 for one per CPU")
+    parser.add_argument("--preload", action="store_true", default=settings.SERVER_PRELOAD,
+                        help="Import the app once before forking workers (needs gunicorn)")
+    parser.add_argument("--dev", action="store_true", help="Single process with auto-reload, for development only")
+    return parser.parse_args()
+
+def run_dev(args):
+    import uvicorn
+
+    uvicorn.run(APP, host=args.host, port=args.port, reload=True, reload_dirs=[str(WEB_DIR / "rag")])
+
+def run_production(args, settings, workers: int):
+    import uvicorn
+
+    # uvloop and httptools come with uvicorn[standard]; fall back to the pure-Python versions
+    loop = "uvloop" if installed("uvloop") else "asyncio"
+    http = "httptools" if installed("httptools") else "h11"
+    if loop == "asyncio" or http == "h11":
+        print(f"⚠️  uvloop/httptools not installed, using {loop}/{http}")
+
+    uvicorn.run(
+        APP,
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        backlog=settings.SERVER_BACKLOG,
+        timeout_keep_alive=settings.SERVER_KEEPALIVE,
+        timeout_graceful_shutdown=settings.SERVER_GRACEFUL_TIMEOUT,
+    )
+
+def run_preloaded(args, settings, workers: int):
+    """
+    Gunicorn with uvicorn workers: the app is imported once in the master and
+    shared copy-on-write by the forked workers. Models and HTTP clients are
+    still created per worker in the lifespan, after the fork.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "backlog": settings.SERVER_BACKLOG,
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+    }
+
+    class PreloadedServer(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from rag.main import app
+            return app
+
+    PreloadedServer().run()
+
+def main():
+    # Run from apps/web so the rag package and its relative imports resolve
+    os.chdir(WEB_DIR)
+    sys.path.insert(0, str(WEB_DIR))
+    from rag.config import settings
+
+    args = parse_args(settings)
+    workers = 1 if args.dev else (args.workers or os.cpu_count() or 1)
+    mode = "development (auto-reload)" if args.dev else f"production, {workers} worker(s)"
+    if args.preload and not args.dev:
+        mode += ", preloaded"
+    # Workers read the resolved count, e.g. to warn about per-process state
+    os.environ["RAG_SERVER_WORKERS"] = str(workers)
+    settings.SERVER_WORKERS = workers
+
     print("🚀 Starting RAG Food Analysis Server...")
-    print("📡 Server will be available at: http://localhost:8000")
-    print("📄 API Documentation: http://localhost:8000/docs")
-    print("✨ Health Check: http://localhost:8000/")
+    print(f"⚙️  Mode: {mode}")
+    print(f"📡 Server will be available at: http://localhost:{args.port}")
+    print(f"📄 API Documentation: http://localhost:{args.port}/docs")
+    print(f"✨ Health Check: http://localhost:{args.port}/")
     print("")
     print("🔧 Make sure you have GEMINI_API_KEY in your environment variables!")
-    print("💡 You can test the integration with: curl -X POST http://localhost:8000/analyze-image-url")
+    print(f"💡 You can test the integration with: curl -X POST http://localhost:{args.port}/analyze-image-url")
     print("")
-    
-    # Start the server
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-        reload_dirs=["."]
-    ) 
\ No newline at end of file
+
+    if args.dev:
+        run_dev(args)
+    elif args.preload:
+        if not installed("gunicorn"):
+            raise SystemExit("--preload needs gunicorn: pip install gunicorn")
+        run_preloaded(args, settings, workers)
+    else:
+        run_production(args, settings, workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+Tests run offline against the fake model backend; run from apps/web:
+    python -m pytest rag/tests
+"""
+import io
+import os
+import sys
+from pathlib import Path
+import pytest
+
+os.environ["RAG_MODEL_BACKEND"] = "fake"
+os.environ.setdefault("RAG_FAKE_MODEL_LATENCY", "0")
+os.environ.setdefault("RAG_FAKE_MODEL_LATENCY_SIGMA", "0")
+os.environ.setdefault("RAG_JOB_DB_PATH", "")
+
+# The rag package is imported from apps/web
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+@pytest.fixture
+def make_image():
+    """
+    Factory for small deterministic JPEGs, different for every index
+    """
+    from PIL import Image
+
+    def make(index: int = 0, size=(96, 72)) -> bytes:
+        image = Image.new("RGB", size, ((index * 37) % 256, (index * 91) % 256, (index * 53) % 256))
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=85)
+        return buffer.getvalue()
+    return make
@@ -0,0 +1,122 @@
+import asyncio
+import pytest
+from rag.utils.admission import BATCH, INTERACTIVE, AdmissionController, Overloaded, TokenBucket
+
+class RateLimited(Exception):
+    code = 429
+
+def controller(**overrides) -> AdmissionController:
+    options = dict(rate=1000.0, burst=1000, queue_size=8, queue_timeout=5.0,
+                   initial_limit=4, min_limit=1, max_limit=16, target_latency=1.0)
+    return AdmissionController(**{**options, **overrides})
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=10, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert 0 < bucket.delay() <= 0.1
+
+def test_limit_grows_about_one_per_window_of_fast_calls():
+    limiter = controller(initial_limit=4)
+
+    async def run():
+        for _ in range(4):
+            async with limiter.slot():
+                pass
+
+    asyncio.run(run())
+    assert limiter.limit == pytest.approx(5.0, abs=0.2)
+    assert limiter.counters["admitted"] == 4
+
+def test_rate_limit_and_slow_calls_halve_the_limit():
+    limiter = controller(initial_limit=8, target_latency=0.2)
+
+    async def run():
+        with pytest.raises(RateLimited):
+            async with limiter.slot():
+                raise RateLimited()
+        halved = limiter.limit
+        # Within the same latency window a second signal doesn't halve again
+        with pytest.raises(RateLimited):
+            async with limiter.slot():
+                raise RateLimited()
+        after_repeat = limiter.limit
+        limiter._last_decrease = 0.0
+        async with limiter.slot():
+            await asyncio.sleep(0.25)
+        return halved, after_repeat, limiter.limit
+
+    assert asyncio.run(run()) == (4.0, 4.0, 2.0)
+    assert limiter.counters["rateLimited"] == 2
+    assert limiter.counters["slow"] == 1
+
+def test_limit_stays_within_bounds():
+    limiter = controller(initial_limit=1, min_limit=1, max_limit=1)
+
+    async def run():
+        for _ in range(5):
+            async with limiter.slot():
+                pass
+        with pytest.raises(RateLimited):
+            async with limiter.slot():
+                raise RateLimited()
+
+    asyncio.run(run())
+    assert limiter.limit == 1
+
+def test_interactive_callers_go_ahead_of_queued_batch_work():
+    limiter = controller(initial_limit=1, max_limit=1)
+    order = []
+
+    async def caller(name: str, priority: int):
+        async with limiter.slot(priority):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        blocker = asyncio.ensure_future(caller("first", INTERACTIVE))
+        await asyncio.sleep(0)
+        batch = asyncio.ensure_future(caller("batch", BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(caller("interactive", INTERACTIVE))
+        await asyncio.gather(blocker, batch, interactive)
+
+    asyncio.run(run())
+    assert order == ["first", "interactive", "batch"]
+
+def test_full_queue_sheds_batch_work_for_interactive_callers():
+    limiter = controller(initial_limit=1, max_limit=1, queue_size=1)
+
+    async def hold(priority: int, seconds: float):
+        async with limiter.slot(priority):
+            await asyncio.sleep(seconds)
+
+    async def run():
+        blocker = asyncio.ensure_future(hold(INTERACTIVE, 0.05))
+        await asyncio.sleep(0)
+        batch = asyncio.ensure_future(hold(BATCH, 0))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(hold(INTERACTIVE, 0))
+        await asyncio.sleep(0)
+        # The queue now holds an interactive caller, so another one can't displace it
+        with pytest.raises(Overloaded):
+            await hold(INTERACTIVE, 0)
+        results = await asyncio.gather(blocker, batch, interactive, return_exceptions=True)
+        return [type(result).__name__ for result in results]
+
+    assert asyncio.run(run()) == ["NoneType", "Overloaded", "NoneType"]
+    assert limiter.counters["rejected"] == 2
+
+def test_queue_wait_times_out_with_retry_after():
+    limiter = controller(initial_limit=1, max_limit=1, queue_timeout=0.02)
+
+    async def run():
+        async with limiter.slot():
+            with pytest.raises(Overloaded) as error:
+                async with limiter.slot():
+                    pass
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.status_code == 503 and error.retry_after >= 1
+    assert limiter.counters["timedOut"] == 1
+    assert limiter.in_flight == 0
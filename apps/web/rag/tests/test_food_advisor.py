@@ -0,0 +1,46 @@
+import asyncio
+from types import SimpleNamespace
+from rag import food_advisor
+from rag.food_advisor import FoodAdvisor
+from rag.prompts import prompt_registry
+from rag.utils.result_cache import ResultCache
+
+PROFILE = {"age": 30, "current_weight": 70, "health_goals": "lose weight"}
+ANALYSIS = {"foodName": "ramen", "portionSize": "1 bowl", "calories": 600, "confidence": 0.9,
+            "nutrition": {"protein": 20, "carbs": 80, "fat": 20, "fiber": 4, "sugar": 5}}
+
+def test_exact_advice_cache_is_per_user(monkeypatch):
+    notes = {"alice": ["Alice ate ramen yesterday."], "bob": ["Bob avoids gluten."]}
+
+    async def retrieve(vector, k=None, user_id=None):
+        return notes.get(user_id, [])
+
+    async def find_advice(vector, version, user_id):
+        return None
+
+    async def add_advice(*args):
+        pass
+
+    async def generate(name, model, values=None, **kwargs):
+        # Advice that echoes the notes it was grounded in
+        return SimpleNamespace(text=values["notes"])
+
+    monkeypatch.setattr(food_advisor.knowledge_base, "retrieve", retrieve)
+    monkeypatch.setattr(food_advisor.knowledge_base, "find_advice", find_advice)
+    monkeypatch.setattr(food_advisor.knowledge_base, "add_advice", add_advice)
+    monkeypatch.setattr(prompt_registry, "generate", generate)
+    monkeypatch.setattr(food_advisor, "advice_cache", ResultCache(max_entries=10, ttl_seconds=60))
+
+    async def run():
+        advice = [
+            (await FoodAdvisor(PROFILE, user).get_recommendation(ANALYSIS))["analysis"]
+            for user in ["alice", "bob", "alice"]
+        ]
+        streamed = "".join([text async for text in FoodAdvisor(PROFILE, "bob").stream_recommendation(ANALYSIS)])
+        return advice, streamed
+
+    (alice, bob, alice_again), streamed = asyncio.run(run())
+    assert "Alice" in alice and "Bob" not in alice
+    assert "Bob" in bob and "Alice" not in bob
+    assert alice_again == alice
+    assert streamed == bob
@@ -0,0 +1,35 @@
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from rag import food
+
+def proxy(monkeypatch, handler) -> TestClient:
+    monkeypatch.setattr(food, "_proxy_client", httpx.AsyncClient(
+        transport=httpx.MockTransport(handler), base_url="http://rag.test"
+    ))
+    app = FastAPI()
+    app.include_router(food.router)
+    return TestClient(app)
+
+FORM = {"age": "31", "current_weight": "72.5", "goal_weight": "70", "health_goals": "eat better"}
+FILES = {"file": ("meal.jpg", b"jpeg bytes", "image/jpeg")}
+
+def test_form_and_file_are_forwarded_with_the_user_id(monkeypatch):
+    seen = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen["body"] = request.read()
+        return httpx.Response(200, json={"recommendation": "ok"})
+
+    response = proxy(monkeypatch, handler).post(
+        "/api/food/analyze", data={**FORM, "user_id": "alice"}, files=FILES
+    )
+    assert response.json() == {"recommendation": "ok"}
+    assert b'name="user_id"\r\n\r\nalice\r\n' in seen["body"]
+    assert b'filename="meal.jpg"' in seen["body"] and b"jpeg bytes" in seen["body"]
+
+def test_non_json_upstream_errors_are_passed_on(monkeypatch):
+    client = proxy(monkeypatch, lambda request: httpx.Response(502, text="<html>Bad Gateway</html>"))
+    response = client.post("/api/food/analyze", data=FORM, files=FILES)
+    assert response.status_code == 502
+    assert response.json() == {"detail": "<html>Bad Gateway</html>"}
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+from rag.food_image_analyzer import FoodImageAnalyzer, ImagePacker
+from rag.utils import model_backends
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+    generate = model_backends.FakeModel.generate_content_async
+
+    async def counted(self, contents, *args, **kwargs):
+        calls.append(contents)
+        return await generate(self, contents, *args, **kwargs)
+
+    monkeypatch.setattr(model_backends.FakeModel, "generate_content_async", counted)
+    return calls
+
+def test_pack_is_analysed_in_one_call(make_image, model_calls, monkeypatch):
+    monkeypatch.setattr("rag.food_image_analyzer.settings.PACK_SIZE", 4)
+    results = asyncio.run(FoodImageAnalyzer().analyze_food_images([make_image(i) for i in range(3)]))
+    assert [result['success'] for result in results] == [True, True, True]
+    assert len(model_calls) == 1
+
+def test_programming_errors_in_a_pack_surface(make_image, monkeypatch):
+    async def broken(self, *args, **kwargs):
+        raise TypeError("bad schema")
+
+    monkeypatch.setattr(model_backends.FakeModel, "generate_content_async", broken)
+    with pytest.raises(TypeError):
+        asyncio.run(FoodImageAnalyzer()._analyze_pack([make_image(0), make_image(1)]))
+
+def test_pack_is_cancelled_when_every_waiter_is(make_image):
+    analyzer = FoodImageAnalyzer()
+    sent, cancelled = [], asyncio.Event()
+
+    async def slow_pack(images):
+        sent.append(len(images))
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    analyzer.analyze_food_images = slow_pack
+    packer = ImagePacker(analyzer, linger=0.01)
+
+    async def run():
+        waiters = [asyncio.ensure_future(packer.analyze_food_image(make_image(i))) for i in range(3)]
+        await asyncio.sleep(0)
+        # Gone before the pack is sent: left out of it
+        waiters[0].cancel()
+        await asyncio.sleep(0.05)
+        for waiter in waiters[1:]:
+            waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(run())
+    assert sent == [2]
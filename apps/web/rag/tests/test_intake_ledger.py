@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from rag.intake_ledger import WINDOW_DAYS, IntakeLedger
+
+DAY = 740000
+
+def meal(calories: float, protein: float = 10) -> dict:
+    return {"calories": calories, "nutrition": {"protein": protein, "carbs": 20, "fat": 5, "fiber": 2, "sugar": 1}}
+
+def ledger(tmp_path, max_users: int = 16) -> IntakeLedger:
+    return IntakeLedger(str(tmp_path / "intake.sqlite3"), max_users=max_users, flush_interval=60)
+
+def test_windows_sum_the_right_days(tmp_path):
+    intake = ledger(tmp_path)
+
+    async def run():
+        await intake.record("alice", meal(500), day=DAY)
+        await intake.record("alice", meal(300), day=DAY)
+        await intake.record("alice", meal(700), day=DAY - 3)
+        await intake.record("alice", meal(900), day=DAY - 20)
+        return await intake.summary("alice", day=DAY)
+
+    summary = asyncio.run(run())
+    assert (summary["today"]["calories"], summary["today"]["meals"]) == (800, 2)
+    assert summary["last7Days"]["calories"] == 1500
+    assert summary["last30Days"]["calories"] == 2400
+    assert summary["last30Days"]["meals"] == 4
+    assert summary["last7Days"]["dailyAverage"]["calories"] == pytest.approx(1500 / 7, abs=0.1)
+
+def test_ring_rows_are_reused_as_days_pass(tmp_path):
+    intake = ledger(tmp_path)
+
+    async def run():
+        await intake.record("alice", meal(500), day=DAY)
+        # Same ring row, WINDOW_DAYS later: the old day is cleared, not added to
+        await intake.record("alice", meal(200), day=DAY + WINDOW_DAYS)
+        # Older than the window for that row: ignored
+        await intake.record("alice", meal(999), day=DAY)
+        return (await intake.summary("alice", day=DAY + WINDOW_DAYS),
+                await intake.summary("alice", day=DAY + 2 * WINDOW_DAYS))
+
+    latest, later = asyncio.run(run())
+    assert latest["today"]["calories"] == 200
+    assert latest["last30Days"]["calories"] == 200
+    assert later["last30Days"]["meals"] == 0
+
+def test_evicted_users_reload_flushed_and_pending_rows(tmp_path):
+    intake = ledger(tmp_path, max_users=2)
+
+    async def run():
+        await intake.record("alice", meal(500), day=DAY - 1)
+        await intake.flush()
+        await intake.record("alice", meal(300), day=DAY)
+        # Two more users evict alice before her latest row is flushed
+        await intake.record("bob", meal(100), day=DAY)
+        await intake.record("carol", meal(100), day=DAY)
+        summary = await intake.summary("alice", day=DAY)
+        await intake.close()
+        return summary
+
+    summary = asyncio.run(run())
+    assert summary["today"]["calories"] == 300
+    assert summary["last7Days"]["calories"] == 800
+    assert intake.counters["evictions"] >= 1
+    assert intake.stats()["users"] == 2
+
+    reopened = ledger(tmp_path)
+    assert asyncio.run(reopened.summary("alice", day=DAY))["last7Days"]["meals"] == 2
+
+def test_workers_sharing_a_file_add_up_each_others_meals(tmp_path):
+    first, second = ledger(tmp_path), ledger(tmp_path)
+
+    async def run():
+        await first.record("alice", meal(500), day=DAY)
+        await second.record("alice", meal(300), day=DAY)
+        await first.flush()
+        await second.flush()
+        # Loaded before the other worker's meal was stored
+        await first.record("alice", meal(100), day=DAY)
+        return await first.summary("alice", day=DAY), await second.summary("alice", day=DAY)
+
+    seen_by_first, seen_by_second = asyncio.run(run())
+    assert (seen_by_first["today"]["calories"], seen_by_first["today"]["meals"]) == (900, 3)
+    assert (seen_by_second["today"]["calories"], seen_by_second["today"]["meals"]) == (800, 2)
+
+def test_failed_flush_keeps_meals_for_the_next_one(tmp_path, monkeypatch):
+    intake = ledger(tmp_path)
+    add = intake.store.add
+
+    def fail(rows):
+        raise OSError("disk full")
+
+    async def run():
+        await intake.record("alice", meal(500), day=DAY)
+        monkeypatch.setattr(intake.store, "add", fail)
+        await intake.flush()
+        await intake.record("alice", meal(300), day=DAY)
+        monkeypatch.setattr(intake.store, "add", add)
+        await intake.flush()
+
+    asyncio.run(run())
+    assert intake.counters["flushErrors"] == 1 and intake.stats()["pendingRows"] == 0
+    assert asyncio.run(ledger(tmp_path).summary("alice", day=DAY))["today"]["calories"] == 800
+
+def test_an_analysis_is_counted_once_per_user(tmp_path):
+    intake = ledger(tmp_path)
+
+    async def run():
+        for user_id in ["alice", "alice", "bob"]:
+            await intake.record(user_id, meal(500), day=DAY, analysis_id="photo-1")
+        await intake.record("alice", meal(300), day=DAY, analysis_id="photo-2")
+        return await intake.summary("alice", day=DAY), await intake.summary("bob", day=DAY)
+
+    alice, bob = asyncio.run(run())
+    assert (alice["today"]["meals"], alice["today"]["calories"]) == (2, 800)
+    assert bob["today"]["meals"] == 1
+    assert intake.counters["duplicates"] == 1
@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import httpx
+import pytest
+from rag.config import settings
+from rag.jobs import JobQueue, check_callback_url
+from rag.utils.admission import Overloaded
+
+@pytest.mark.parametrize("url", [
+    "ftp://example.com/hook",
+    "http://127.0.0.1/hook",
+    "http://localhost:8000/hook",
+    "http://169.254.169.254/latest/meta-data",
+    "http://10.0.0.5/hook",
+    "http://192.168.1.10/hook",
+    "http://[::1]/hook",
+])
+def test_callbacks_to_internal_addresses_are_rejected(url):
+    with pytest.raises(ValueError):
+        asyncio.run(check_callback_url(url))
+
+def test_callbacks_to_public_addresses_are_accepted():
+    asyncio.run(check_callback_url("https://93.184.216.34/hook"))
+
+def test_allowlist_replaces_the_address_check(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_WEBHOOK_ALLOWED_HOSTS", "hooks.internal, 127.0.0.1")
+    asyncio.run(check_callback_url("http://127.0.0.1:9000/hook"))
+    with pytest.raises(ValueError):
+        asyncio.run(check_callback_url("https://93.184.216.34/hook"))
+
+async def succeed(image, user_id):
+    return {'success': True, 'data': {'foodName': image.decode(), 'user': user_id}}
+
+async def wait_for(queue: JobQueue, job_id: str, statuses=("succeeded", "failed")) -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} stuck in {job['status']}")
+
+def test_jobs_run_and_deduplicate_per_user():
+    async def run():
+        queue = JobQueue("", workers=2)
+        first = await queue.submit("hash-a", b"apple", "alice")
+        again = await queue.submit("hash-a", b"apple", "alice")
+        other = await queue.submit("hash-a", b"apple", "bob")
+        queue.start(succeed)
+        done = await wait_for(queue, first["jobId"])
+        await wait_for(queue, other["jobId"])
+        after = await queue.submit("hash-a", b"apple", "alice")
+        await queue.refresh()
+        await queue.close()
+        return first, again, other, done, after, queue.stats()
+
+    first, again, other, done, after, stats = asyncio.run(run())
+    assert again == {"jobId": first["jobId"], "deduplicated": True}
+    assert other["jobId"] != first["jobId"]
+    assert after["jobId"] == first["jobId"]
+    assert done["result"] == {"foodName": "apple", "user": "alice"}
+    assert stats["succeeded"] == 2 and stats["queued"] == 0 and stats["deduplicated"] == 2
+
+def test_overloaded_jobs_are_requeued_until_retry_after():
+    calls = []
+
+    async def overloaded_once(image, user_id):
+        calls.append(image)
+        if len(calls) == 1:
+            raise Overloaded("busy", retry_after=0.05)
+        return await succeed(image, user_id)
+
+    async def run():
+        queue = JobQueue("", workers=1)
+        job = await queue.submit("hash-b", b"bread")
+        queue.start(overloaded_once)
+        done = await wait_for(queue, job["jobId"])
+        await queue.close()
+        return done, queue.counters
+
+    done, counters = asyncio.run(run())
+    assert done["status"] == "succeeded"
+    assert counters["requeued"] == 1 and len(calls) == 2
+
+def test_abandoned_jobs_are_requeued_then_failed():
+    queue = JobQueue("", workers=1)
+    store = queue.store
+    job_id, _ = store.submit("hash-c", "", None, b"cake", 0.0, 0.0)
+    for attempt in range(settings.JOB_MAX_ATTEMPTS):
+        now = 10.0 * attempt
+        assert store.claim(now)[0] == job_id
+        assert store.get(job_id)[1] == "running"
+        assert store.expire(leased_before=now + 1, max_attempts=settings.JOB_MAX_ATTEMPTS, now=now + 2) == 1
+    status, error = store.get(job_id)[1], store.get(job_id)[3]
+    assert status == "failed" and "abandoned" in error
+
+def test_interrupted_jobs_are_requeued_on_close():
+    started = asyncio.Event()
+
+    async def hang(image, user_id):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def run():
+        queue = JobQueue("", workers=1)
+        job = await queue.submit("hash-d", b"dates")
+        queue.start(hang)
+        await started.wait()
+        await queue.close()
+        return await queue.get(job["jobId"]), queue.store.claim(1e12)
+
+    job, claim = asyncio.run(run())
+    assert job["status"] == "queued"
+    assert claim is not None
+
+def test_webhooks_are_signed_and_do_not_follow_redirects(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_WEBHOOK_ALLOWED_HOSTS", "hooks.test")
+    monkeypatch.setattr(settings, "JOB_WEBHOOK_SECRET", "secret")
+    received = []
+
+    def receive(request: httpx.Request) -> httpx.Response:
+        received.append(request)
+        return httpx.Response(200)
+
+    async def run():
+        queue = JobQueue("", workers=1)
+        assert queue._webhook_client().follow_redirects is False
+        queue._client = httpx.AsyncClient(transport=httpx.MockTransport(receive), follow_redirects=False)
+        job = await queue.submit("hash-e", b"eggs", callback_url="http://hooks.test/done")
+        queue.start(succeed)
+        await wait_for(queue, job["jobId"])
+        while queue._deliveries:
+            await asyncio.sleep(0.01)
+        await queue.close()
+        return queue.counters
+
+    counters = asyncio.run(run())
+    assert counters["webhooksDelivered"] == 1
+    body = received[0].content
+    assert json.loads(body)["status"] == "succeeded"
+    expected = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+    assert received[0].headers["X-Signature"] == f"sha256={expected}"
+
+def test_in_memory_queue_refuses_several_workers(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "SERVER_WORKERS", 2)
+
+    async def process(image, user_id):
+        return {"success": True, "data": {}}
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            JobQueue("", workers=1).start(process)
+        shared = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=1)
+        shared.start(process)
+        await shared.close()
+
+    asyncio.run(run())
@@ -0,0 +1,52 @@
+import asyncio
+from rag.config import settings
+from rag.utils.admission import admission
+from rag.utils import llm_client
+from rag.utils.llm_client import get_model, stream_content
+from rag.utils.model_backends import CANNED_RESPONSES
+
+def test_stream_releases_slot_before_slow_client_reads():
+    async def run():
+        stream = stream_content(get_model(), "Give advice", usage_key="test")
+        first = await stream.__anext__()
+        # The client stalls; the upstream is read to the end meanwhile
+        for _ in range(100):
+            if admission.in_flight == 0:
+                break
+            await asyncio.sleep(0.01)
+        released = admission.in_flight == 0
+        rest = [text async for text in stream]
+        return released, first + "".join(rest)
+
+    released, text = asyncio.run(run())
+    assert released
+    assert text == CANNED_RESPONSES["advice"]
+
+def test_closing_stream_early_cancels_upstream(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_MODEL_LATENCY", 2.0)
+    monkeypatch.setattr(settings, "FAKE_MODEL_LATENCY_SIGMA", 0.0)
+
+    async def run():
+        stream = stream_content(get_model(), "Give advice", usage_key="test")
+        await stream.__anext__()
+        assert admission.in_flight == 1
+        await stream.aclose()
+        await asyncio.sleep(0)
+        return admission.in_flight
+
+    assert asyncio.run(run()) == 0
+
+def test_full_buffer_keeps_the_slot_until_the_client_reads(monkeypatch):
+    monkeypatch.setattr(llm_client, "STREAM_BUFFER_CHUNKS", 1)
+
+    async def run():
+        stream = stream_content(get_model(), "Give advice", usage_key="test")
+        first = await stream.__anext__()
+        await asyncio.sleep(0.05)
+        held = admission.in_flight
+        rest = [text async for text in stream]
+        return held, first + "".join(rest), admission.in_flight
+
+    held, text, released = asyncio.run(run())
+    assert (held, released) == (1, 0)
+    assert text == CANNED_RESPONSES["advice"]
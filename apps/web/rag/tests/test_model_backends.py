@@ -0,0 +1,31 @@
+import asyncio
+import pytest
+from rag.config import settings
+from rag.utils.model_backends import FakeBackend, FakeUpstreamError
+
+def test_fake_quota_answers_429_past_the_per_minute_limit(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_MODEL_RPM", 3)
+    backend = FakeBackend()
+    backend.configure()
+    model = backend.create_model("test", {})
+
+    async def run():
+        for _ in range(3):
+            await model.generate_content_async("Give advice")
+        with pytest.raises(FakeUpstreamError) as error:
+            await model.generate_content_async("Give advice")
+        return error.value.code
+
+    assert asyncio.run(run()) == 429
+
+def test_fake_backend_tracks_upstream_concurrency(monkeypatch):
+    monkeypatch.setattr(settings, "FAKE_MODEL_LATENCY", 0.05)
+    monkeypatch.setattr(settings, "FAKE_MODEL_LATENCY_SIGMA", 0.0)
+    backend = FakeBackend()
+    model = backend.create_model("test", {})
+
+    async def run():
+        await asyncio.gather(*(model.generate_content_async("Give advice") for _ in range(5)))
+
+    asyncio.run(run())
+    assert (backend.peak_in_flight, backend.in_flight) == (5, 0)
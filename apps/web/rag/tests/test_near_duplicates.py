@@ -0,0 +1,74 @@
+import asyncio
+import random
+from rag import main
+from rag.intake_ledger import IntakeLedger
+from rag.utils import preprocess
+from rag.utils.near_duplicates import BKTree, NearDuplicateIndex, hamming
+
+def test_bk_tree_search_matches_brute_force():
+    generator = random.Random(7)
+    hashes = [generator.getrandbits(64) for _ in range(500)]
+    tree = BKTree()
+    for value in hashes:
+        tree.add(value, value)
+    query = hashes[0] ^ 0b1011
+    found = tree.search(query, 10)
+    expected = sorted(hamming(query, value) for value in hashes if hamming(query, value) <= 10)
+    assert [distance for distance, _ in found] == expected
+    assert found[0] == (3, hashes[0])
+
+def test_index_is_scoped_by_user_and_version():
+    index = NearDuplicateIndex(threshold=4, ttl_seconds=60, per_user=8, max_users=8)
+    index.add("alice", 0b1111, "v1", "result")
+    assert index.find("alice", 0b0111, "v1") == "result"
+    assert index.find("bob", 0b1111, "v1") is None
+    assert index.find("alice", 0b1111, "v2") is None
+    assert index.find("alice", 0b1111 ^ (2 ** 40 - 1), "v1") is None
+
+def test_index_bounds_entries_per_user_and_users():
+    index = NearDuplicateIndex(threshold=0, ttl_seconds=60, per_user=2, max_users=2)
+    for value in range(3):
+        index.add("alice", value, "v1", value)
+    assert index.find("alice", 0, "v1") is None
+    assert index.find("alice", 2, "v1") == 2
+    index.add("bob", 5, "v1", 5)
+    index.add("carol", 6, "v1", 6)
+    assert index.find("alice", 2, "v1") is None
+
+def test_index_expires_entries():
+    index = NearDuplicateIndex(threshold=0, ttl_seconds=0, per_user=8, max_users=8)
+    index.add("alice", 1, "v1", "result")
+    assert index.find("alice", 1, "v1") is None
+
+def test_hash_of_prepared_image_matches_raw_photo(make_image):
+    data = make_image(3, size=(2400, 1800))
+    prepared, image_hash = preprocess.prepare_and_hash(data, "phash")
+    assert prepared["data"]
+    assert hamming(image_hash, preprocess.perceptual_hash(data, "phash")) <= 6
+
+def test_user_analysis_decodes_the_photo_once(make_image, monkeypatch):
+    decodes = []
+    open_image = preprocess.open_image
+
+    def counted(data):
+        decodes.append(len(data))
+        return open_image(data)
+
+    monkeypatch.setattr(preprocess, "open_image", counted)
+    result = asyncio.run(main.analyze_image_data(make_image(11, size=(1600, 1200)), user_id="decode-once"))
+    assert result['success']
+    assert len(decodes) == 1
+
+def test_meal_first_analysed_elsewhere_is_counted_once(make_image, monkeypatch):
+    monkeypatch.setattr(main, "intake_ledger", IntakeLedger("", max_users=16, flush_interval=60))
+
+    async def run():
+        # Analysed without recording intake (e.g. by /analyze), then logged from a near-identical photo twice
+        await main.analyze_image_data(make_image(21, size=(640, 480)), user_id="logger")
+        for _ in range(2):
+            analysis = await main.analyze_image_data(make_image(21, size=(630, 470)), user_id="logger")
+            assert analysis['nearDuplicate']
+            await main.record_intake("logger", analysis)
+        return await main.intake_ledger.summary("logger")
+
+    assert asyncio.run(run())["today"]["meals"] == 1
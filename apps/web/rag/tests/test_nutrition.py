@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from rag.nutrition import daily_targets, targets_for_profile
+
+def profile(**overrides) -> dict:
+    return {"weight": 80, "height": 180, "age": 30, "gender": "male", "activity_level": "MODERATE",
+            "goal": "MAINTAIN", **overrides}
+
+def test_web_app_goals_adjust_calories_and_macros():
+    maintain = targets_for_profile(profile())
+    # 10 * 80 + 6.25 * 180 - 5 * 30 + 5 = 1780 kcal BMR
+    assert maintain["calories"] == round(1780 * 1.55)
+    assert targets_for_profile(profile(goal="LOSE_FAT"))["calories"] == maintain["calories"] - 500
+
+    muscle = targets_for_profile(profile(goal="BUILD_MUSCLE"))
+    assert muscle["calories"] == maintain["calories"] + 500
+    assert muscle["protein"] == round(muscle["calories"] * 0.30 / 4)
+    assert targets_for_profile(profile(goal="build muscle")) == muscle
+
+def test_targets_are_vectorised_over_profiles():
+    targets = daily_targets([80, 60], [180, 165], [30, 45], ["male", "female"], ["MODERATE", "LOW"],
+                            ["BUILD_MUSCLE", "LOSE_FAT"])
+    singles = [targets_for_profile(profile(goal="BUILD_MUSCLE")),
+               targets_for_profile(dict(weight=60, height=165, age=45, gender="female",
+                                        activity_level="LOW", goal="LOSE_FAT"))]
+    for name, values in targets.items():
+        assert np.asarray(values).tolist() == pytest.approx([single[name] for single in singles])
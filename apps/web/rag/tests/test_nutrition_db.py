@@ -0,0 +1,60 @@
+import pytest
+from rag.food_image_analyzer import fill_from_database
+from rag.nutrition_db import nutrition_db
+
+def analysis(food_name: str, portion_size: str, **extra) -> dict:
+    return {
+        "foodName": food_name, "portionSize": portion_size, "calories": 250,
+        "nutrition": {"protein": 5, "carbs": 30, "fat": 12, "fiber": 3, "sugar": 2}, **extra
+    }
+
+@pytest.mark.parametrize("name, expected", [
+    ("Banana", "banana"),
+    ("bananas", "banana"),
+    ("Grilled chicken breast", "chicken breast"),
+    ("mashed potatoes", "mashed potato"),
+    ("crisps", "potato chips"),
+])
+def test_exact_and_alias_matches_score_one(name, expected):
+    row, score = nutrition_db.match(name)
+    assert score == 1.0
+    assert nutrition_db.lookup(name, "100g")["matchedFood"] == expected
+
+def test_similar_names_score_below_one():
+    _, score = nutrition_db.match("Sweet potato fries")
+    assert score < 1.0
+    assert nutrition_db.match("Chicken") is None
+
+def test_scaling_by_grams_cups_and_units():
+    # banana: 89 kcal and 22.8 g carbs per 100 g, 118 g each, 150 g per cup
+    assert nutrition_db.lookup("banana", "100g")["calories"] == 89
+    assert nutrition_db.lookup("banana", "250 g")["nutrition"]["carbs"] == 57.0
+    assert nutrition_db.lookup("banana", "1/2 cup")["grams"] == 75.0
+    assert nutrition_db.lookup("banana", "2 bananas")["grams"] == 236.0
+    assert nutrition_db.lookup("banana", "1 large")["grams"] == pytest.approx(147.5)
+    assert nutrition_db.lookup("banana", "8 oz")["grams"] == pytest.approx(226.8)
+    assert nutrition_db.lookup("chicken breast", "2 breasts")["grams"] == 344.0
+
+def test_unit_words_must_match_whole_words():
+    # "pie" is inside "pineapple" but is not a pineapple unit; falls back to the model's grams
+    assert nutrition_db.lookup("pineapple", "1 pie") is None
+    assert nutrition_db.lookup("pineapple", "1 pie", portion_grams=80)["grams"] == 80.0
+
+def test_fill_keeps_model_values_for_similar_foods():
+    result = analysis("Sweet potato fries", "1 cup")
+    assert not fill_from_database(result)
+    assert result["calories"] == 250
+    assert result["nutritionSource"] == "model"
+    assert result["similarFood"] == "sweet potato"
+
+def test_fill_does_not_map_generic_chicken_to_a_breast():
+    result = analysis("Chicken", "1 piece")
+    assert not fill_from_database(result)
+    assert result["calories"] == 250
+
+def test_fill_overrides_exact_matches():
+    result = analysis("banana", "1 medium")
+    assert fill_from_database(result)
+    assert result["nutritionSource"] == "database"
+    assert result["calories"] == round(89 * 1.18)
+    assert "similarFood" not in result
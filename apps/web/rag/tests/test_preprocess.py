@@ -0,0 +1,38 @@
+import asyncio
+import io
+import time
+from PIL import Image
+from rag.food_image_analyzer import FoodImageAnalyzer
+from rag.utils import preprocess
+
+def test_prepare_image_downscales_and_reencodes(make_image):
+    prepared = preprocess.prepare_image(make_image(0, size=(3000, 2000)), max_edge=512, image_format="JPEG")
+    assert prepared["mime_type"] == "image/jpeg"
+    assert max(Image.open(io.BytesIO(prepared["data"])).size) == 512
+
+def test_preprocessing_does_not_block_the_event_loop(make_image, monkeypatch):
+    prepare = preprocess.prepare_image
+
+    def slow_prepare(data, *args, **kwargs):
+        time.sleep(0.2)
+        return prepare(data, *args, **kwargs)
+
+    monkeypatch.setattr(preprocess, "prepare_image", slow_prepare)
+
+    async def run():
+        ticks = 0
+
+        async def heartbeat():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beat = asyncio.ensure_future(heartbeat())
+        result = await FoodImageAnalyzer().analyze_food_image(make_image(0))
+        beat.cancel()
+        return result, ticks
+
+    result, ticks = asyncio.run(run())
+    assert result['success']
+    assert ticks >= 10
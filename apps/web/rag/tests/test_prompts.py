@@ -0,0 +1,26 @@
+import asyncio
+from rag import food_advisor, food_image_analyzer  # noqa: F401  (registers the templates)
+from rag.config import settings
+from rag.prompts import PromptTemplate, prompt_registry
+from rag.utils.llm_client import get_model
+
+def test_current_prompts_only_get_implicit_caching():
+    # The module docstring and /prompts/stats say so; this keeps that true
+    for name, entry in prompt_registry.stats().items():
+        assert entry["staticTokens"] < settings.PROMPT_CACHE_MIN_TOKENS, name
+        assert entry["cacheMode"] == "implicit"
+        assert entry["explicitCache"].startswith("static prefix below")
+
+def test_large_prefix_is_still_sent_whole_on_backends_without_context_caching():
+    template = prompt_registry.register(PromptTemplate(
+        "test_large", "1", "word " * (4 * settings.PROMPT_CACHE_MIN_TOKENS // 5 + 1), dynamic="Food: {food}"
+    ))
+    assert template.static_tokens >= settings.PROMPT_CACHE_MIN_TOKENS
+    try:
+        assert prompt_registry.stats()["test_large"]["explicitCache"] == "not supported by the model backend"
+        model = get_model()
+        prepared, contents = asyncio.run(prompt_registry.prepare("test_large", model, {"food": "rice"}))
+        assert prepared is model
+        assert contents == [template.render(food="rice")]
+    finally:
+        prompt_registry._templates.pop("test_large")
@@ -0,0 +1,72 @@
+import asyncio
+from rag.recommendation_cache import RecommendationCache, parse_buckets, parse_hours
+
+BUCKETS = "age:5,weight:5,height:5,calories:100,protein:10,carbs:25,fat:10"
+
+def cache() -> RecommendationCache:
+    return RecommendationCache(parse_buckets(BUCKETS), max_entries=100, ttl_seconds=3600)
+
+def profile(**overrides) -> dict:
+    return {"age": 31, "weight": 72.4, "height": 178, "goal": "weight loss", "activity_level": "moderate",
+            "gender": "female", **overrides}
+
+def test_parse_settings():
+    assert parse_buckets("age:5, weight:2.5,") == {"age": 5.0, "weight": 2.5}
+    assert parse_hours("2-6") == (2, 6)
+    assert parse_hours(" ") is None
+
+def test_values_snap_to_the_middle_of_their_bucket():
+    recommendations = cache()
+    snapped, intake = recommendations.quantise(profile(), {"calories": 1234, "protein": None})
+    assert (snapped["age"], snapped["weight"], snapped["height"]) == (32.5, 72.5, 177.5)
+    assert snapped["goal"] == "WEIGHT_LOSS" and snapped["activity_level"] == "MODERATE"
+    assert intake == {"calories": 1250, "protein": 5, "carbs": 12.5, "fat": 5}
+
+    recommendations.buckets = {**recommendations.buckets, "age": 0}
+    assert recommendations.quantise(profile(), {})[0]["age"] == 31.0
+
+def test_bucket_edges():
+    recommendations = cache()
+    ages = [recommendations.quantise(profile(age=age), {})[0]["age"] for age in [30, 34.9, 35]]
+    assert ages == [32.5, 32.5, 37.5]
+
+def test_users_in_one_bucket_share_an_answer():
+    recommendations = cache()
+    computed = []
+
+    async def compute(bucket_profile, intake):
+        computed.append(bucket_profile)
+        return {"success": True, "data": len(computed)}
+
+    async def run():
+        return [
+            await recommendations.get_or_compute(profile(age=age, goal=goal), {"calories": calories}, "v1", compute)
+            for age, goal, calories in [(31, "weight loss", 1210), (33, "Weight-Loss", 1290), (36, "weight loss", 1210)]
+        ]
+
+    results = asyncio.run(run())
+    assert [result["data"] for result in results] == [1, 1, 2]
+    assert recommendations.stats()["trackedBuckets"] == 2
+
+def test_prewarm_regenerates_the_most_requested_buckets():
+    recommendations = cache()
+    warmed = []
+
+    async def compute(bucket_profile, intake):
+        warmed.append(bucket_profile["age"])
+        return {"success": True, "data": bucket_profile["age"]}
+
+    async def run():
+        # Requests are tracked even when the first compute fails
+        for age, count in [(31, 3), (41, 1)]:
+            for _ in range(count):
+                await recommendations.get_or_compute(
+                    profile(age=age), {}, "v1", lambda p, i: asyncio.sleep(0, {"success": False})
+                )
+        first = await recommendations.prewarm(compute, "v1", top=1)
+        # Already warm and fresh: skipped
+        second = await recommendations.prewarm(compute, "v1", top=2)
+        return first, second
+
+    assert asyncio.run(run()) == (1, 1)
+    assert warmed == [32.5, 42.5]
@@ -0,0 +1,169 @@
+import asyncio
+import contextlib
+import time
+import pytest
+from rag.config import settings
+from rag.utils.resilience import (
+    CircuitBreaker, DeadlineExceeded, ResilientCaller, UpstreamUnavailable, deadline, remaining
+)
+
+class UpstreamError(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"{code} upstream error")
+        self.code = code
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "MODEL_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(settings, "MODEL_BREAKER_THRESHOLD", 100)
+
+def flaky(*outcomes):
+    """
+    A call that raises or returns each outcome in turn, counting invocations
+    """
+    remaining_outcomes = list(outcomes)
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        outcome = remaining_outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, calls
+
+def test_retryable_errors_are_retried():
+    caller = ResilientCaller()
+    call, calls = flaky(UpstreamError(503), UpstreamError(429), "ok")
+    assert asyncio.run(caller.call("test", call)) == "ok"
+    assert len(calls) == 3
+    assert caller.counters["retries"] == 2
+
+def test_other_errors_are_not_retried():
+    caller = ResilientCaller()
+    call, calls = flaky(UpstreamError(400), "ok")
+    with pytest.raises(UpstreamError):
+        asyncio.run(caller.call("test", call))
+    assert len(calls) == 1
+
+def test_retries_give_up_with_503():
+    caller = ResilientCaller()
+    call, calls = flaky(*[UpstreamError(500)] * 3)
+    with pytest.raises(UpstreamUnavailable) as error:
+        asyncio.run(caller.call("test", call))
+    assert error.value.status_code == 503
+    assert len(calls) == 3
+    assert caller.counters["failed"] == 1
+
+def test_deadline_bounds_the_call():
+    caller = ResilientCaller()
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def run():
+        with deadline(0.05):
+            assert 0 < remaining() <= 0.05
+            await caller.call("test", slow)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert remaining() is None
+
+def test_nested_deadline_keeps_the_sooner_one():
+    with deadline(0.1):
+        with deadline(10):
+            assert remaining() <= 0.1
+
+def test_slow_call_is_hedged_and_the_hedge_wins(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "MODEL_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(settings, "MODEL_HEDGE_BUDGET", 1.0)
+    caller = ResilientCaller()
+    for _ in range(5):
+        caller.latencies.record("test", 0.01)
+    started = []
+
+    async def call():
+        started.append(len(started))
+        await asyncio.sleep(1 if len(started) == 1 else 0)
+        return f"call {len(started)}"
+
+    begin = time.monotonic()
+    assert asyncio.run(caller.call("test", call)) == "call 2"
+    assert time.monotonic() - begin < 0.5
+    assert (caller.counters["hedges"], caller.counters["hedgeWins"]) == (1, 1)
+
+def test_time_queued_for_admission_is_not_latency(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_HEDGE_ENABLED", True)
+    monkeypatch.setattr(settings, "MODEL_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(settings, "MODEL_HEDGE_BUDGET", 1.0)
+    caller = ResilientCaller()
+    for _ in range(5):
+        caller.latencies.record("test", 0.01)
+
+    @contextlib.asynccontextmanager
+    async def queued_slot():
+        await asyncio.sleep(0.1)
+        yield
+
+    async def call():
+        await asyncio.sleep(0.005)
+        return "ok"
+
+    assert asyncio.run(caller.call("test", call, admit=queued_slot)) == "ok"
+    assert caller.counters["hedges"] == 0
+    assert caller.latencies.percentile("test", 0.95) < 0.05
+
+def test_hedges_respect_the_budget(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(settings, "MODEL_HEDGE_BUDGET", 0.0)
+    caller = ResilientCaller()
+    for _ in range(5):
+        caller.latencies.record("test", 0.001)
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    assert asyncio.run(caller.call("test", call)) == "ok"
+    assert caller.counters["hedges"] == 0
+
+def test_breaker_opens_fails_fast_and_closes_after_a_probe():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.before_call() is True
+    # Only one probe at a time
+    with pytest.raises(UpstreamUnavailable):
+        breaker.before_call()
+    breaker.record_success(probe=True)
+    assert breaker.state == "closed" and breaker.trips == 1
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    breaker.record_failure(probe=True)
+    assert breaker.state == "open"
+
+def test_caller_fails_fast_while_breaker_is_open(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_BREAKER_THRESHOLD", 2)
+    caller = ResilientCaller()
+    call, calls = flaky(*[UpstreamError(503)] * 3)
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(caller.call("test", call))
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(caller.call("test", call))
+    assert len(calls) == 3
+    assert caller.stats()["breaker"] == "open"
@@ -0,0 +1,150 @@
+import asyncio
+import sqlite3
+import time
+import numpy as np
+import pytest
+from rag.config import settings
+from rag.retrieval import KnowledgeBase, summarise_analysis
+from rag.utils.llm_client import embed_texts
+from rag.utils.vector_store import DirectoryInUse, VectorStore, normalise
+
+DIM = 32
+
+def random_vectors(count: int, seed: int = 0) -> np.ndarray:
+    return normalise(np.random.default_rng(seed).normal(size=(count, DIM)))
+
+def entries(count: int, kind: str = "note", scope: str = "") -> list:
+    return [{"id": f"{kind}:{scope}:{i}", "kind": kind, "scope": scope, "text": f"text {i}"} for i in range(count)]
+
+def test_flat_search_is_exact():
+    store = VectorStore(DIM)
+    vectors = random_vectors(200)
+    store.upsert(entries(200), vectors)
+    queries = random_vectors(20, seed=1)
+    for query in queries:
+        expected = np.argsort(-(vectors @ query))[:5]
+        assert [entry["text"] for entry in store.search(query, 5)] == [f"text {i}" for i in expected]
+
+def test_upsert_replaces_by_id():
+    store = VectorStore(DIM)
+    vectors = random_vectors(2)
+    store.upsert([{"id": "a", "kind": "note", "text": "first"}], vectors[:1])
+    store.upsert([{"id": "a", "kind": "note", "text": "second", "payload": {"n": 2}}], vectors[1:])
+    assert len(store) == 1
+    [found] = store.search(vectors[1], 1)
+    assert (found["text"], found["payload"], found["score"]) == ("second", {"n": 2}, pytest.approx(1.0))
+
+def test_search_filters_kinds_and_scopes():
+    store = VectorStore(DIM)
+    vectors = random_vectors(30)
+    store.upsert(entries(10, "reference") + entries(10, "analysis", "alice") + entries(10, "analysis", "bob"), vectors)
+    found = store.search(vectors[15], 30, ["reference", "analysis"], ["", "alice"])
+    assert len(found) == 20
+    assert {entry["scope"] for entry in found} == {"", "alice"}
+    assert store.search(vectors[25], 30, ["analysis"], ["carol"]) == []
+    assert store.counts() == {"reference": 10, "analysis": 20}
+
+def test_directory_store_reopens_and_migrates(tmp_path):
+    vectors = random_vectors(3)
+    store = VectorStore(DIM, str(tmp_path / "new"))
+    store.upsert(entries(3, "analysis", "alice"), vectors)
+    store.close()
+    reopened = VectorStore(DIM, str(tmp_path / "new"))
+    assert [entry["scope"] for entry in reopened.search(vectors[0], 3, scopes=["alice"])] == ["alice"] * 3
+
+    # A store written before scopes existed
+    old = tmp_path / "old"
+    old.mkdir()
+    conn = sqlite3.connect(old / "entries.sqlite3")
+    conn.execute("CREATE TABLE entries (id TEXT PRIMARY KEY, row INTEGER NOT NULL, kind TEXT NOT NULL, "
+                 "text TEXT NOT NULL, payload TEXT, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO entries VALUES ('a', 0, 'reference', 'old note', 'null', 0)")
+    conn.commit()
+    conn.close()
+    np.save(old / "vectors.npy", np.vstack([vectors[:1], np.zeros((1023, DIM), np.float32)]))
+    [found] = VectorStore(DIM, str(old)).search(vectors[0], 1, scopes=[""])
+    assert found["text"] == "old note"
+
+def test_ivfpq_recall_and_filters():
+    rng = np.random.default_rng(2)
+    centres = rng.normal(size=(20, DIM))
+    vectors = normalise(centres[rng.integers(0, 20, 4000)] + 0.3 * rng.normal(size=(4000, DIM)))
+    store = VectorStore(DIM, mode="ivfpq", lists=16, probes=4, subvectors=8, min_train_rows=1000)
+    store.upsert(entries(2000, "note", "alice") + entries(2000, "note", "bob"), vectors)
+    store.search(vectors[0], 1)
+    deadline = time.time() + 30
+    while store.stats()["ivfTraining"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert store.stats()["ivfTrained"]
+
+    queries = normalise(vectors[:200] + 0.05 * rng.normal(size=(200, DIM)))
+    hits = sum(store.search(query, 1)[0]["id"] == f"note:alice:{i}" for i, query in enumerate(queries))
+    assert hits >= 180
+    assert {entry["scope"] for entry in store.search(queries[0], 20, scopes=["bob"])} == {"bob"}
+
+def test_each_process_writes_its_own_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_DIR", str(tmp_path))
+    store = VectorStore(DIM, str(tmp_path / "store"))
+    with pytest.raises(DirectoryInUse):
+        VectorStore(DIM, str(tmp_path / "store"))
+    store.close()
+    VectorStore(DIM, str(tmp_path / "store")).close()
+
+    # Two workers, then a restart of the first reusing its index
+    first, second = KnowledgeBase(), KnowledgeBase()
+    directories = [base.store._path for base in (first, second)]
+    assert directories[0] != directories[1]
+    asyncio.run(first.close())
+    restarted = KnowledgeBase()
+    assert restarted.store._path == directories[0]
+    for base in (second, restarted):
+        asyncio.run(base.close())
+
+@pytest.fixture
+def knowledge_base(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_DIR", "")
+    monkeypatch.setattr(settings, "ANALYSIS_NOTES_MAX_ENTRIES", 3)
+    monkeypatch.setattr(settings, "SEMANTIC_CACHE_MAX_ENTRIES", 2)
+    monkeypatch.setattr(settings, "RETRIEVAL_MIN_SCORE", 0.5)
+    base = KnowledgeBase()
+    yield base
+    asyncio.run(base.close())
+
+def meal(name: str) -> dict:
+    return {"foodName": name, "portionSize": "1 bowl", "calories": 400,
+            "nutrition": {"protein": 20, "carbs": 40, "fat": 15, "fiber": 5, "sugar": 3}}
+
+def test_analysis_notes_are_per_user_and_bounded(knowledge_base):
+    async def run():
+        for name in ["ramen", "pho", "laksa", "udon", "bibimbap"]:
+            await knowledge_base._index_analysis("alice", meal(name))
+        [query] = await embed_texts([summarise_analysis(meal("bibimbap"))], task_type="retrieval_query")
+        return (await knowledge_base.retrieve(query, k=10, user_id="alice"),
+                await knowledge_base.retrieve(query, k=10, user_id="bob"),
+                await knowledge_base.retrieve(query, k=10))
+
+    alices, bobs, anonymous = asyncio.run(run())
+    assert knowledge_base.store.counts()["analysis"] == 3
+    assert any("bibimbap" in note for note in alices)
+    assert not any("ramen" in note for note in alices)
+    assert bobs == [] and anonymous == []
+
+def test_analysis_notes_expire(knowledge_base, monkeypatch):
+    async def run():
+        await knowledge_base._index_analysis("alice", meal("ramen"))
+        [query] = await embed_texts([summarise_analysis(meal("ramen"))], task_type="retrieval_query")
+        return await knowledge_base.retrieve(query, user_id="alice")
+
+    monkeypatch.setattr(settings, "ANALYSIS_NOTES_TTL", -1)
+    assert asyncio.run(run()) == []
+
+def test_semantic_cache_is_per_user(knowledge_base):
+    vector = normalise(np.random.default_rng(3).normal(size=settings.EMBEDDING_DIM))[0]
+
+    async def run():
+        await knowledge_base.add_advice("query", vector, "v1", "alice's advice", "alice")
+        await knowledge_base.add_advice("query", vector, "v1", "nobody's advice", None)
+        return [await knowledge_base.find_advice(vector, "v1", user) for user in ["alice", "bob", None]]
+
+    assert asyncio.run(run()) == ["alice's advice", None, None]
+    assert knowledge_base.store.counts() == {"advice": 1}
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+APPS_WEB = Path(__file__).resolve().parents[2]
+
+# Modules only needed once an image is decoded or a real model is called
+LAZY_MODULES = ["PIL", "google.generativeai"]
+
+def test_fake_backend_imports_without_key_or_heavy_modules():
+    env = {name: value for name, value in os.environ.items() if name != "GEMINI_API_KEY"}
+    env["RAG_MODEL_BACKEND"] = "fake"
+    script = (
+        "import sys\n"
+        "import rag.main\n"
+        f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))\n"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", script], cwd=APPS_WEB, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.strip() == ""
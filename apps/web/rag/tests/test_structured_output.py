@@ -0,0 +1,33 @@
+import json
+import pytest
+from rag import schemas
+from rag.food_image_analyzer import PACKED_SCHEMA
+from rag.utils.structured_output import extract_json, json_config
+
+# Every schema passed to json_config by the service
+RESPONSE_SCHEMAS = [
+    schemas.FoodAnalysis,
+    schemas.FoodIdentification,
+    schemas.NutritionEstimate,
+    schemas.RecommendationAdvice,
+    PACKED_SCHEMA,
+]
+
+@pytest.mark.parametrize("schema", RESPONSE_SCHEMAS, ids=lambda schema: str(schema))
+def test_response_schemas_convert_with_the_sdk(schema):
+    generation_types = pytest.importorskip("google.generativeai.types.generation_types")
+    config = generation_types.to_generation_config_dict(json_config(schema))
+    assert config["response_schema"] is not None
+
+def test_extract_json_from_fenced_block():
+    assert extract_json('Here you go:\n```json\n{"a": 1}\n```') == {"a": 1}
+
+def test_extract_json_skips_prose_and_unbalanced_text():
+    assert extract_json('Result (see below): [1, 2] and {"b": "x}"}') == [1, 2]
+
+def test_extract_json_ignores_brackets_inside_strings():
+    assert extract_json('note {"text": "a } b", "n": 2} trailing') == {"text": "a } b", "n": 2}
+
+def test_extract_json_raises_without_json():
+    with pytest.raises(json.JSONDecodeError):
+        extract_json("no json here")
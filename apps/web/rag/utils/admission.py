@@ -0,0 +1,269 @@
+"""
+Admission control for upstream model calls.
+
+Every Gemini call takes a slot from the shared AdmissionController:
+
+- a token bucket keeps the call rate within the API quota,
+- a bounded priority queue holds callers waiting for a slot, interactive
+  requests ahead of batch back-fill,
+- the number of concurrent calls adapts AIMD-style: it grows by about one per
+  window of fast successful calls and halves on a 429 or a call slower than
+  the latency target,
+- callers that can't be queued are rejected at once with 503 and Retry-After
+  instead of piling onto an upstream that is already rate limiting us.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import HTTPException
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+INTERACTIVE = 0
+BATCH = 1
+
+_priority: ContextVar[int] = ContextVar("model_call_priority", default=INTERACTIVE)
+
+@contextmanager
+def call_priority(priority: int):
+    """
+    Run the model calls made in this context (and tasks started from it) at a priority
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class Overloaded(HTTPException):
+    """
+    Raised when a model call can't be admitted; rendered as 503 with Retry-After
+    """
+    def __init__(self, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+def is_rate_limited(error: Exception) -> bool:
+    """
+    True for upstream 429 / RESOURCE_EXHAUSTED errors
+    """
+    return getattr(error, "code", None) == 429 or type(error).__name__ == "ResourceExhausted"
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average with bursts of up to `burst`
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """
+        Seconds until the next token is available
+        """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+class Ticket:
+    """
+    A granted slot. Streaming callers call mark() at the first chunk so the
+    limiter judges time-to-first-token rather than the length of the answer.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def mark(self):
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started
+
+class AdmissionController:
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        queue_size: int,
+        queue_timeout: float,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        target_latency: float,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.target_latency = target_latency
+
+        self.in_flight = 0
+        self._queue = []  # (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_decrease = 0.0
+        self._latency = target_latency / 2  # EWMA of admitted call latency
+        self.counters = {"admitted": 0, "rejected": 0, "timedOut": 0, "rateLimited": 0, "slow": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._queue if not future.done())
+
+    def retry_after(self) -> float:
+        """
+        Rough time for the current queue to drain
+        """
+        throughput = min(self.bucket.rate, self.limit / max(self._latency, 1e-3))
+        return (self.queued + 1) / max(throughput, 1e-3)
+
+    def _reject(self, message: str) -> Overloaded:
+        self.counters["rejected"] += 1
+        return Overloaded(message, self.retry_after())
+
+    def _make_room(self, priority: int) -> bool:
+        """
+        Free a queue position for a new caller by rejecting the newest waiter
+        of a lower priority. False when every waiter is at least as important.
+        """
+        self._queue = [entry for entry in self._queue if not entry[2].done()]
+        heapq.heapify(self._queue)
+        if len(self._queue) < self.queue_size:
+            return True
+        if not self._queue:
+            return False
+        victim = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= priority:
+            return False
+        self._queue.remove(victim)
+        heapq.heapify(self._queue)
+        victim[2].set_exception(self._reject("Model queue is full"))
+        return True
+
+    def _dispatch(self):
+        self._timer = None
+        while self._queue and self.in_flight < int(self.limit):
+            if self._queue[0][2].done():
+                heapq.heappop(self._queue)
+                continue
+            if not self.bucket.try_acquire():
+                self._timer = asyncio.get_running_loop().call_later(self.bucket.delay(), self._dispatch)
+                return
+            _, _, future = heapq.heappop(self._queue)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _release(self, ticket: Ticket, error: Optional[BaseException]):
+        self.in_flight -= 1
+        now = time.monotonic()
+        latency = ticket.latency if ticket.latency is not None else now - ticket.started
+        if error is not None and is_rate_limited(error):
+            self.counters["rateLimited"] += 1
+            self._decrease(now)
+        elif error is None:
+            self._latency = 0.8 * self._latency + 0.2 * latency
+            if latency > self.target_latency:
+                self.counters["slow"] += 1
+                self._decrease(now)
+            else:
+                # +1 per window of `limit` fast calls
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        if self._timer is None:
+            self._dispatch()
+
+    def _return_unused(self):
+        # A slot granted to a caller that had already given up
+        self.in_flight -= 1
+        if self._timer is None:
+            self._dispatch()
+
+    def _decrease(self, now: float):
+        # At most one halving per typical call latency, so a burst of 429s
+        # from the same window counts as a single congestion signal
+        if now - self._last_decrease >= self._latency:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self._last_decrease = now
+            logger.warning(f"Model concurrency limit reduced to {self.limit:.1f}")
+
+    @asynccontextmanager
+    async def slot(self, priority: int = None, timeout: float = None):
+        """
+        Hold an admitted model call slot for the duration of the block.
+        timeout caps the queue wait below MODEL_QUEUE_TIMEOUT, e.g. to fit a request deadline.
+        """
+        priority = _priority.get() if priority is None else priority
+        if self.queued >= self.queue_size and not self._make_room(priority):
+            raise self._reject("Model queue is full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._sequence), future))
+        if self._timer is None:
+            self._dispatch()
+        try:
+            wait = self.queue_timeout if timeout is None else min(timeout, self.queue_timeout)
+            await asyncio.wait_for(asyncio.shield(future), wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the wait timed out
+                self._return_unused()
+            future.cancel()
+            self.counters["timedOut"] += 1
+            raise self._reject("Timed out waiting for a model slot")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._return_unused()
+            future.cancel()
+            raise
+
+        self.counters["admitted"] += 1
+        ticket = Ticket()
+        try:
+            yield ticket
+        except BaseException as e:
+            self._release(ticket, e)
+            raise
+        self._release(ticket, None)
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "inFlight": self.in_flight,
+            "queued": self.queued,
+            "queueSize": self.queue_size,
+            "latencyEwma": round(self._latency, 3),
+            "ratePerSecond": self.bucket.rate,
+            **self.counters,
+        }
+
+# Global instance
+admission = AdmissionController(
+    rate=settings.MODEL_RATE_LIMIT / 60,
+    burst=settings.MODEL_RATE_BURST,
+    queue_size=settings.MODEL_QUEUE_SIZE,
+    queue_timeout=settings.MODEL_QUEUE_TIMEOUT,
+    initial_limit=settings.MODEL_CONCURRENCY,
+    min_limit=settings.MODEL_CONCURRENCY_MIN,
+    max_limit=settings.MODEL_CONCURRENCY_MAX,
+    target_latency=settings.MODEL_TARGET_LATENCY,
+)
@@ -0,0 +1,24 @@
+import asyncio
+from fastapi import HTTPException, Request
+from ..config import settings
+
+# Non-standard status used by nginx for "client closed request"
+CLIENT_CLOSED_REQUEST = 499
+
+async def run_until_disconnected(request: Request, coro):
+    """
+    Await a coroutine, cancelling it if the client disconnects first
+    so abandoned requests stop holding a model call slot.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client disconnected")
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,98 @@
+import io
+from typing import TYPE_CHECKING, Optional
+import httpx
+from fastapi import HTTPException, UploadFile
+from ..config import settings
+from .metrics import image_bytes, stage
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+CHUNK_SIZE = 64 * 1024
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the pooled client used for image downloads, creating it on first use
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.IMAGE_DOWNLOAD_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=settings.IMAGE_DOWNLOAD_MAX_CONNECTIONS)
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _check_content_type(content_type: Optional[str]):
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if not media_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Unsupported content type: {media_type or 'unknown'}")
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Image exceeds maximum size of {settings.MAX_IMAGE_BYTES} bytes"
+    )
+
+async def download_image(url: str) -> bytes:
+    """
+    Stream an image from a URL into memory, rejecting non-images and
+    oversized bodies before they are fully downloaded
+    """
+    try:
+        with stage("download"):
+            data = await _download(url)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
+    image_bytes.observe(len(data), source="download")
+    return data
+
+async def _download(url: str) -> bytes:
+    async with get_http_client().stream("GET", url) as response:
+        response.raise_for_status()
+        _check_content_type(response.headers.get("content-type"))
+
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > settings.MAX_IMAGE_BYTES:
+            raise _too_large()
+
+        buffer = bytearray()
+        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > settings.MAX_IMAGE_BYTES:
+                raise _too_large()
+        return bytes(buffer)
+
+async def read_upload(file: UploadFile) -> bytes:
+    """
+    Read an uploaded image into memory, enforcing content type and size limits
+    """
+    _check_content_type(file.content_type)
+    if file.size is not None and file.size > settings.MAX_IMAGE_BYTES:
+        raise _too_large()
+
+    buffer = bytearray()
+    with stage("upload"):
+        while chunk := await file.read(CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > settings.MAX_IMAGE_BYTES:
+                raise _too_large()
+    image_bytes.observe(len(buffer), source="upload")
+    return bytes(buffer)
+
+def open_image(data: bytes) -> "Image.Image":
+    """
+    Decode image bytes with PIL without touching the filesystem
+    """
+    # Imported on first use so startup doesn't load PIL
+    from PIL import Image
+
+    return Image.open(io.BytesIO(data))
@@ -1,33 +1,154 @@
-import google.generativeai as genai
-from PIL import Image
+import asyncio
+import time
+from typing import List
+import numpy as np
 from ..config import settings
+from .admission import admission
+from .metrics import model_call_seconds, model_tokens, stage
+from .resilience import remaining, resilience
+from .model_registry import model_registry
+from .preprocess import prepare_image_async
+from .vector_store import normalise
 
-def init_gemini():
-    genai.configure(api_key=settings.GEMINI_API_KEY)
+EMBED_BATCH_SIZE = 100  # Texts per embedding request (the API maximum)
+STREAM_BUFFER_CHUNKS = 256  # Chunks buffered per stream, enough for a MAX_TOKENS answer
+
+# Running totals of calls and tokens reported by Gemini ("cached" is
+# prompt tokens served from a context/prefix cache), overall and per prompt
+token_usage = {"calls": 0, "prompt": 0, "output": 0, "cached": 0}
+token_usage_by_prompt = {}
+
+def get_model():
+    """
+    Shared text/advice model configured from settings
+    """
+    return model_registry.get(
+        settings.MODEL_NAME,
+        temperature=settings.TEMPERATURE,
+        max_output_tokens=settings.MAX_TOKENS
+    )
+
+async def generate_content(model, contents, usage_key: str = None, **kwargs):
+    """
+    Call Gemini through the SDK's async API without blocking the event loop.
+    Cancelling the awaiting task cancels the upstream call. usage_key
+    attributes the token usage to a named prompt. Calls go through admission
+    control and raise Overloaded (503) when they can't be queued. Transient
+    failures are retried (and slow calls hedged) within the request deadline.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        with stage("model_call", prompt=usage_key or "other"):
+            response = await resilience.call(
+                usage_key or model.model_name,
+                lambda: model.generate_content_async(contents, **kwargs),
+                admit=lambda: admission.slot(timeout=remaining())
+            )
+        outcome = "ok"
+    finally:
+        model_call_seconds.observe(time.perf_counter() - start, prompt=usage_key or "other", outcome=outcome)
+    _record_usage(response, usage_key)
+    return response
+
+async def stream_content(model, contents, usage_key: str = None, **kwargs):
+    """
+    Stream Gemini output as text chunks. A background task reads the upstream
+    stream as fast as the model sends it, holding the call slot only until the
+    answer is complete; the consumer takes the buffered chunks at its own
+    pace, so a slow client doesn't keep a slot. The buffer holds up to
+    STREAM_BUFFER_CHUNKS chunks; for a longer answer the reader waits for the
+    client, still holding the slot, once it is full. Closing the stream early
+    cancels the upstream read.
+    """
+    chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+
+    async def read():
+        try:
+            async with admission.slot(timeout=remaining()) as ticket:
+                # Opening the stream is retried; once text has been sent it can't be
+                response = await resilience.call(
+                    usage_key or model.model_name,
+                    lambda: model.generate_content_async(contents, stream=True, **kwargs),
+                    hedge=False
+                )
+                async for chunk in response:
+                    ticket.mark()
+                    if chunk.text:
+                        await chunks.put(chunk.text)
+            _record_usage(response, usage_key)
+        except Exception as e:
+            await chunks.put(e)
+        else:
+            await chunks.put(None)
+
+    reader = asyncio.ensure_future(read())
+    try:
+        while True:
+            text = await chunks.get()
+            if text is None:
+                return
+            if isinstance(text, Exception):
+                raise text
+            yield text
+    finally:
+        reader.cancel()
+
+async def embed_texts(texts: List[str], task_type: str = "retrieval_document") -> np.ndarray:
+    """
+    Unit-length float32 embeddings, one row per text. Embedding calls are
+    short and have their own quota, so they skip the generation call limit
+    (queueing behind multi-second generations) but keep retries and the deadline.
+    """
+    backend = model_registry.backend
+    rows = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch = texts[start:start + EMBED_BATCH_SIZE]
+        with stage("embed"):
+            rows += await resilience.call("embedding", lambda batch=batch: backend.embed(batch, task_type))
+    return normalise(np.array(rows, dtype=np.float32).reshape(len(texts), settings.EMBEDDING_DIM))
+
+def _record_usage(response, usage_key: str = None):
+    totals = [token_usage]
+    if usage_key:
+        totals.append(token_usage_by_prompt.setdefault(usage_key, dict.fromkeys(token_usage, 0)))
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        for kind, count in [("prompt", usage.prompt_token_count), ("output", usage.candidates_token_count),
+                            ("cached", getattr(usage, "cached_content_token_count", 0))]:
+            model_tokens.inc(count, prompt=usage_key or "other", kind=kind)
+    for total in totals:
+        total["calls"] += 1
+        if usage is not None:
+            total["prompt"] += usage.prompt_token_count
+            total["output"] += usage.candidates_token_count
+            total["cached"] += getattr(usage, "cached_content_token_count", 0)
+
+def combine_prompts(prompt: str, system_prompt: str = None) -> str:
+    return f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
     
-async def generate_response(prompt: str, system_prompt: str = None, image_path: str = None) -> str:
-    init_gemini()
+async def generate_response(prompt: str, system_prompt: str = None, image_data: bytes = None,
+                            usage_key: str = None) -> str:
+    """
+    Text answer for a prompt. Errors propagate to the caller once retries are exhausted.
+    """
+    model = get_model()
     
-    try:
-        model = genai.GenerativeModel(
-            model_name=settings.MODEL_NAME,
-            generation_config={
-                "temperature": settings.TEMPERATURE,
-                "max_output_tokens": settings.MAX_TOKENS,
-            }
-        )
-        
-        # Combine prompts
-        full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+    # Combine prompts
+    full_prompt = combine_prompts(prompt, system_prompt)
+    
+    # If image is provided, use multimodal generation
+    if image_data:
+        image = await prepare_image_async(image_data)
+        response = await generate_content(model, [full_prompt, image], usage_key=usage_key)
+    else:
+        response = await generate_content(model, full_prompt, usage_key=usage_key)
         
-        # If image is provided, use multimodal generation
-        if image_path:
-            image = Image.open(image_path)
-            response = model.generate_content([full_prompt, image])
-        else:
-            response = model.generate_content(full_prompt)
-            
-        return response.text
-    except Exception as e:
-        print(f"Error generating Gemini response: {e}")
-        return None 
\ No newline at end of file
+    return response.text
+
+async def stream_response(prompt: str, system_prompt: str = None, usage_key: str = None):
+    """
+    Streaming counterpart of generate_response, yielding text chunks
+    """
+    async for text in stream_content(get_model(), combine_prompts(prompt, system_prompt), usage_key=usage_key):
+        yield text
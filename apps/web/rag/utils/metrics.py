@@ -0,0 +1,186 @@
+"""
+Per-worker metrics in the Prometheus text format, with optional
+OpenTelemetry spans.
+
+Instruments are plain counters, gauges and histograms keyed by label
+values. State that already lives elsewhere (caches, admission, resilience)
+is read through collectors at scrape time rather than mirrored here.
+stage() times one pipeline stage into rag_stage_seconds and, when
+METRICS_TRACING is on and OpenTelemetry is installed, wraps it in a span.
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
+from ..config import settings
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+BYTE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2)
+
+# (metric name, type, help, [(labels, value)])
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def lines(self) -> List[str]:
+        return [f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts..., +Inf count], sum
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def lines(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Sample]]):
+        """
+        Register a callback producing samples from state owned elsewhere, read at scrape time
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += metric.lines()
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+# Global instance and the service's instruments
+metrics = MetricsRegistry()
+
+stage_seconds = metrics.histogram(
+    "rag_stage_seconds", "Time spent in each pipeline stage", ["stage"]
+)
+model_call_seconds = metrics.histogram(
+    "rag_model_call_seconds", "Model call latency by prompt and outcome", ["prompt", "outcome"]
+)
+model_tokens = metrics.counter(
+    "rag_model_tokens_total", "Tokens reported by the model by prompt and kind", ["prompt", "kind"]
+)
+image_bytes = metrics.histogram(
+    "rag_image_bytes", "Image sizes received and sent to the model", ["source"], buckets=BYTE_BUCKETS
+)
+http_requests_in_flight = metrics.gauge(
+    "rag_http_requests_in_flight", "HTTP requests currently being served", ["path"]
+)
+http_request_seconds = metrics.histogram(
+    "rag_http_request_seconds", "HTTP request latency until the response starts", ["path", "method", "status"]
+)
+job_wait_seconds = metrics.histogram(
+    "rag_job_wait_seconds", "Time analysis jobs spent queued before a worker claimed them", buckets=JOB_BUCKETS
+)
+job_service_seconds = metrics.histogram(
+    "rag_job_service_seconds", "Time workers spent running analysis jobs by final status", ["status"], buckets=JOB_BUCKETS
+)
+
+_tracer = trace.get_tracer("rag") if trace is not None else None
+
+@contextmanager
+def stage(name: str, **attributes):
+    """
+    Time a pipeline stage into rag_stage_seconds, inside an OpenTelemetry span when tracing is enabled
+    """
+    start = time.perf_counter()
+    tracing = _tracer is not None and settings.METRICS_TRACING
+    with _tracer.start_as_current_span(f"rag.{name}", attributes=attributes) if tracing else nullcontext():
+        try:
+            yield
+        finally:
+            stage_seconds.observe(time.perf_counter() - start, stage=name)
@@ -0,0 +1,272 @@
+"""
+Model backends behind ModelRegistry.
+
+A backend builds model objects with the small part of the
+google.generativeai GenerativeModel interface the service uses: a
+model_name, and generate_content_async(contents, stream=False,
+generation_config=None) returning a response with .text and
+.usage_metadata that can also be iterated for streamed chunks. It also
+embeds text for retrieval (embed()).
+
+- "gemini": the real API.
+- "fake": a deterministic local stand-in with a log-normal latency
+  distribution, an injectable error rate, an optional per-minute quota
+  answered with 429 and canned JSON answers, for load tests and offline
+  runs. Select it with RAG_MODEL_BACKEND=fake.
+"""
+import asyncio
+import collections
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import typing
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List, Optional
+from ..config import settings
+from .. import schemas
+
+class ModelBackend:
+    name = ""
+    # Whether prompts.PromptRegistry may create context caches for this backend's models
+    supports_context_cache = False
+
+    def configure(self):
+        pass
+
+    def create_model(self, model_name: str, generation_config: dict):
+        raise NotImplementedError
+
+    async def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """
+        One EMBEDDING_DIM vector per text. task_type is retrieval_document or retrieval_query.
+        """
+        raise NotImplementedError
+
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+    supports_context_cache = True
+
+    def configure(self):
+        # Checked here rather than at import so the fake backend runs without a key
+        if not settings.GEMINI_API_KEY:
+            raise ValueError("GEMINI_API_KEY is not set in environment variables")
+        import google.generativeai as genai
+
+        genai.configure(api_key=settings.GEMINI_API_KEY)
+
+    def create_model(self, model_name: str, generation_config: dict):
+        import google.generativeai as genai
+
+        return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+
+    async def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        import google.generativeai as genai
+
+        result = await genai.embed_content_async(
+            model=settings.EMBEDDING_MODEL,
+            content=texts,
+            task_type=task_type,
+            output_dimensionality=settings.EMBEDDING_DIM
+        )
+        return result["embedding"]
+
+# Canned answers for the fake backend, keyed by the kind of prompt
+CANNED_RESPONSES = {
+    "analysis": {
+        "foodName": "banana", "calories": 105, "confidence": 0.92,
+        "nutrition": {"protein": 1.3, "carbs": 27.0, "fat": 0.4, "fiber": 3.1, "sugar": 14.4},
+        "portionSize": "1 medium", "ingredients": ["banana"], "mealType": "snack",
+        "healthScore": 8, "tips": ["Pair with a protein source to stay full longer"],
+    },
+    "identification": {
+        "foodName": "banana", "confidence": 0.92, "portionSize": "1 medium",
+        "portionGrams": 118, "mealType": "snack",
+    },
+    "estimate": {
+        "calories": 105,
+        "nutrition": {"protein": 1.3, "carbs": 27.0, "fat": 0.4, "fiber": 3.1, "sugar": 14.4},
+    },
+    "recommendations": {
+        "recommendations": [
+            {"food": "Greek yogurt with berries", "reason": "High protein, low fat", "calories": 180, "mealType": "snack"},
+        ],
+        "tips": ["Spread protein evenly across meals"],
+    },
+    "advice": (
+        "**Nutritional analysis**\n- A moderate-calorie food with mostly carbohydrates.\n\n"
+        "**Alignment with goals**\n- Fits well as a snack within the daily target.\n\n"
+        "**Recommendations**\n- Add a protein source.\n- Keep the portion to one serving."
+    ),
+}
+
+SCHEMA_KINDS = {
+    schemas.FoodAnalysis: "analysis",
+    schemas.FoodIdentification: "identification",
+    schemas.NutritionEstimate: "estimate",
+    schemas.RecommendationAdvice: "recommendations",
+}
+
+class FakeUpstreamError(Exception):
+    """
+    Injected failure with the HTTP status code an API error would carry
+    """
+    def __init__(self, code: int):
+        super().__init__(f"{code} fake upstream error")
+        self.code = code
+
+def _estimate_tokens(contents) -> int:
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = 0
+    for part in parts:
+        # Images are billed at a flat rate; text at roughly 4 characters per token
+        tokens += 258 if isinstance(part, dict) else len(str(part)) // 4
+    return tokens
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int, chunk_delay: float = 0.0):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=len(text) // 4,
+            cached_content_token_count=0,
+        )
+        self._chunk_delay = chunk_delay
+
+    async def __aiter__(self):
+        words = self.text.split(" ")
+        for start in range(0, len(words), 8):
+            if self._chunk_delay:
+                await asyncio.sleep(self._chunk_delay)
+            text = " ".join(words[start:start + 8])
+            yield SimpleNamespace(text=text + (" " if start + 8 < len(words) else ""))
+
+class FakeModel:
+    def __init__(self, backend: "FakeBackend", model_name: str, generation_config: dict):
+        self.backend = backend
+        self.model_name = f"fake/{model_name}"
+        self._generation_config = generation_config
+
+    def _kind(self, contents, schema) -> str:
+        if typing.get_origin(schema) is list:
+            return "packed"
+        if schema in SCHEMA_KINDS:
+            return SCHEMA_KINDS[schema]
+        # No schema (structured output disabled): recognise the prompt text
+        prompt = str(contents[0] if isinstance(contents, list) else contents)
+        if "JSON array" in prompt:
+            return "packed"
+        for marker, kind in [("Identify the food", "identification"), ("Estimate the nutrition", "estimate"),
+                             ("food recommendations", "recommendations"), ("JSON object", "analysis")]:
+            if marker in prompt:
+                return kind
+        return "advice"
+
+    def _answer(self, contents, kind: str) -> str:
+        canned = self.backend.canned
+        if kind == "packed":
+            labels = [part for part in contents if isinstance(part, str) and part.startswith("Image ")]
+            return json.dumps([{**canned["analysis"], "index": index} for index in range(len(labels))])
+        answer = canned[kind]
+        return answer if isinstance(answer, str) else json.dumps(answer)
+
+    async def generate_content_async(self, contents, stream: bool = False, generation_config: dict = None, **kwargs):
+        config = {**self._generation_config, **(generation_config or {})}
+        kind = self._kind(contents, config.get("response_schema"))
+        latency, error = self.backend.draw()
+        text = self._answer(contents, kind)
+        response = FakeResponse(text, _estimate_tokens(contents))
+        with self.backend.track():
+            if stream:
+                # Time to first chunk, then the rest of the latency spread over the chunks
+                await asyncio.sleep(latency * 0.3)
+                if error:
+                    raise FakeUpstreamError(error)
+                response._chunk_delay = latency * 0.7 / max(1, math.ceil(len(text.split(" ")) / 8))
+                return response
+            await asyncio.sleep(latency)
+        if error:
+            raise FakeUpstreamError(error)
+        return response
+
+class FakeBackend(ModelBackend):
+    name = "fake"
+
+    def __init__(self):
+        self.canned = dict(CANNED_RESPONSES)
+        self._random = random.Random(settings.FAKE_MODEL_SEED)
+        self._starts = collections.deque()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def configure(self):
+        self._random = random.Random(settings.FAKE_MODEL_SEED)
+        self._starts.clear()
+        self.canned = dict(CANNED_RESPONSES)
+        if settings.FAKE_MODEL_CANNED:
+            self.canned.update(json.loads(Path(settings.FAKE_MODEL_CANNED).read_text()))
+
+    def draw(self):
+        """
+        Next (latency seconds, error status or None) from the seeded distributions
+        """
+        latency = 0.0
+        if settings.FAKE_MODEL_LATENCY > 0:
+            latency = self._random.lognormvariate(math.log(settings.FAKE_MODEL_LATENCY), settings.FAKE_MODEL_LATENCY_SIGMA)
+        error: Optional[int] = None
+        if self._random.random() < settings.FAKE_MODEL_ERROR_RATE:
+            error = self._random.choice([429, 500, 503])
+        if settings.FAKE_MODEL_RPM > 0:
+            # Quota over a sliding minute of accepted calls, like the Gemini per-minute limit
+            now = time.monotonic()
+            while self._starts and now - self._starts[0] > 60:
+                self._starts.popleft()
+            if len(self._starts) >= settings.FAKE_MODEL_RPM:
+                # Over quota: rejected at once, before any work is done
+                latency, error = 0.0, 429
+            elif error is None:
+                self._starts.append(now)
+        return latency, error
+
+    @contextmanager
+    def track(self):
+        """
+        Count a call as in flight upstream for the duration of the block
+        """
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def create_model(self, model_name: str, generation_config: dict):
+        return FakeModel(self, model_name, generation_config)
+
+    async def embed(self, texts: List[str], task_type: str) -> List[List[float]]:
+        return [_hashed_embedding(text) for text in texts]
+
+def _hashed_embedding(text: str) -> List[float]:
+    """
+    Signed feature hashing of words and word pairs: deterministic, and texts
+    sharing most of their words land close together
+    """
+    vector = [0.0] * settings.EMBEDDING_DIM
+    words = re.findall(r"[a-z0-9.]+", text.lower())
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % settings.EMBEDDING_DIM
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    return vector
+
+BACKENDS = {"gemini": GeminiBackend, "fake": FakeBackend}
+
+def create_backend(name: str = None) -> ModelBackend:
+    name = (name or settings.MODEL_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {name} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
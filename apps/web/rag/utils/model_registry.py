@@ -0,0 +1,52 @@
+import threading
+from typing import Dict, Optional, Tuple
+from ..config import settings
+from .model_backends import ModelBackend, create_backend
+
+class ModelRegistry:
+    """
+    Process-wide cache of configured models keyed by
+    (model_name, generation_config). The backend (Gemini, or the local fake
+    selected by MODEL_BACKEND) is configured once and shared by every
+    model, and with it the underlying connection.
+    """
+    def __init__(self):
+        self._models: Dict[Tuple, object] = {}
+        self._backend: Optional[ModelBackend] = None
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> ModelBackend:
+        self.configure()
+        return self._backend
+
+    def configure(self):
+        with self._lock:
+            if self._backend is None:
+                backend = create_backend()
+                backend.configure()
+                self._backend = backend
+
+    def get(self, model_name: str = None, **generation_config):
+        """
+        Return the shared model for this name and generation config, building it on first use
+        """
+        model_name = model_name or settings.MODEL_NAME
+        key = (model_name, tuple(sorted(generation_config.items())))
+        model = self._models.get(key)
+        if model is None:
+            backend = self.backend
+            with self._lock:
+                model = self._models.get(key)
+                if model is None:
+                    model = backend.create_model(model_name, dict(generation_config))
+                    self._models[key] = model
+        return model
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._backend = None
+
+# Global instance
+model_registry = ModelRegistry()
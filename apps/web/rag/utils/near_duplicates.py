@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from ..config import settings
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes: finds every stored hash within a
+    Hamming radius while visiting only the subtrees the triangle inequality allows
+    """
+    def __init__(self):
+        # Node: [hash, value, {distance: child node}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, key: int, value: Any):
+        self.size += 1
+        if self._root is None:
+            self._root = [key, value, {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, value, {}]
+                return
+            node = child
+
+    def search(self, key: int, radius: int) -> List[Tuple[int, Any]]:
+        """
+        (distance, value) pairs within radius of key, closest first
+        """
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= radius:
+                found.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda match: match[0])
+        return found
+
+class _UserHashes:
+    """
+    One user's recent (hash, result) entries, oldest first, indexed by a BK-tree.
+    BK-trees don't support removal, so the tree is rebuilt when entries leave;
+    with a few dozen entries per user that is cheaper than tombstones.
+    """
+    def __init__(self):
+        self.entries: Deque[Tuple[float, int, Any]] = deque()
+        self.tree = BKTree()
+
+    def _rebuild(self):
+        self.tree = BKTree()
+        for entry in self.entries:
+            self.tree.add(entry[1], entry)
+
+    def prune(self, now: float, ttl: float, capacity: int) -> int:
+        dropped = 0
+        while self.entries and (len(self.entries) > capacity or now - self.entries[0][0] > ttl):
+            self.entries.popleft()
+            dropped += 1
+        if dropped:
+            self._rebuild()
+        return dropped
+
+    def add(self, now: float, key: int, value: Any):
+        entry = (now, key, value)
+        self.entries.append(entry)
+        self.tree.add(key, entry)
+
+class NearDuplicateIndex:
+    """
+    Recent analysis results per user, looked up by perceptual hash so a
+    second, slightly different photo of the same plate reuses the first
+    analysis. Bounded per user and in the number of users (LRU).
+    """
+    def __init__(self, threshold: int, ttl_seconds: float, per_user: int, max_users: int):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.per_user = per_user
+        self.max_users = max_users
+        self._users: "OrderedDict[Tuple[str, str], _UserHashes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+        self.evictions = 0
+
+    def find(self, user_id: str, image_hash: int, version: str) -> Optional[Any]:
+        """
+        The stored result whose hash is closest to image_hash within the threshold, if any
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.lookups += 1
+            hashes = self._users.get((user_id, version))
+            if hashes is None:
+                return None
+            self._users.move_to_end((user_id, version))
+            for _, (created, _, value) in hashes.tree.search(image_hash, self.threshold):
+                if now - created <= self.ttl_seconds:
+                    self.matches += 1
+                    return value
+        return None
+
+    def add(self, user_id: str, image_hash: int, version: str, value: Any):
+        now = time.monotonic()
+        with self._lock:
+            hashes = self._users.get((user_id, version))
+            if hashes is None:
+                hashes = self._users[(user_id, version)] = _UserHashes()
+            self._users.move_to_end((user_id, version))
+            hashes.add(now, image_hash, value)
+            self.evictions += hashes.prune(now, self.ttl_seconds, self.per_user)
+            while len(self._users) > self.max_users:
+                _, dropped = self._users.popitem(last=False)
+                self.evictions += len(dropped.entries)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "matchRatio": self.matches / self.lookups if self.lookups else 0.0,
+            "users": len(self._users),
+            "entries": sum(len(hashes.entries) for hashes in self._users.values()),
+            "evictions": self.evictions,
+            "threshold": self.threshold,
+        }
+
+# Global instance
+near_duplicate_index = NearDuplicateIndex(
+    threshold=settings.NEAR_DUPLICATE_THRESHOLD,
+    ttl_seconds=settings.NEAR_DUPLICATE_TTL,
+    per_user=settings.NEAR_DUPLICATE_PER_USER,
+    max_users=settings.NEAR_DUPLICATE_MAX_USERS
+)
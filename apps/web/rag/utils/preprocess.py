@@ -0,0 +1,155 @@
+import asyncio
+import io
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+import numpy as np
+from ..config import settings
+from .ingestion import open_image
+from .metrics import image_bytes, stage
+
+# PIL is imported inside the functions that decode, so startup doesn't load it
+if TYPE_CHECKING:
+    from PIL import Image
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+def _normalise_mode(image: "Image.Image") -> "Image.Image":
+    """
+    Convert any colour mode (palette, alpha, CMYK, 16-bit...) to plain RGB,
+    flattening transparency onto a white background
+    """
+    from PIL import Image
+
+    if image.mode == "RGB":
+        return image
+    if image.mode == "P":
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+def downscale(image: "Image.Image", max_edge: int) -> "Image.Image":
+    """
+    Shrink an image so its longest edge is at most max_edge. JPEGs are decoded
+    at reduced scale via draft(), then reduce() does cheap integer box
+    downsampling before the final high-quality resize.
+    """
+    from PIL import Image
+
+    if image.format == "JPEG":
+        image.draft("RGB", (max_edge, max_edge))
+
+    longest = max(image.size)
+    if longest <= max_edge:
+        return image
+
+    factor = longest // (2 * max_edge)
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    scale = max_edge / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+def prepare_image(data: bytes, max_edge: Optional[int] = None, image_format: Optional[str] = None,
+                  quality: Optional[int] = None) -> dict:
+    """
+    Turn raw image bytes into a compact blob for vision inference: fix EXIF
+    orientation, downscale, normalise to RGB and re-encode.
+    Returns a {"mime_type", "data"} dict accepted by generate_content.
+    """
+    image_format = (image_format or settings.IMAGE_FORMAT).upper()
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    with stage("preprocess"):
+        return _encode(_decode(data, max_edge), image_format, quality)
+
+def _decode(data: bytes, max_edge: Optional[int] = None) -> "Image.Image":
+    from PIL import ImageOps
+
+    image = open_image(data)
+    image = downscale(image, max_edge or settings.IMAGE_MAX_EDGE)
+    image = ImageOps.exif_transpose(image)
+    return _normalise_mode(image)
+
+def _encode(image: "Image.Image", image_format: str, quality: Optional[int] = None) -> dict:
+    output = io.BytesIO()
+    image.save(output, format=image_format, quality=quality or settings.IMAGE_QUALITY)
+    image_bytes.observe(output.tell(), source="prepared")
+    return {
+        "mime_type": MIME_TYPES[image_format],
+        "data": output.getvalue()
+    }
+
+def prepare_and_hash(data: bytes, method: Optional[str] = None) -> Tuple[dict, int]:
+    """
+    prepare_image and perceptual_hash from a single decode: the hash is taken
+    from the downscaled image before it is re-encoded
+    """
+    with stage("preprocess"):
+        image = _decode(data)
+        prepared = _encode(image, settings.IMAGE_FORMAT.upper())
+    return prepared, image_hash(image, method)
+
+async def prepare_image_async(image: Union[bytes, dict]) -> dict:
+    """
+    prepare_image in a worker thread, since decoding a large photo would stall
+    the event loop. An already prepared image is returned as is.
+    """
+    if isinstance(image, dict):
+        return image
+    return await asyncio.to_thread(prepare_image, image)
+
+def preprocess_version() -> str:
+    """
+    Identifies the preprocessing settings, for use in cache keys
+    """
+    return f"{settings.IMAGE_MAX_EDGE}-{settings.IMAGE_FORMAT.lower()}-q{settings.IMAGE_QUALITY}"
+
+@lru_cache(maxsize=4)
+def _dct_matrix(n: int) -> np.ndarray:
+    # Orthonormal DCT-II basis, so a 2-D DCT is D @ X @ D.T
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+def _thumbnail(image: "Image.Image", size: tuple) -> np.ndarray:
+    from PIL import Image, ImageOps
+
+    image = downscale(image, 4 * max(size))
+    image = ImageOps.exif_transpose(image)
+    image = _normalise_mode(image).convert("L").resize(size, Image.Resampling.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+def perceptual_hash(data: bytes, method: Optional[str] = None) -> int:
+    """
+    64-bit perceptual hash of an image, computed on a small grayscale thumbnail.
+    "dhash" compares neighbouring pixels; "phash" compares the low-frequency
+    DCT coefficients to their median. Near-identical photos differ in few bits.
+    """
+    return image_hash(open_image(data), method)
+
+def image_hash(image: "Image.Image", method: Optional[str] = None) -> int:
+    """
+    perceptual_hash of an already decoded image
+    """
+    method = (method or settings.NEAR_DUPLICATE_HASH).lower()
+    with stage("perceptual_hash"):
+        if method == "dhash":
+            pixels = _thumbnail(image, (9, 8))
+            bits = pixels[:, 1:] > pixels[:, :-1]
+        elif method == "phash":
+            dct = _dct_matrix(32)
+            low = (dct @ _thumbnail(image, (32, 32)) @ dct.T)[:8, :8].ravel()
+            # The DC term only tracks overall brightness
+            bits = low > np.median(low[1:])
+        else:
+            raise ValueError(f"Unsupported perceptual hash: {method}")
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
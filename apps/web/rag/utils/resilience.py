@@ -0,0 +1,288 @@
+"""
+Resilience for upstream model calls: deadlines, retries, hedging and a
+circuit breaker.
+
+- A request deadline is set once per request (deadline()) and read by every
+  model call it makes, including calls in tasks started from it, so no call
+  outlives the request that needs it.
+- Retryable errors (429, 5xx, timeouts, dropped connections) are retried
+  with exponential backoff and full jitter while the deadline allows.
+- A call still running after the observed p95 latency for its kind gets a
+  hedge: a second identical call, first answer wins. Hedges are capped at a
+  fraction of all calls so an upstream slowdown can't double the load.
+  Latency is measured from admission (e.g. getting a call slot), so time
+  queued behind other calls neither skews the p95 nor triggers hedges.
+- After repeated upstream failures the breaker opens and calls fail fast
+  with 503 until a probe call succeeds.
+"""
+import asyncio
+import collections
+import logging
+import math
+import random
+import time
+from contextlib import AbstractAsyncContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Optional
+from fastapi import HTTPException, Request
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self, detail: str = "Request deadline exceeded"):
+        super().__init__(status_code=504, detail=detail)
+
+class UpstreamUnavailable(HTTPException):
+    """
+    The model API kept failing or the circuit breaker is open; rendered as 503 with Retry-After
+    """
+    def __init__(self, detail: str, retry_after: float):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(self.retry_after)})
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Bound everything run in this context to `seconds` from now, or to the
+    enclosing deadline if that is sooner
+    """
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def request_deadline(request: Request):
+    """
+    Deadline for an interactive request: REQUEST_TIMEOUT, or less when the
+    caller propagates its own budget in an X-Request-Timeout header (seconds)
+    """
+    seconds = settings.REQUEST_TIMEOUT
+    header = request.headers.get("x-request-timeout")
+    try:
+        if header:
+            seconds = min(seconds, max(0.0, float(header)))
+    except ValueError:
+        pass
+    return deadline(seconds)
+
+def remaining() -> Optional[float]:
+    """
+    Seconds left before the current deadline, None when there is none
+    """
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
+class LatencyTracker:
+    """
+    Recent successful call latencies per kind of call, for the hedge threshold
+    """
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, collections.deque] = {}
+
+    def record(self, key: str, latency: float):
+        self._samples.setdefault(key, collections.deque(maxlen=self.window)).append(latency)
+
+    def percentile(self, key: str, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples or len(samples) < settings.MODEL_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive upstream failures, fails fast for
+    `cooldown` seconds, then lets a single probe call through
+    """
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def before_call(self) -> bool:
+        """
+        Raise when the breaker is open. Returns True if this call is the half-open probe.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        retry_after = self.cooldown - (time.monotonic() - self.opened_at) if state == "open" else 1
+        raise UpstreamUnavailable("Model API is unavailable, failing fast", retry_after)
+
+    def record_success(self, probe: bool = False):
+        self.failures = 0
+        if probe or self.opened_at is not None:
+            self.opened_at = None
+            self._probing = False
+            logger.info("Model circuit breaker closed")
+
+    def end_probe(self):
+        # The probe ended without telling us anything about upstream health
+        self._probing = False
+
+    def record_failure(self, probe: bool = False):
+        self.failures += 1
+        if probe or (self.opened_at is None and self.failures >= self.threshold):
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+            self._probing = False
+            logger.warning(f"Model circuit breaker opened after {self.failures} failures")
+
+class ResilientCaller:
+    def __init__(self):
+        self.latencies = LatencyTracker()
+        self.breaker = CircuitBreaker(settings.MODEL_BREAKER_THRESHOLD, settings.MODEL_BREAKER_COOLDOWN)
+        self.counters = {"calls": 0, "retries": 0, "hedges": 0, "hedgeWins": 0, "deadlineExceeded": 0, "failed": 0}
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform over [0, base * 2^attempt], capped
+        return random.uniform(0, min(settings.MODEL_RETRY_MAX_DELAY, settings.MODEL_RETRY_BASE_DELAY * 2 ** attempt))
+
+    def _hedge_allowed(self) -> bool:
+        return (settings.MODEL_HEDGE_ENABLED
+                and self.counters["hedges"] < settings.MODEL_HEDGE_BUDGET * max(1, self.counters["calls"]))
+
+    @staticmethod
+    async def _admitted(call: Callable[[], Awaitable], admit: Optional[Callable[[], AbstractAsyncContextManager]],
+                        started: asyncio.Future):
+        async with admit() if admit is not None else nullcontext():
+            if not started.done():
+                started.set_result(time.monotonic())
+            return await call()
+
+    async def _attempt(self, key: str, call: Callable[[], Awaitable], hedge: bool,
+                       admit: Optional[Callable[[], AbstractAsyncContextManager]]):
+        """
+        One logical attempt: the call, plus a hedge if it outlives the observed p95 once admitted
+        """
+        started = asyncio.get_running_loop().create_future()
+        primary = asyncio.ensure_future(self._admitted(call, admit, started))
+        tasks = {primary}
+        try:
+            threshold = self.latencies.percentile(key, 0.95) if hedge else None
+            if threshold is not None:
+                # The hedge timer starts once the call holds its slot, not while it queues
+                await asyncio.wait({primary, started}, return_when=asyncio.FIRST_COMPLETED)
+                if not primary.done():
+                    done, _ = await asyncio.wait(tasks, timeout=threshold)
+                    if not done and self._hedge_allowed():
+                        self.counters["hedges"] += 1
+                        tasks.add(asyncio.ensure_future(
+                            self._admitted(call, admit, asyncio.get_running_loop().create_future())
+                        ))
+
+            while True:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.counters["hedgeWins"] += 1
+                        self.latencies.record(key, time.monotonic() - started.result())
+                        return task.result()
+                    if not tasks:
+                        raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, key: str, call: Callable[[], Awaitable], hedge: bool = True,
+                   admit: Optional[Callable[[], AbstractAsyncContextManager]] = None):
+        """
+        Run call() under the current deadline with retries, hedging and the breaker.
+        call must start a fresh upstream request each time it is invoked; admit,
+        if given, returns the context (e.g. an admission slot) each one runs in.
+        """
+        probe = self.breaker.before_call()
+        self.counters["calls"] += 1
+        try:
+            return await self._call_with_retries(key, call, hedge, admit, probe)
+        finally:
+            if probe:
+                self.breaker.end_probe()
+
+    async def _call_with_retries(self, key: str, call: Callable[[], Awaitable], hedge: bool,
+                                 admit: Optional[Callable[[], AbstractAsyncContextManager]], probe: bool):
+        attempt = 0
+        while True:
+            left = remaining()
+            if left is not None and left <= 0:
+                self.counters["deadlineExceeded"] += 1
+                raise DeadlineExceeded()
+            try:
+                result = await asyncio.wait_for(self._attempt(key, call, hedge, admit), left)
+            except asyncio.TimeoutError:
+                if remaining() is not None and remaining() <= 0:
+                    self.counters["deadlineExceeded"] += 1
+                    raise DeadlineExceeded()
+                error = asyncio.TimeoutError()
+            except HTTPException:
+                # Our own admission/deadline errors, not an upstream failure
+                raise
+            except Exception as e:
+                error = e
+            else:
+                self.breaker.record_success(probe)
+                return result
+
+            if not is_retryable(error):
+                # Upstream answered, just not with a result (e.g. invalid argument)
+                self.breaker.record_success(probe)
+                raise error
+            self.breaker.record_failure(probe)
+            attempt += 1
+            delay = self._backoff(attempt)
+            left = remaining()
+            if probe or attempt >= settings.MODEL_RETRY_ATTEMPTS or (left is not None and delay >= left):
+                self.counters["failed"] += 1
+                raise UpstreamUnavailable(
+                    f"Model API failed after {attempt} attempt(s): {str(error) or type(error).__name__}",
+                    self._backoff(attempt + 1)
+                ) from error
+            self.counters["retries"] += 1
+            logger.warning(f"Retrying model call ({key}) in {delay:.2f}s after: {str(error) or type(error).__name__}")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "breaker": self.breaker.state,
+            "breakerTrips": self.breaker.trips,
+            "hedgeThresholds": {
+                key: round(self.latencies.percentile(key, 0.95), 3)
+                for key in self.latencies._samples
+                if self.latencies.percentile(key, 0.95) is not None
+            },
+        }
+
+# Global instance
+resilience = ResilientCaller()
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+def content_key(data: bytes, version: str) -> str:
+    """
+    Build a cache key from the SHA-256 of the content plus a prompt/model version
+    """
+    return f"{hashlib.sha256(data).hexdigest()}:{version}"
+
+class _DiskTier:
+    """
+    SQLite-backed store that keeps cached results across restarts
+    """
+    def __init__(self, directory: str, ttl_seconds: float):
+        os.makedirs(directory, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "analysis_cache.sqlite3"),
+            check_same_thread=False
+        )
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._conn.commit()
+
+class _InFlight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+class ResultCache:
+    """
+    Two-tier (in-process LRU + optional SQLite) cache for model results.
+    Concurrent requests for the same key share a single computation.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: float, disk_dir: str = "", disk_ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, _InFlight] = {}
+        self._disk = _DiskTier(disk_dir, disk_ttl_seconds) if disk_dir else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() > expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_memory(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self._get_memory(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self._disk is not None:
+            try:
+                value = await asyncio.to_thread(self._disk.get, key)
+            except Exception as e:
+                logger.warning(f"Result cache disk read failed: {str(e)}")
+                value = None
+            if value is not None:
+                self.disk_hits += 1
+                self._set_memory(key, value)
+                return value
+        return None
+
+    async def set(self, key: str, value: Any):
+        self._set_memory(key, value)
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.set, key, value)
+            except Exception as e:
+                logger.warning(f"Result cache disk write failed: {str(e)}")
+
+    async def _compute_and_store(self, key: str, compute: Callable[[], Awaitable[Any]],
+                                 should_cache: Callable[[Any], bool]) -> Any:
+        value = await compute()
+        if should_cache(value):
+            await self.set(key, value)
+        return value
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]],
+                             should_cache: Callable[[Any], bool] = lambda value: True) -> Any:
+        """
+        Return the cached value for key, or run compute() once for all concurrent
+        callers. The shared computation is cancelled only when every caller has gone.
+        """
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = _InFlight(asyncio.ensure_future(self._compute_and_store(key, compute, should_cache)))
+            self._inflight[key] = entry
+            entry.task.add_done_callback(
+                lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is entry else None
+            )
+        else:
+            self.coalesced += 1
+
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.task.done():
+                entry.task.cancel()
+
+    def ttl_remaining(self, key: str) -> float:
+        """
+        Seconds before the in-memory entry for key expires, 0 when there is none
+        """
+        entry = self._entries.get(key)
+        return max(0.0, entry[0] - time.monotonic()) if entry else 0.0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._entries),
+            "inFlight": len(self._inflight),
+            "hitRatio": (lookups - self.misses) / lookups if lookups else 0.0,
+        }
+
+# Global instance
+analysis_cache = ResultCache(
+    max_entries=settings.RESULT_CACHE_SIZE,
+    ttl_seconds=settings.RESULT_CACHE_TTL,
+    disk_dir=settings.RESULT_CACHE_DIR,
+    disk_ttl_seconds=settings.RESULT_CACHE_DISK_TTL
+)
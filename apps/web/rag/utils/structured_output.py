@@ -0,0 +1,113 @@
+import json
+import logging
+import re
+from ..config import settings
+from .llm_client import generate_content
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+REPAIR_PROMPT = """
+            The following text was meant to be a single valid JSON value but could not be parsed.
+            Return ONLY the corrected JSON value, keeping the same fields and values, with no commentary or markdown.
+
+            {text}
+            """
+
+# How model responses were turned into JSON
+parse_stats = {"responses": 0, "direct": 0, "extracted": 0, "repairAttempts": 0, "repaired": 0, "failed": 0}
+
+def json_config(schema) -> dict:
+    """
+    Per-call generation config requesting JSON output that follows a pydantic
+    schema, or nothing when structured output is disabled
+    """
+    if not settings.STRUCTURED_OUTPUT:
+        return {}
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+def _balanced_spans(text: str):
+    """
+    Yield each top-level {...} or [...] span, skipping brackets inside strings
+    """
+    depth, start, in_string, escaped = 0, 0, False, False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"' and depth:
+            in_string = True
+        elif char in "{[":
+            if depth == 0:
+                start = position
+            depth += 1
+        elif char in "}]" and depth:
+            depth -= 1
+            if depth == 0:
+                yield text[start:position + 1]
+
+def extract_json(text: str):
+    """
+    Parse JSON from model output, tolerating markdown fences and
+    surrounding prose by taking the first balanced object or array that parses
+    """
+    text = text.strip()
+    fenced = _FENCE_PATTERN.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+
+    for span in _balanced_spans(text):
+        try:
+            return json.loads(span)
+        except json.JSONDecodeError:
+            continue
+    raise json.JSONDecodeError("No JSON value found", text, 0)
+
+async def parse_json_response(model, text: str, schema=None):
+    """
+    Parse a model's JSON answer. Falls back to tolerant extraction and then a
+    single text-only repair call, which is far cheaper than re-running a
+    vision analysis. Raises json.JSONDecodeError if all of that fails.
+    """
+    parse_stats["responses"] += 1
+    with stage("parse"):
+        try:
+            value = json.loads(text.strip())
+            parse_stats["direct"] += 1
+            return value
+        except json.JSONDecodeError:
+            pass
+
+        try:
+            value = extract_json(text)
+            parse_stats["extracted"] += 1
+            return value
+        except json.JSONDecodeError:
+            pass
+
+    parse_stats["repairAttempts"] += 1
+    logger.warning(f"Repairing unparseable model response: {text[:200]}")
+    try:
+        response = await generate_content(
+            model, REPAIR_PROMPT.format(text=text), generation_config=json_config(schema) if schema else {}
+        )
+        value = extract_json(response.text)
+        parse_stats["repaired"] += 1
+        return value
+    except Exception:
+        parse_stats["failed"] += 1
+        raise
+
+def parse_report() -> dict:
+    responses = parse_stats["responses"]
+    return {
+        **parse_stats,
+        "parseFailureRate": (responses - parse_stats["direct"]) / responses if responses else 0.0,
+        "repairRate": parse_stats["repairAttempts"] / responses if responses else 0.0,
+    }
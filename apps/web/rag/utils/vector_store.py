@@ -0,0 +1,395 @@
+"""
+Embedded vector store: a float32 matrix of unit-length vectors, memory-mapped
+from disk, with each row's id, kind, scope, text and payload in SQLite.
+Searches can be limited to some kinds and some scopes (e.g. one user's rows
+plus the shared "" scope).
+
+- "flat" search scores every row with one matrix-vector product (exact).
+- "ivfpq" clusters the rows into inverted lists with k-means and
+  product-quantises each row's residual to one byte per subvector. A query
+  scans only the nearest lists using lookup tables, then re-ranks the best
+  candidates exactly against the mapped vectors. Below min_train_rows,
+  search stays flat, which is also faster at that size.
+
+Upserts overwrite a row in place by id or append one. The matrix file
+doubles in capacity as it fills. With no directory everything is kept in
+memory. A store locks its directory while open; opening it from a second
+process raises DirectoryInUse.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RERANK_FACTOR = 32
+MAX_TRAIN_ROWS = 20000
+
+def normalise(vectors) -> np.ndarray:
+    """
+    Rows scaled to unit length, so inner product is cosine similarity
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _nearest(data: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    # argmin ||x - c||^2 = argmin ||c||^2 - 2 x.c, in chunks to bound memory
+    squared = (centroids ** 2).sum(axis=1)
+    out = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        out[start:start + chunk] = np.argmin(squared - 2 * data[start:start + chunk] @ centroids.T, axis=1)
+    return out
+
+def kmeans(data: np.ndarray, k: int, iterations: int = 12, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        # Per-cluster sums as one-hot @ data, much faster than np.add.at
+        members = np.zeros((len(data), k), dtype=np.float32)
+        members[np.arange(len(data)), _nearest(data, centroids)] = 1
+        sums = members.T @ data
+        counts = members.sum(axis=0)
+        filled = counts > 0
+        # Empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+class IVFPQIndex:
+    """
+    Inverted lists over k-means centroids with product-quantised residuals.
+    For inner product q.(c + r) = q.c + sum_j q_j.r_j, so one set of lookup
+    tables per query serves every list.
+    """
+    def __init__(self, dim: int, lists: int, subvectors: int):
+        while dim % subvectors:
+            subvectors -= 1
+        self.dim = dim
+        self.lists = lists
+        self.subvectors = subvectors
+        self.centroids: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, dim) -> (subvectors, n, dim / subvectors)
+        return vectors.reshape(len(vectors), self.subvectors, -1).transpose(1, 0, 2)
+
+    def train(self, data: np.ndarray):
+        lists = max(1, min(self.lists, len(data) // 39))
+        self.centroids = kmeans(data, lists)
+        residuals = self._split(data - self.centroids[_nearest(data, self.centroids)])
+        codes = min(256, len(data))
+        self.codebooks = np.stack([kmeans(np.ascontiguousarray(part), codes, iterations=8) for part in residuals])
+
+    def encode(self, vectors: np.ndarray):
+        """
+        (list of each vector, uint8 PQ codes of its residual)
+        """
+        assign = _nearest(vectors, self.centroids)
+        residuals = self._split(vectors - self.centroids[assign])
+        codes = np.stack([_nearest(part, book) for part, book in zip(residuals, self.codebooks)], axis=1)
+        return assign, codes.astype(np.uint8)
+
+    def approximate(self, query: np.ndarray, probes: int, assign: np.ndarray, codes: np.ndarray):
+        """
+        Rows in the `probes` lists nearest the query and their approximate scores
+        """
+        coarse = self.centroids @ query
+        probed = np.argsort(-coarse)[:probes]
+        rows = np.flatnonzero(np.isin(assign, probed))
+        tables = np.einsum("md,mkd->mk", query.reshape(self.subvectors, -1), self.codebooks)
+        scores = coarse[assign[rows]] + tables[np.arange(self.subvectors), codes[rows]].sum(axis=1)
+        return rows, scores
+
+class DirectoryInUse(RuntimeError):
+    """
+    The store directory is open in another process
+    """
+
+def _lock_directory(directory: str):
+    """
+    An exclusive lock on directory, held until the returned file is closed
+    """
+    import fcntl
+
+    handle = open(os.path.join(directory, "lock"), "a")
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        raise DirectoryInUse(f"Vector store {directory} is open in another process")
+    return handle
+
+class VectorStore:
+    def __init__(self, dim: int, directory: str = "", mode: str = "flat", lists: int = 64,
+                 probes: int = 8, subvectors: int = 32, min_train_rows: int = 5000):
+        if mode not in ("flat", "ivfpq"):
+            raise ValueError(f"Unknown vector index mode: {mode} (expected flat or ivfpq)")
+        self.dim = dim
+        self.mode = mode
+        self.lists = lists
+        self.probes = probes
+        self.subvectors = subvectors
+        self.min_train_rows = min_train_rows
+        self._lock = threading.RLock()
+        self._path = os.path.join(directory, "vectors.npy") if directory else None
+        self._lock_file = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._lock_file = _lock_directory(directory)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "entries.sqlite3") if directory else ":memory:",
+            check_same_thread=False
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (id TEXT PRIMARY KEY, row INTEGER NOT NULL, "
+            "kind TEXT NOT NULL, text TEXT NOT NULL, payload TEXT, updated_at REAL NOT NULL, "
+            "scope TEXT NOT NULL DEFAULT '')"
+        )
+        if "scope" not in [column[1] for column in self._conn.execute("PRAGMA table_info(entries)")]:
+            # Stores written before scopes; their rows become shared
+            self._conn.execute("ALTER TABLE entries ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_age ON entries (kind, updated_at)")
+        self._conn.commit()
+
+        entries = self._conn.execute("SELECT id, row, kind, scope FROM entries ORDER BY row").fetchall()
+        self._rows: Dict[str, int] = {id: row for id, row, _, _ in entries}
+        self._count = len(entries)
+        self._kind_codes_by_name: Dict[str, int] = {}
+        self._scope_codes_by_name: Dict[str, int] = {}
+        capacity = max(1024, self._count)
+        if self._path and os.path.exists(self._path):
+            self._vectors = np.load(self._path, mmap_mode="r+")
+            if self._vectors.shape[1] != dim or len(self._vectors) < self._count:
+                raise ValueError(f"Vector file {self._path} doesn't match the store ({self._vectors.shape})")
+            capacity = len(self._vectors)
+        elif self._path:
+            self._vectors = np.lib.format.open_memmap(self._path, "w+", np.float32, (capacity, dim))
+        else:
+            self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._kinds = np.full(capacity, -1, dtype=np.int16)
+        self._scopes = np.full(capacity, -1, dtype=np.int32)
+        for _, row, kind, scope in entries:
+            self._kinds[row] = self._kind_code(kind)
+            self._scopes[row] = self._scope_code(scope)
+
+        # The trained IVF/PQ index, its list assignment and codes per row
+        self.index: Optional[IVFPQIndex] = None
+        self._assign = np.zeros(capacity, dtype=np.int64)
+        self._codes = np.zeros((capacity, 0), dtype=np.uint8)
+        self._trained_rows = 0
+        self._training = False
+        self._changed_while_training = set()
+
+    def _kind_code(self, kind: str) -> int:
+        return self._kind_codes_by_name.setdefault(kind, len(self._kind_codes_by_name))
+
+    def _scope_code(self, scope: str) -> int:
+        return self._scope_codes_by_name.setdefault(scope, len(self._scope_codes_by_name))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._vectors))
+        filled = min(self._count, len(self._vectors))
+        if self._path:
+            # Copy into a larger file, then swap it in
+            temporary = self._path + ".tmp"
+            vectors = np.lib.format.open_memmap(temporary, "w+", np.float32, (capacity, self.dim))
+            vectors[:filled] = self._vectors[:filled]
+            vectors.flush()
+            del vectors
+            self._vectors = None
+            os.replace(temporary, self._path)
+            self._vectors = np.load(self._path, mmap_mode="r+")
+        else:
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            vectors[:filled] = self._vectors[:filled]
+            self._vectors = vectors
+        for name in ("_kinds", "_scopes", "_assign", "_codes"):
+            old = getattr(self, name)
+            new = np.full((capacity,) + old.shape[1:], -1 if name in ("_kinds", "_scopes") else 0, dtype=old.dtype)
+            new[:filled] = old[:filled]
+            setattr(self, name, new)
+
+    def upsert(self, entries: Sequence[dict], vectors):
+        """
+        Insert or replace entries ({"id", "kind", "text", optional "scope" and "payload"}) with their vectors
+        """
+        vectors = normalise(vectors)
+        if vectors.shape != (len(entries), self.dim):
+            raise ValueError(f"Expected {len(entries)} vectors of dimension {self.dim}, got {vectors.shape}")
+        now = time.time()
+        with self._lock:
+            rows = []
+            for entry in entries:
+                row = self._rows.get(entry["id"])
+                if row is None:
+                    row = self._rows[entry["id"]] = self._count
+                    self._count += 1
+                rows.append(row)
+            if self._count > len(self._vectors):
+                self._grow(self._count)
+            self._vectors[rows] = vectors
+            self._kinds[rows] = [self._kind_code(entry["kind"]) for entry in entries]
+            self._scopes[rows] = [self._scope_code(entry.get("scope", "")) for entry in entries]
+            if self.index is not None:
+                self._assign[rows], self._codes[rows] = self.index.encode(vectors)
+            if self._training:
+                self._changed_while_training.update(rows)
+            if self._path:
+                # Vectors reach disk before the rows that point at them
+                self._vectors.flush()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (id, row, kind, text, payload, updated_at, scope) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(entry["id"], row, entry["kind"], entry["text"], json.dumps(entry.get("payload")), now,
+                  entry.get("scope", ""))
+                 for entry, row in zip(entries, rows)]
+            )
+            self._conn.commit()
+
+    def _maybe_train(self):
+        # Train once there are enough rows, and again each time the store
+        # doubles. Training takes seconds, so it runs in the background while
+        # search carries on with the previous index, or flat.
+        if (self.mode != "ivfpq" or self._training or self._count < self.min_train_rows
+                or self._count < 2 * self._trained_rows):
+            return
+        self._training = True
+        self._changed_while_training = set()
+        threading.Thread(target=self._train, name="vector-index-train", daemon=True).start()
+
+    def _train(self):
+        with self._lock:
+            count, vectors = self._count, self._vectors
+        try:
+            sample = np.random.default_rng(0).choice(count, min(count, MAX_TRAIN_ROWS), replace=False)
+            index = IVFPQIndex(self.dim, self.lists, self.subvectors)
+            index.train(np.asarray(vectors[np.sort(sample)]))
+            assign = np.zeros(count, dtype=np.int64)
+            codes = np.zeros((count, index.subvectors), dtype=np.uint8)
+            for start in range(0, count, 8192):
+                end = min(count, start + 8192)
+                assign[start:end], codes[start:end] = index.encode(np.asarray(vectors[start:end]))
+
+            with self._lock:
+                capacity = len(self._vectors)
+                self._assign = np.zeros(capacity, dtype=np.int64)
+                self._codes = np.zeros((capacity, index.subvectors), dtype=np.uint8)
+                self._assign[:count], self._codes[:count] = assign, codes
+                # Rows written since the snapshot
+                rows = sorted(self._changed_while_training | set(range(count, self._count)))
+                if rows:
+                    self._assign[rows], self._codes[rows] = index.encode(np.asarray(self._vectors[rows]))
+                self.index = index
+            logger.info(f"Trained IVF/PQ vector index on {count} rows")
+        except Exception as e:
+            logger.warning(f"Vector index training failed, searching flat: {str(e)}")
+        finally:
+            with self._lock:
+                self._trained_rows = count
+                self._training = False
+
+    def search(self, query, k: int, kinds: Optional[Sequence[str]] = None,
+               scopes: Optional[Sequence[str]] = None) -> List[dict]:
+        """
+        The k entries most similar to query (cosine), optionally of the given
+        kinds and scopes, as dicts with id, kind, scope, text, payload and score
+        """
+        query = normalise(query)[0]
+        with self._lock:
+            if self._count == 0:
+                return []
+            count = self._count
+            allowed = None
+            if kinds is not None:
+                codes = [self._kind_codes_by_name[kind] for kind in kinds if kind in self._kind_codes_by_name]
+                allowed = np.isin(self._kinds[:count], codes)
+            if scopes is not None:
+                codes = [self._scope_codes_by_name[scope] for scope in scopes if scope in self._scope_codes_by_name]
+                in_scope = np.isin(self._scopes[:count], codes)
+                allowed = in_scope if allowed is None else allowed & in_scope
+
+            self._maybe_train()
+            if self.index is not None:
+                rows, approximate = self.index.approximate(query, self.probes, self._assign[:count], self._codes[:count])
+                if allowed is not None:
+                    keep = allowed[rows]
+                    rows, approximate = rows[keep], approximate[keep]
+                shortlist = rows[np.argsort(-approximate)[:k * RERANK_FACTOR]]
+                scores = np.asarray(self._vectors[np.sort(shortlist)]) @ query
+                rows = np.sort(shortlist)
+            else:
+                scores = np.asarray(self._vectors[:count]) @ query
+                rows = np.arange(count)
+                if allowed is not None:
+                    rows, scores = rows[allowed], scores[allowed]
+
+            if len(rows) == 0:
+                return []
+            top = np.argsort(-scores)[:k]
+            found = {int(rows[i]): float(scores[i]) for i in top}
+            placeholders = ",".join("?" * len(found))
+            records = self._conn.execute(
+                f"SELECT id, row, kind, scope, text, payload, updated_at FROM entries WHERE row IN ({placeholders})",
+                list(found)
+            ).fetchall()
+        results = [
+            {"id": id, "kind": kind, "scope": scope, "text": text, "payload": json.loads(payload),
+             "updatedAt": updated_at, "score": found[row]}
+            for id, row, kind, scope, text, payload, updated_at in records
+        ]
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results
+
+    def texts(self, ids: Sequence[str]) -> Dict[str, str]:
+        """
+        Stored text for each of these ids that exists
+        """
+        with self._lock:
+            found = {}
+            for start in range(0, len(ids), 500):
+                batch = list(ids[start:start + 500])
+                found.update(self._conn.execute(
+                    f"SELECT id, text FROM entries WHERE id IN ({','.join('?' * len(batch))})", batch
+                ).fetchall())
+            return found
+
+    def oldest(self, kind: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM entries WHERE kind = ? ORDER BY updated_at LIMIT 1", (kind,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Number of entries of each kind
+        """
+        with self._lock:
+            counts = np.bincount(self._kinds[:self._count].astype(np.int64), minlength=len(self._kind_codes_by_name))
+            return {kind: int(counts[code]) for kind, code in self._kind_codes_by_name.items()}
+
+    def stats(self) -> dict:
+        return {
+            "rows": self._count,
+            "mode": self.mode,
+            "ivfTrained": self.index is not None,
+            "ivfTrainedRows": self._trained_rows if self.index is not None else 0,
+            "ivfTraining": self._training,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._path:
+                self._vectors.flush()
+            self._conn.close()
+            if self._lock_file is not None:
+                self._lock_file.close()